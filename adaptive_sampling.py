@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive choice of pixel intensities for luminance calibration.
+
+Instead of measuring a fixed grid of intensities (e.g. 17 linear steps, two
+repetitions), the luminance model is refitted after each reading, and the
+next reading is taken at the pixel intensity where the prediction of the
+model is most uncertain. Measurement stops when the confidence interval of
+the predicted luminance is narrower than a target accuracy [cd/m^2] across
+the whole range of pixel intensities (or after a maximum number of readings).
+The stopping test is only applied once the residuals have enough degrees of
+freedom for a stable estimate of their variance, and the standard deviation
+of a reading is bounded below by the repeatability of the photometer.
+
+The uncertainty of the prediction is calculated for models that are linear
+in their parameters (e.g. the cubic polynomial, 'poly3', see
+luminance_models.py), from the design matrix and the residual variance.
+
+Validation (simulated readings, and replay of the 2018 measurements):
+
+    python adaptive_sampling.py
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import time
+import numpy as np
+from scipy.stats import t as objDstT
+from luminance_models import dicMdl, funcFit, funcPred
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Model:
+strMdl = 'poly3'
+
+# Target accuracy, half width of the confidence interval of the predicted
+# luminance [cd/m^2]:
+varAcc = 10.0
+
+# Confidence level:
+varCnf = 0.95
+
+# Initial pixel intensities (measured before adaptive sampling):
+tplInit = (-1.0, -0.5, 0.0, 0.5, 1.0)
+
+# Candidate pixel intensities (from which the next reading is chosen):
+vecCnd = np.linspace(-1.0, 1.0, num=201)
+
+# Maximum number of readings (as many as the fixed 17 step x 2 repetition
+# measurement):
+varMaxMsr = 34
+
+# Minimum degrees of freedom of the residuals before the stopping test (with
+# fewer, the residual variance and the t quantile are too unstable):
+varDofMin = 5
+
+# Lower bound of the standard deviation of a reading [cd/m^2], so that
+# sampling does not stop early because a few readings happen to be fitted
+# almost perfectly. Repeatability of the photometer: pooled standard
+# deviation of repeated readings in the 2018 measurements (two repetitions of
+# 17 intensities, both coils, see `funcReplicateSd`):
+varSgmMin = 2.5
+
+# Measurements with repeated readings:
+lstPathRep = [os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'luminance_measurement_20180913', strTmp)
+              for strTmp in ('Luminance_measurement_7T_NOVA_coil.csv',
+                             'Luminance_measurement_7T_vision_coil.csv')]
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcReplicateSd(lstPathCsv=lstPathRep):
+    """
+    Pooled standard deviation of repeated readings (photometer repeatability).
+
+    Parameters
+    ----------
+    lstPathCsv : list
+        Measurement files (csv, see luminance_io.py), with more than one
+        repetition.
+
+    Returns
+    -------
+    varSd : float
+        Pooled standard deviation [cd/m^2] of readings at the same pixel
+        intensity.
+    """
+    from luminance_io import funcReadCsv
+    varSs = 0.0
+    varDof = 0
+    for strPathCsv in lstPathCsv:
+        aryDep = funcReadCsv(strPathCsv)[1]
+        varSs += float(np.sum(np.square(aryDep - np.mean(aryDep, axis=0))))
+        varDof += aryDep.size - aryDep.shape[1]
+    if varDof < 1:
+        raise ValueError('Repeatability requires repeated readings')
+    return np.sqrt(varSs / varDof)
+
+
+def funcPredSd(strMdl, vecX, vecY, vecCnd, varSgmMin=varSgmMin):
+    """
+    Fit model and standard error of its prediction.
+
+    Parameters
+    ----------
+    strMdl : str
+        Model name (key of `luminance_models.dicMdl`), a model with a design
+        matrix ('basis').
+    vecX, vecY : np.ndarray
+        Pixel intensities and luminance of the readings so far.
+    vecCnd : np.ndarray
+        Pixel intensities at which to calculate the standard error.
+    varSgmMin : float
+        Lower bound of the standard deviation of a reading [cd/m^2].
+
+    Returns
+    -------
+    vecPrm : np.ndarray
+        Fitted parameters.
+    vecSe : np.ndarray
+        Standard error of the predicted luminance at `vecCnd` (infinite if
+        there are not more readings than parameters).
+    varDof : int
+        Degrees of freedom of the residuals.
+    """
+    dicTmp = dicMdl[strMdl]
+    dicFit = funcFit(strMdl, vecX, vecY)
+    varDof = dicFit['obs'] - len(dicTmp['prm'])
+
+    if varDof < 1:
+        return dicFit['prm'], np.full(vecCnd.shape, np.inf), varDof
+
+    lgcDom = dicTmp['domain'](vecX)
+    aryDsgn = dicTmp['basis'](vecX[lgcDom])
+    varSgm2 = max((dicFit['rss'] / varDof), (varSgmMin ** 2))
+    aryCov = np.linalg.pinv(np.dot(aryDsgn.T, aryDsgn)) * varSgm2
+
+    with np.errstate(all='ignore'):
+        aryDsgnCnd = dicTmp['basis'](vecCnd)
+    vecSe = np.sqrt(np.einsum('ij,jk,ik->i', aryDsgnCnd, aryCov, aryDsgnCnd))
+    vecSe[~dicTmp['domain'](vecCnd)] = np.nan
+
+    return dicFit['prm'], vecSe, varDof
+
+
+def funcAdaptive(funcMeasure, strMdl=strMdl, varAcc=varAcc, varCnf=varCnf,
+                 vecInit=tplInit, vecCnd=vecCnd, varMaxMsr=varMaxMsr,
+                 varSgmMin=varSgmMin, varDofMin=varDofMin):
+    """
+    Measure luminance at adaptively chosen pixel intensities.
+
+    Parameters
+    ----------
+    funcMeasure : function
+        Takes a pixel intensity, displays it, and returns the measured
+        luminance [cd/m^2] (see `funcPhotometerMeasure`).
+    strMdl : str
+        Model name (key of `luminance_models.dicMdl`), a model with a design
+        matrix ('basis').
+    varAcc : float
+        Target accuracy, half width of the confidence interval of the
+        predicted luminance [cd/m^2].
+    varCnf : float
+        Confidence level.
+    vecInit : array_like
+        Pixel intensities measured first (more than model parameters, so
+        that the uncertainty of the prediction can be estimated before the
+        first adaptive reading).
+    vecCnd : np.ndarray
+        Candidate pixel intensities for adaptive readings.
+    varMaxMsr : int
+        Maximum number of readings.
+    varSgmMin : float
+        Lower bound of the standard deviation of a reading [cd/m^2].
+    varDofMin : int
+        Minimum degrees of freedom of the residuals before measurement can
+        stop.
+
+    Returns
+    -------
+    dicAdp : dict
+        'x', 'y': pixel intensities and luminance of all readings (in the
+        order of measurement); 'prm': fitted parameters; 'half_width':
+        largest half width of the confidence interval after each reading
+        (NaN before the model can be fitted with residual degrees of
+        freedom); 'converged': whether the target accuracy was reached.
+    """
+    if dicMdl[strMdl]['basis'] is None:
+        raise ValueError('Adaptive sampling requires a model that is linear '
+                         + 'in its parameters, not ' + strMdl)
+    vecCnd = np.asarray(vecCnd, dtype=np.float64)
+    varNumPrm = len(dicMdl[strMdl]['prm'])
+    if len(vecInit) <= varNumPrm:
+        raise ValueError('Initial design needs more than ' + str(varNumPrm)
+                         + ' pixel intensities for ' + strMdl)
+
+    lstX = []
+    lstY = []
+    lstHw = []
+    lgcCnv = False
+    lstQue = list(vecInit)
+    vecSe = np.full(vecCnd.shape, np.inf)
+
+    while len(lstX) < varMaxMsr:
+
+        # Next pixel intensity: initial design first, then the candidate with
+        # the most uncertain prediction:
+        if lstQue:
+            varX = float(lstQue.pop(0))
+        else:
+            varX = float(vecCnd[np.nanargmax(vecSe)])
+
+        lstX.append(varX)
+        lstY.append(float(funcMeasure(varX)))
+
+        if len(lstX) < varNumPrm:
+            lstHw.append(np.nan)
+            continue
+
+        vecPrm, vecSe, varDof = funcPredSd(strMdl, np.array(lstX),
+                                           np.array(lstY), vecCnd,
+                                           varSgmMin=varSgmMin)
+        if varDof < 1:
+            lstHw.append(np.nan)
+            continue
+
+        varHw = float(objDstT.ppf(0.5 * (1.0 + varCnf), varDof)
+                      * np.nanmax(vecSe))
+        lstHw.append(varHw)
+
+        if (varHw <= varAcc) and (varDof >= varDofMin) and not lstQue:
+            lgcCnv = True
+            break
+
+    vecX = np.array(lstX)
+    vecY = np.array(lstY)
+
+    return {'x': vecX,
+            'y': vecY,
+            'prm': funcFit(strMdl, vecX, vecY)['prm'],
+            'half_width': np.array(lstHw),
+            'converged': lgcCnv}
+
+
+def funcPhotometerMeasure(objRdr, funcSetPix, varTmeSttl=0.5, varNumSmp=1):
+    """
+    Measurement function for `funcAdaptive`, reading a photometer.
+
+    Parameters
+    ----------
+    objRdr : photometer.PhotometerReader
+        Running photometer reader.
+    funcSetPix : function
+        Sets the pixel intensity of the display (see
+        `photometer.funcAcquire`).
+    varTmeSttl : float
+        Settling time after a change of intensity [s].
+    varNumSmp : int
+        Number of readings averaged per step.
+    """
+    def funcMeasure(varPix):
+        funcSetPix(varPix)
+        varTmeMin = time.perf_counter() + varTmeSttl
+        return float(np.mean(objRdr.get(varTmeMin, varNumSmp=varNumSmp)))
+
+    return funcMeasure
+
+
+def funcReplayMeasure(vecInd, aryDep):
+    """
+    Measurement function for `funcAdaptive`, replaying a recorded session.
+
+    A reading at a pixel intensity returns the recorded luminance at the
+    nearest recorded intensity, cycling through the repetitions when the same
+    intensity is read repeatedly.
+
+    Parameters
+    ----------
+    vecInd : np.ndarray
+        Recorded pixel intensities.
+    aryDep : np.ndarray
+        Recorded luminance, repetitions x levels.
+    """
+    vecCnt = np.zeros(vecInd.size, dtype=np.int64)
+
+    def funcMeasure(varPix):
+        idxLvl = int(np.argmin(np.abs(vecInd - varPix)))
+        varY = aryDep[vecCnt[idxLvl] % aryDep.shape[0], idxLvl]
+        vecCnt[idxLvl] += 1
+        return varY
+
+    return funcMeasure
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Validation
+
+if __name__ == '__main__':
+
+    from luminance_io import funcReadCsv
+    from photometer import (PhotometerReader, SimulatedDisplay,
+                            SimulatedPhotometer)
+
+    vecPrd = np.linspace(-1.0, 1.0, num=201)
+
+    print('Repeatability of readings (pooled standard deviation): '
+          + str(np.around(funcReplicateSd(), 2)) + ' cd/m^2 (lower bound '
+          + 'used: ' + str(varSgmMin) + ' cd/m^2)')
+
+    # Simulated readings, known luminance function (7T, NOVA coil):
+    vecPrmTrue = np.array([-195.9, 246.3, 887.4, 454.4])
+    objDsp = SimulatedDisplay(vecPrmTrue, varTau=0.005)
+    objPht = SimulatedPhotometer(objDsp, varTmeInt=0.01, varSeed=0)
+    with PhotometerReader(objPht) as objRdr:
+        dicAdp = funcAdaptive(funcPhotometerMeasure(objRdr, objDsp.set,
+                                                    varTmeSttl=0.03))
+    varErr = np.max(np.abs(funcPred(strMdl, vecPrd, dicAdp['prm'])
+                           - np.polyval(vecPrmTrue, vecPrd)))
+    print('Simulation: ' + str(dicAdp['x'].size) + ' readings (converged: '
+          + str(dicAdp['converged']) + '), half width '
+          + str(np.around(dicAdp['half_width'][-1], 2))
+          + ' cd/m^2, maximum error from true function '
+          + str(np.around(varErr, 2)) + ' cd/m^2')
+
+    # Replay of recorded sessions (readings are taken from the recorded grid
+    # of 17 intensities, compared with the fit to all 34 readings):
+    for strPathCsv in ['luminance_measurement_20180913/'
+                       + 'Luminance_measurement_7T_NOVA_coil.csv',
+                       'luminance_measurement_20180913/'
+                       + 'Luminance_measurement_7T_vision_coil.csv']:
+        vecInd, aryDep, strTtl = funcReadCsv(strPathCsv)
+        dicAdp = funcAdaptive(funcReplayMeasure(vecInd, aryDep),
+                              vecCnd=vecInd)
+        vecPrmAll = funcFit(strMdl, vecInd, np.mean(aryDep, axis=0))['prm']
+        varErr = np.max(np.abs(funcPred(strMdl, vecPrd, dicAdp['prm'])
+                               - funcPred(strMdl, vecPrd, vecPrmAll)))
+        print(strTtl + ': ' + str(dicAdp['x'].size) + ' of '
+              + str(aryDep.size) + ' readings (converged: '
+              + str(dicAdp['converged']) + '), half width '
+              + str(np.around(dicAdp['half_width'][-1], 2))
+              + ' cd/m^2, maximum difference from fit to all readings '
+              + str(np.around(varErr, 2)) + ' cd/m^2')
+# *****************************************************************************
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of conversion, fitting, loading, and plotting.
+
+Each benchmark runs an operation on reproducible synthetic inputs (fixed
+random seed) of several sizes, from single values to 100 million pixels, and
+from one to 10,000 measurement sessions. For each benchmark and size, the
+time per call (best of several repeats) and the peak memory allocated during
+one call (tracemalloc, main process only) are reported. The benchmarks of
+the original implementations (grid search inverse of get_pix_value.py and
+get_psychopy_vals_contrast.py, polynomial with `np.power`) serve as
+reference for the optimised code paths.
+
+Results are saved as JSON, and compared against a baseline (a results file
+of an earlier run); benchmarks that are slower than the baseline by more than
+a tolerance are reported as regressions.
+
+    python benchmark.py                      # quick sizes
+    python benchmark.py --full               # all sizes (slow, ~5 GB RAM)
+    python benchmark.py -k pix --baseline benchmark_baseline.json
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import fnmatch
+import argparse
+import datetime
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Calibration used for synthetic data (7T, NOVA coil):
+vecPrmBch = np.array([-195.9, 246.3, 887.4, 454.4])
+
+# Seed of random number generator:
+varSeed = 0
+
+# Minimum duration of one timed repeat [s] (fast operations are looped):
+varMinTme = 0.2
+
+# Number of timed repeats (operations slower than `varMaxTme` are timed
+# once):
+varNumRpt = 3
+varMaxTme = 2.0
+
+# Slowdown relative to baseline reported as regression:
+varTolDef = 1.25
+
+# Default output file:
+strPathResDef = 'benchmark_results.json'
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Synthetic inputs
+
+def funcSynthSession(objRng, varNumLvl=17, varNumRep=2):
+    """Synthetic measurement session (calibration `vecPrmBch` plus noise)."""
+    vecInd = np.linspace(-1.0, 1.0, num=varNumLvl)
+    vecCd = np.polyval(vecPrmBch, vecInd)
+    aryDep = vecCd[None, :] + objRng.normal(
+        0.0, (0.01 * np.abs(vecCd) + 0.5), size=(varNumRep, varNumLvl))
+    return vecInd, aryDep
+
+
+def funcSynthArchive(dicCtx, varNumSes):
+    """
+    Directory with synthetic measurement files (created once per run).
+
+    Returns
+    -------
+    strPathDir : str
+        Root directory of the measurement files (100 files per
+        subdirectory).
+    """
+    from luminance_io import funcWriteCsv
+
+    strKey = 'archive_' + str(varNumSes)
+    if strKey not in dicCtx:
+        strPathDir = os.path.join(dicCtx['tmp'], strKey)
+        objRng = np.random.default_rng(varSeed)
+        for idxSes in range(varNumSes):
+            strPathSub = os.path.join(strPathDir, '%04d' % (idxSes // 100))
+            if not os.path.isdir(strPathSub):
+                os.makedirs(strPathSub)
+            vecInd, aryDep = funcSynthSession(objRng)
+            funcWriteCsv(os.path.join(strPathSub, 'Luminance_measurement_'
+                                      + '%05d' % idxSes + '.csv'),
+                         vecInd, aryDep,
+                         'Luminance measurement at 7T, NOVA coil, '
+                         + 'filter = ND.3, date: 13.09.2018')
+        dicCtx[strKey] = strPathDir
+    return dicCtx[strKey]
+
+
+def funcSynthPix(varSze, dtype=np.float32):
+    """Synthetic pixel intensities in [-1, 1]."""
+    objRng = np.random.default_rng(varSeed)
+    return objRng.uniform(-1.0, 1.0, size=varSze).astype(dtype)
+
+
+def funcSynthCd(varSze):
+    """Synthetic target luminances within the range of the display."""
+    from luminance import funcGamut
+    varCdLo, varCdHi = sorted(funcGamut(vecPrmBch)[2:])
+    objRng = np.random.default_rng(varSeed)
+    return objRng.uniform(varCdLo, varCdHi, size=varSze)
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Benchmarks
+#
+# Each benchmark takes the size and a context (dictionary with a temporary
+# directory and inputs shared between benchmarks), prepares its inputs, and
+# returns the operation to time (function without arguments).
+
+def funcBchLum(varSze, dicCtx):
+    """Forward luminance function (Horner, chunked)."""
+    from luminance import funcLum
+    aryPix = funcSynthPix(varSze)
+    aryOut = np.empty(aryPix.shape, dtype=np.float32)
+    return lambda: funcLum(aryPix, vecPrmBch, out=aryOut)
+
+
+def funcBchLumLegacy(varSze, dicCtx):
+    """Forward luminance function with `np.power` (original scripts)."""
+    varA, varB, varC, varD = vecPrmBch
+    aryPix = funcSynthPix(varSze, dtype=np.float64)
+    return lambda: (varA * np.power(aryPix, 3.0) + varB * np.power(aryPix, 2.0)
+                    + varC * np.power(aryPix, 1.0) + varD)
+
+
+def funcBchPix(varSze, dicCtx):
+    """Exact inverse (bracketed Newton)."""
+    from luminance import funcPix
+    aryCd = funcSynthCd(varSze)
+    return lambda: funcPix(aryCd, vecPrmBch)
+
+
+def funcBchPixLut(varSze, dicCtx):
+    """Inverse with 16 bit lookup table."""
+    from luminance_lut import funcLutApply, funcLutLoad, funcLutSlope
+    vecLut, varLo, varHi = funcLutLoad(vecPrmBch, varBit=16,
+                                       strPathCache=dicCtx['tmp'])
+    vecLut = np.array(vecLut)
+    vecSlp = funcLutSlope(vecLut)
+    aryCd = funcSynthCd(varSze)
+    aryOut = np.empty(aryCd.shape, dtype=np.float32)
+    return lambda: funcLutApply(aryCd, vecLut, varLo, varHi, out=aryOut,
+                                vecSlp=vecSlp)
+
+
+def funcBchPixInterp(varSze, dicCtx):
+    """Inverse of monotone interpolant (pchip, 17 knots)."""
+    from luminance_interp import funcInterpFit, funcInterpPix
+    vecInd = np.linspace(-1.0, 1.0, num=17)
+    dicItp = funcInterpFit(vecInd, np.polyval(vecPrmBch, vecInd))
+    aryCd = np.clip(funcSynthCd(varSze), dicItp['y'][0], dicItp['y'][-1])
+    return lambda: funcInterpPix(aryCd, dicItp)
+
+
+def funcBchPixLegacy(varSze, dicCtx):
+    """Grid search inverse, one target at a time (get_pix_value.py)."""
+    varA, varB, varC, varD = vecPrmBch
+    vecCd = funcSynthCd(varSze)
+
+    def funcRun():
+        vecX = np.linspace(-1.0, 1.0, 10000)
+        vecPix = np.empty(vecCd.size)
+        for idxCd, varCd in enumerate(vecCd):
+            vecDiff = np.ones(10000)
+            for idx01, varTmpX in enumerate(vecX):
+                varTmpY = (varA * np.power(varTmpX, 3.0)
+                           + varB * np.power(varTmpX, 2.0)
+                           + varC * np.power(varTmpX, 1.0) + varD)
+                vecDiff[idx01] = np.abs(varTmpY - varCd)
+            vecPix[idxCd] = vecX[np.argmin(vecDiff)]
+        return vecPix
+
+    return funcRun
+
+
+def funcBchContrast(varSze, dicCtx):
+    """Michelson contrast to pixel intensities (exact inverse)."""
+    from contrast import funcCntrPix
+    objRng = np.random.default_rng(varSeed)
+    vecCntr = objRng.uniform(0.0, 0.9, size=varSze)
+    return lambda: funcCntrPix(vecCntr, vecPrmBch)
+
+
+def funcBchContrastLegacy(varSze, dicCtx):
+    """Grid search contrast (get_psychopy_vals_contrast.py)."""
+    # Coefficients in ascending order, as in the original script:
+    b0, b1, b2, b3 = vecPrmBch[::-1]
+    objRng = np.random.default_rng(varSeed)
+    vecCntr = objRng.uniform(0.0, 0.9, size=varSze)
+
+    def calc_cntr(x):
+        # Original implementation (get_psychopy_vals_contrast.py):
+        I1 = b3 * np.power(x, 3.0) + b2 * np.power(x, 2.0) + b1 * x + b0
+        I2 = b3 * np.power(-x, 3.0) + b2 * np.power(-x, 2.0) + b1 * -x + b0
+        return (I1 - I2) / (I1 + I2)
+
+    def funcRun():
+        vecOut = np.empty(vecCntr.size)
+        vecX = np.linspace(0.0, 1.0, 10000)
+        for idxCntr, varTrg in enumerate(vecCntr):
+            vecDiff = np.ones(10000)
+            for idx01, varTmpX in enumerate(vecX):
+                vecDiff[idx01] = np.abs(calc_cntr(varTmpX) - varTrg)
+            vecOut[idxCntr] = vecX[np.argmin(vecDiff)]
+        return vecOut
+
+    return funcRun
+
+
+def funcBchFitModels(varSze, dicCtx):
+    """Fit of all models to sessions (serial)."""
+    from luminance_models import dicMdl, funcFit
+    objRng = np.random.default_rng(varSeed)
+    lstSes = [funcSynthSession(objRng) for _ in range(varSze)]
+
+    def funcRun():
+        for vecInd, aryDep in lstSes:
+            vecDepAvg = np.mean(aryDep, axis=0)
+            for strMdl in dicMdl:
+                funcFit(strMdl, vecInd, vecDepAvg)
+
+    return funcRun
+
+
+def funcBchFitBatch(varSze, dicCtx):
+    """Batch fit of measurement files (process pool)."""
+    from fit_luminance_batch import funcFitBatch
+    from luminance_io import funcFindCsv
+    lstPathCsv = funcFindCsv(funcSynthArchive(dicCtx, varSze))
+    return lambda: funcFitBatch(lstPathCsv)
+
+
+def funcBchLoadCold(varSze, dicCtx):
+    """Load archive of measurement files, without cache."""
+    from luminance_io import funcLoadArchive
+    strPathIn = funcSynthArchive(dicCtx, varSze)
+    strPathCache = os.path.join(dicCtx['tmp'], 'cache_cold')
+
+    def funcRun():
+        shutil.rmtree(strPathCache, ignore_errors=True)
+        return funcLoadArchive(strPathIn, strPathCache=strPathCache)
+
+    return funcRun
+
+
+def funcBchLoadWarm(varSze, dicCtx):
+    """Load archive of measurement files, from cache."""
+    from luminance_io import funcLoadArchive
+    strPathIn = funcSynthArchive(dicCtx, varSze)
+    strPathCache = os.path.join(dicCtx['tmp'], 'cache_warm')
+    funcLoadArchive(strPathIn, strPathCache=strPathCache)
+    return lambda: funcLoadArchive(strPathIn, strPathCache=strPathCache)
+
+
+def funcBchPlot(varSze, dicCtx):
+    """Render summary figures (one per session, serial)."""
+    from fit_luminance_batch import funcFitBatch, funcPlotSessions
+    from luminance_io import funcFindCsv
+    from luminance_plot import funcRenderBatch
+    strPathIn = funcSynthArchive(dicCtx, varSze)
+    strPathPlt = os.path.join(dicCtx['tmp'], 'plots_' + str(varSze))
+    if not os.path.isdir(strPathPlt):
+        os.makedirs(strPathPlt)
+    lstSes = funcPlotSessions(funcFitBatch(funcFindCsv(strPathIn), varPar=1),
+                              strPathPlt, strPathIn=strPathIn)
+    return lambda: funcRenderBatch(lstSes, varPar=1)
+
+
+# Benchmarks with sizes (quick run, and additional sizes of full run):
+dicBch = {
+    'lum': (funcBchLum, (1, 1000, 10 ** 6), (10 ** 7, 10 ** 8)),
+    'lum_legacy': (funcBchLumLegacy, (1, 1000, 10 ** 6), (10 ** 7, 10 ** 8)),
+    'pix': (funcBchPix, (1, 1000, 10 ** 6), (10 ** 7,)),
+    'pix_lut16': (funcBchPixLut, (1, 1000, 10 ** 6), (10 ** 7, 10 ** 8)),
+    'pix_interp': (funcBchPixInterp, (1, 1000, 10 ** 6), (10 ** 7,)),
+    'pix_legacy': (funcBchPixLegacy, (1,), (10,)),
+    'contrast': (funcBchContrast, (1, 1000, 10 ** 6), (10 ** 7,)),
+    'contrast_legacy': (funcBchContrastLegacy, (1,), (10,)),
+    'fit_models': (funcBchFitModels, (1, 10), (100,)),
+    'fit_batch': (funcBchFitBatch, (1, 100), (1000, 10000)),
+    'load_cold': (funcBchLoadCold, (1, 100), (1000, 10000)),
+    'load_warm': (funcBchLoadWarm, (1, 100), (1000, 10000)),
+    'plot': (funcBchPlot, (1, 10), (100,)),
+}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcTime(funcRun):
+    """
+    Time an operation.
+
+    Fast operations are looped, so that one timed repeat lasts at least
+    `varMinTme`. The best of `varNumRpt` repeats is reported (slow operations
+    are timed once).
+
+    Returns
+    -------
+    varTme : float
+        Time per call [s].
+    varNumLoop : int
+        Number of calls per repeat.
+    """
+    varNumLoop = 1
+    while True:
+        varTme = time.perf_counter()
+        for _ in range(varNumLoop):
+            funcRun()
+        varTme = time.perf_counter() - varTme
+        if (varTme >= varMinTme) or (varNumLoop >= 10 ** 6):
+            break
+        varNumLoop *= 10
+
+    lstTme = [varTme]
+    if varTme < varMaxTme:
+        for _ in range(varNumRpt - 1):
+            varTmp = time.perf_counter()
+            for _ in range(varNumLoop):
+                funcRun()
+            lstTme.append(time.perf_counter() - varTmp)
+
+    return min(lstTme) / varNumLoop, varNumLoop
+
+
+def funcPeakMem(funcRun):
+    """Peak memory allocated during one call [MB] (tracemalloc)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        varBse = tracemalloc.get_traced_memory()[0]
+        funcRun()
+        varPk = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return (varPk - varBse) / 2.0 ** 20
+
+
+def funcRun(lstBch=None, lgcFull=False, funcLog=None):
+    """
+    Run benchmarks.
+
+    Parameters
+    ----------
+    lstBch : list, optional
+        Names of benchmarks (default: all, see `dicBch`).
+    lgcFull : bool
+        Whether to run all sizes (default: quick sizes only).
+    funcLog : function, optional
+        Called with each result (e.g. to print progress).
+
+    Returns
+    -------
+    dicRes : dict
+        'meta': system information; 'results': list of results (benchmark,
+        size, time per call [s], calls per repeat, peak memory [MB]).
+    """
+    if lstBch is None:
+        lstBch = list(dicBch.keys())
+
+    dicRes = {'meta': {'date': datetime.datetime.now().isoformat(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.machine(),
+                       'platform': platform.platform(),
+                       'cpus': os.cpu_count(),
+                       'full': lgcFull},
+              'results': []}
+
+    strPathTmp = tempfile.mkdtemp(prefix='psychophysics_benchmark_')
+    dicCtx = {'tmp': strPathTmp}
+    try:
+        for strBch in lstBch:
+            funcBch, tplSze, tplSzeFull = dicBch[strBch]
+            for varSze in (tplSze + (tplSzeFull if lgcFull else ())):
+                funcTmp = funcBch(varSze, dicCtx)
+                varTme, varNumLoop = funcTime(funcTmp)
+                dicTmp = {'benchmark': strBch,
+                          'size': varSze,
+                          'time': varTme,
+                          'loops': varNumLoop,
+                          'peak_mb': funcPeakMem(funcTmp)}
+                dicRes['results'].append(dicTmp)
+                if funcLog is not None:
+                    funcLog(dicTmp)
+                del funcTmp
+                gc.collect()
+    finally:
+        shutil.rmtree(strPathTmp, ignore_errors=True)
+
+    return dicRes
+
+
+def funcCompare(dicRes, dicBse, varTol=varTolDef):
+    """
+    Compare results with a baseline.
+
+    Returns
+    -------
+    lstCmp : list
+        One dictionary per benchmark and size present in both: benchmark,
+        size, time, baseline time, ratio (time / baseline time), and whether
+        it is a regression (ratio above `varTol`).
+    """
+    dicTmp = {(dicRow['benchmark'], dicRow['size']): dicRow['time']
+              for dicRow in dicBse['results']}
+    lstCmp = []
+    for dicRow in dicRes['results']:
+        tplKey = (dicRow['benchmark'], dicRow['size'])
+        if tplKey not in dicTmp:
+            continue
+        varRat = dicRow['time'] / dicTmp[tplKey]
+        lstCmp.append({'benchmark': dicRow['benchmark'],
+                       'size': dicRow['size'],
+                       'time': dicRow['time'],
+                       'baseline': dicTmp[tplKey],
+                       'ratio': varRat,
+                       'regression': varRat > varTol})
+    return lstCmp
+
+
+def funcFormat(dicRow):
+    """One line per result."""
+    strLne = ('%-16s %12d %12.3e s %10.3f MB'
+              % (dicRow['benchmark'], dicRow['size'], dicRow['time'],
+                 dicRow['peak_mb']))
+    if dicRow['size'] > 1:
+        strLne += '  (%.3e s per item)' % (dicRow['time'] / dicRow['size'])
+    return strLne
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Run benchmarks
+
+if __name__ == '__main__':
+
+    objParser = argparse.ArgumentParser(description='Run benchmarks.')
+    objParser.add_argument('-k', '--select', nargs='+', default=None,
+                           help='Benchmarks to run (glob patterns, default: '
+                           + 'all): ' + ', '.join(dicBch))
+    objParser.add_argument('--full', action='store_true',
+                           help='Run all sizes (up to 1e8 pixels and 10000 '
+                           + 'sessions).')
+    objParser.add_argument('-o', '--output', default=strPathResDef,
+                           help='Results file (JSON, default: '
+                           + strPathResDef + ').')
+    objParser.add_argument('--baseline', default=None,
+                           help='Results file of an earlier run to compare '
+                           + 'with.')
+    objParser.add_argument('--tolerance', type=float, default=varTolDef,
+                           help='Slowdown reported as regression (default: '
+                           + str(varTolDef) + ').')
+    objArgs = objParser.parse_args()
+
+    lstBch = [strBch for strBch in dicBch
+              if (objArgs.select is None)
+              or any(fnmatch.fnmatch(strBch, strTmp)
+                     for strTmp in objArgs.select)]
+
+    print('%-16s %12s %14s %13s' % ('benchmark', 'size', 'time', 'peak'))
+    dicRes = funcRun(lstBch, lgcFull=objArgs.full,
+                     funcLog=lambda dicRow: print(funcFormat(dicRow),
+                                                  flush=True))
+
+    with open(objArgs.output, 'w') as objFle:
+        json.dump(dicRes, objFle, indent=1)
+    print('Results saved to: ' + objArgs.output)
+
+    if objArgs.baseline is not None:
+        with open(objArgs.baseline, 'r') as objFle:
+            dicBse = json.load(objFle)
+        lstCmp = funcCompare(dicRes, dicBse, varTol=objArgs.tolerance)
+        print('Comparison with ' + objArgs.baseline + ' (time / baseline):')
+        for dicRow in lstCmp:
+            print('%-16s %12d %8.2f%s'
+                  % (dicRow['benchmark'], dicRow['size'], dicRow['ratio'],
+                     ('  REGRESSION' if dicRow['regression'] else '')))
+        if any(dicRow['regression'] for dicRow in lstCmp):
+            sys.exit(1)
+# *****************************************************************************
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+"""
+Drift of luminance calibrations over time.
+
+All calibrations of the calibration store (see calibration_store.py) are
+loaded into columnar arrays (one entry per calibration, coefficients as
+calibrations x coefficients), and all luminance functions are evaluated on a
+common grid of pixel intensities at once (one matrix product of the
+coefficients with the Vandermonde matrix of the grid).
+
+For each calibration, the luminance function is compared with the previous
+calibration of the same display configuration (display, coil, and filter),
+and with the first calibration of that configuration (reference):
+
+- change of black level and of maximum luminance [cd/m^2] (minimum and
+  maximum of the curve over the grid; fitted curves are not necessarily
+  monotonic, e.g. the cubic of the NOVA coil has its minimum at about -0.88,
+  not at -1),
+- mean and maximum absolute deviation between the curves over the grid
+  [cd/m^2].
+
+Calibrations deviating from the previous calibration by more than a
+tolerance are flagged (e.g. after the replacement of the projection mirror,
+see luminance_measurement_20180913/info.txt, or a failing projector lamp).
+
+Report of the calibration store:
+
+    python calibration_drift.py
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import numpy as np
+from calibration_store import funcCheckMdl, funcStoreLoad, funcTime, tplKey
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Grid of pixel intensities on which calibrations are compared:
+vecGrdDef = np.linspace(-1.0, 1.0, num=201)
+
+# Tolerance, maximum deviation from the previous calibration [cd/m^2]:
+varTolDrf = 10.0
+
+# Columns of the drift table:
+lstColDrf = (list(tplKey)
+             + ['date', 'model', 'days_prev', 'black', 'white',
+                'delta_black', 'delta_white', 'mean_dev_prev',
+                'max_dev_prev', 'max_dev_ref', 'flag'])
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcDriftLoad(strPathStore=None):
+    """
+    Load all calibrations of the store into columnar arrays.
+
+    Parameters
+    ----------
+    strPathStore : str, optional
+        Directory of the calibration store (default:
+        `calibration_store.strPathStoreDef`).
+
+    Returns
+    -------
+    dicCol : dict
+        Arrays with one entry per calibration, sorted by display
+        configuration and date: 'display', 'coil', 'filter', 'model' (str),
+        'date' (`np.datetime64`), 'cfg' (index of the display configuration),
+        'coef' (calibrations x coefficients, highest degree first, aligned at
+        the constant term and zero-padded, so that all rows are polynomials
+        of the same degree), 'ncoef' (number of coefficients).
+
+    Raises
+    ------
+    ValueError
+        If a calibration is not a polynomial (see
+        `calibration_store.funcCheckMdl`).
+    """
+    dicStore = funcStoreLoad(strPathStore)
+    lstIdx = dicStore['index']
+    varNumCal = len(lstIdx)
+    for dicRec in lstIdx:
+        funcCheckMdl(dicRec['model'], dicRec['ncoef'])
+
+    dicCol = {strKey: np.array([dicRec[strKey] for dicRec in lstIdx],
+                               dtype=str).reshape(varNumCal)
+              for strKey in (tplKey + ('model',))}
+    dicCol['date'] = np.array([funcTime(dicRec['date'])
+                               for dicRec in lstIdx],
+                              dtype='datetime64[s]').reshape(varNumCal)
+
+    # Coefficients aligned at the constant term (NaN padding of the store
+    # replaced by leading zeros):
+    aryRaw = np.asarray(dicStore['coef'])
+    vecNumCoef = np.array([dicRec['ncoef'] for dicRec in lstIdx],
+                          dtype=np.int64)
+    vecRow = np.array([dicRec['row'] for dicRec in lstIdx], dtype=np.int64)
+    varMaxCoef = int(np.max(vecNumCoef)) if varNumCal > 0 else 1
+    aryCoef = np.zeros((varNumCal, varMaxCoef))
+    for varNumCoef in np.unique(vecNumCoef):
+        lgcTmp = vecNumCoef == varNumCoef
+        aryCoef[lgcTmp, (varMaxCoef - varNumCoef):] = \
+            aryRaw[vecRow[lgcTmp], :varNumCoef]
+    dicCol['coef'] = aryCoef
+    dicCol['ncoef'] = vecNumCoef
+
+    # Display configurations, and order by configuration and date:
+    lstCfg = ['\t'.join(tplTmp) for tplTmp in zip(*[dicCol[strKey]
+                                                    for strKey in tplKey])]
+    _, vecCfg = np.unique(np.array(lstCfg, dtype=str).reshape(varNumCal),
+                          return_inverse=True)
+    vecSrt = np.lexsort((dicCol['date'], vecCfg))
+    dicCol['cfg'] = vecCfg.reshape(varNumCal)
+    for strKey in list(dicCol.keys()):
+        dicCol[strKey] = dicCol[strKey][vecSrt]
+
+    return dicCol
+
+
+def funcDriftCurves(dicCol, vecGrd=vecGrdDef):
+    """
+    Luminance functions of all calibrations on a common grid.
+
+    Parameters
+    ----------
+    dicCol : dict
+        Calibrations (see `funcDriftLoad`).
+    vecGrd : np.ndarray
+        Pixel intensities.
+
+    Returns
+    -------
+    aryLum : np.ndarray
+        Luminance [cd/m^2], calibrations x grid.
+    """
+    vecGrd = np.asarray(vecGrd, dtype=np.float64)
+    aryLum = np.dot(dicCol['coef'],
+                    np.vander(vecGrd, dicCol['coef'].shape[1]).T)
+
+    return aryLum
+
+
+def funcDrift(dicCol, vecGrd=vecGrdDef, varTol=varTolDrf):
+    """
+    Drift of each calibration relative to the previous and first calibration
+    of its display configuration.
+
+    Parameters
+    ----------
+    dicCol : dict
+        Calibrations (see `funcDriftLoad`).
+    vecGrd : np.ndarray
+        Pixel intensities on which curves are compared (the minimum and
+        maximum of each curve over the grid are its black level and maximum
+        luminance).
+    varTol : float
+        Tolerance, maximum deviation from the previous calibration
+        [cd/m^2].
+
+    Returns
+    -------
+    dicDrf : dict
+        Arrays with one entry per calibration (order of `dicCol`): 'prev'
+        (index of the previous calibration, -1 for the first calibration of
+        a configuration), 'ref' (index of the first calibration of the
+        configuration), 'days_prev', 'black' and 'white' (minimum and
+        maximum luminance of the curve over the grid), 'delta_black' and
+        'delta_white' (change from the previous calibration),
+        'mean_dev_prev', 'max_dev_prev', 'max_dev_ref', and
+        'flag' (deviation from previous calibration exceeds `varTol`).
+        Deviations and changes are NaN for the first calibration of a
+        configuration.
+    """
+    aryLum = funcDriftCurves(dicCol, vecGrd=vecGrd)
+    vecCfg = dicCol['cfg']
+    varNumCal = vecCfg.size
+
+    # Previous and first calibration of the same configuration (calibrations
+    # are sorted by configuration and date):
+    lgcFst = np.ones(varNumCal, dtype=bool)
+    lgcFst[1:] = vecCfg[1:] != vecCfg[:-1]
+    vecIdx = np.arange(varNumCal)
+    vecPrv = np.where(lgcFst, -1, vecIdx - 1)
+    vecRef = np.maximum.accumulate(np.where(lgcFst, vecIdx, 0))
+
+    aryDevPrv = aryLum - aryLum[np.maximum(vecPrv, 0)]
+    aryDevPrv[lgcFst] = np.nan
+    aryDevRef = np.abs(aryLum - aryLum[vecRef])
+    aryDevRef[lgcFst] = np.nan
+
+    vecDay = ((dicCol['date'] - dicCol['date'][np.maximum(vecPrv, 0)])
+              / np.timedelta64(1, 'D'))
+    vecDay[lgcFst] = np.nan
+
+    # Black level and maximum luminance:
+    vecBlk = np.min(aryLum, axis=1)
+    vecWht = np.max(aryLum, axis=1)
+    vecDltBlk = vecBlk - vecBlk[np.maximum(vecPrv, 0)]
+    vecDltBlk[lgcFst] = np.nan
+    vecDltWht = vecWht - vecWht[np.maximum(vecPrv, 0)]
+    vecDltWht[lgcFst] = np.nan
+
+    with np.errstate(invalid='ignore'):
+        vecMaxPrv = np.max(np.abs(aryDevPrv), axis=1)
+        return {'prev': vecPrv,
+                'ref': vecRef,
+                'days_prev': vecDay,
+                'black': vecBlk,
+                'white': vecWht,
+                'delta_black': vecDltBlk,
+                'delta_white': vecDltWht,
+                'mean_dev_prev': np.mean(np.abs(aryDevPrv), axis=1),
+                'max_dev_prev': vecMaxPrv,
+                'max_dev_ref': np.max(aryDevRef, axis=1),
+                'flag': vecMaxPrv > varTol}
+
+
+def funcPairwise(aryLum, varChnk=256):
+    """
+    Maximum absolute deviation between all pairs of curves [cd/m^2].
+
+    Parameters
+    ----------
+    aryLum : np.ndarray
+        Luminance, calibrations x grid (see `funcDriftCurves`).
+    varChnk : int
+        Number of calibrations compared at once (limits memory).
+
+    Returns
+    -------
+    aryDev : np.ndarray
+        Calibrations x calibrations.
+    """
+    varNumCal = aryLum.shape[0]
+    aryDev = np.empty((varNumCal, varNumCal))
+    for idxStr in range(0, varNumCal, varChnk):
+        aryDev[idxStr:idxStr + varChnk] = np.max(
+            np.abs(aryLum[idxStr:idxStr + varChnk, None, :]
+                   - aryLum[None, :, :]), axis=2)
+    return aryDev
+
+
+def funcDriftRows(dicCol, dicDrf):
+    """
+    Drift table, one dictionary per calibration (see `lstColDrf`, and
+    `luminance_io.funcSaveTable`).
+    """
+    lstRow = []
+    for idxCal in range(dicCol['cfg'].size):
+        dicRow = {strKey: str(dicCol[strKey][idxCal])
+                  for strKey in (tplKey + ('model',))}
+        dicRow['date'] = str(dicCol['date'][idxCal])
+        for strKey in lstColDrf:
+            if strKey in dicDrf:
+                dicRow[strKey] = dicDrf[strKey][idxCal].item()
+        lstRow.append(dicRow)
+    return lstRow
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Report of the calibration store, and timing on a synthetic store
+
+if __name__ == '__main__':
+
+    import os
+    import time
+    import json
+    import tempfile
+
+    dicCol = funcDriftLoad()
+    dicDrf = funcDrift(dicCol)
+    for dicRow in funcDriftRows(dicCol, dicDrf):
+        print(dicRow['date'][:10] + '  ' + dicRow['display'] + ', '
+              + dicRow['coil'] + ' coil, filter = ' + dicRow['filter']
+              + ': black ' + ('%.1f' % dicRow['black']) + ' cd/m^2, white '
+              + ('%.1f' % dicRow['white']) + ' cd/m^2, maximum deviation '
+              + 'from previous calibration '
+              + ('%.1f' % dicRow['max_dev_prev']) + ' cd/m^2'
+              + (' (FLAG)' if dicRow['flag'] else ''))
+
+    # Synthetic store: weekly calibrations of two coils over ten years, lamp
+    # ageing (slow loss of luminance), and a replaced mirror after five
+    # years:
+    objRng = np.random.default_rng(0)
+    vecPrm = np.array([-195.9, 246.3, 887.4, 454.4])
+    vecDate = (np.datetime64('2018-09-13')
+               + np.arange(0, 3650, 7).astype('timedelta64[D]'))
+    lstIdx = []
+    lstCoef = []
+    for strCoil in ('NOVA', 'vision'):
+        for varDay, varDate in enumerate(vecDate):
+            varGain = 1.0 - 0.00005 * varDay * 7 + objRng.normal(0.0, 0.001)
+            if varDate >= np.datetime64('2023-09-13'):
+                varGain *= 0.95
+            lstIdx.append({'display': '7T', 'coil': strCoil,
+                           'filter': 'ND.3', 'date': str(varDate),
+                           'model': 'poly3', 'note': 'synthetic',
+                           'row': len(lstIdx), 'ncoef': 4})
+            lstCoef.append(vecPrm * varGain)
+
+    with tempfile.TemporaryDirectory() as strPathTmp:
+        np.save(os.path.join(strPathTmp, 'coefficients.npy'),
+                np.array(lstCoef))
+        with open(os.path.join(strPathTmp, 'index.json'), 'w') as objFle:
+            json.dump(lstIdx, objFle)
+
+        varTme = time.perf_counter()
+        dicCol = funcDriftLoad(strPathTmp)
+        dicDrf = funcDrift(dicCol)
+        varTme = time.perf_counter() - varTme
+
+    print(str(len(lstIdx)) + ' synthetic calibrations analysed in '
+          + str(np.around(varTme * 1000.0, 1)) + ' ms')
+    for idxCal in np.flatnonzero(dicDrf['flag']):
+        print('Flagged: ' + dicCol['coil'][idxCal] + ' coil, '
+              + str(dicCol['date'][idxCal])[:10] + ', maximum deviation '
+              + ('%.1f' % dicDrf['max_dev_prev'][idxCal]) + ' cd/m^2')
+    print('Maximum deviation from first calibration: '
+          + ('%.1f' % np.nanmax(dicDrf['max_dev_ref'])) + ' cd/m^2')
+# *****************************************************************************
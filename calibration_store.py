@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk store of luminance calibrations.
+
+Each calibration is the fitted luminance function (polynomial coefficients,
+highest degree first) of one display, coil, and neutral density filter,
+measured at a given date. The store is a directory with
+
+- `index.json`: one record per calibration (display, coil, filter, date,
+  model, note, and row in the coefficient array),
+- `coefficients.npy`: coefficients of all calibrations (calibrations x
+  coefficients, NaN-padded), loaded memory-mapped,
+- `lut/`: lookup tables of the calibrations (see luminance_lut.py).
+
+The index is loaded once per process (and reloaded only if it changes on
+disk). A query returns the calibration that applies at a given time, i.e. the
+most recent calibration measured at or before that time.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import json
+import datetime
+import tempfile
+import numpy as np
+from luminance_lut import funcLutLoad
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Default calibration store (distributed with this repository):
+strPathStoreDef = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'calibrations')
+
+# Fields identifying a display configuration:
+tplKey = ('display', 'coil', 'filter')
+
+# Loaded stores (path: (modification time and size of index, store)):
+dicStoreCache = {}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcTime(varTime=None):
+    """
+    Convert a time to `np.datetime64` (seconds).
+
+    Parameters
+    ----------
+    varTime : str, datetime.datetime, np.datetime64, or None
+        Time, e.g. '2018-09-13' or '2018-09-13T14:30'. None for the current
+        (local) time.
+    """
+    if varTime is None:
+        return np.datetime64(datetime.datetime.now(), 's')
+    return np.datetime64(varTime, 's')
+
+
+def funcWriteAtomic(strPath, funcWrite):
+    """Write file via temporary file (readers never see a partial file)."""
+    strPathDir = os.path.dirname(strPath)
+    varFd, strPathTmp = tempfile.mkstemp(dir=strPathDir)
+    with os.fdopen(varFd, 'wb') as objFle:
+        funcWrite(objFle)
+    os.chmod(strPathTmp, 0o644)
+    os.replace(strPathTmp, strPath)
+
+
+def funcStoreLoad(strPathStore=None):
+    """
+    Load calibration store (cached per process).
+
+    Parameters
+    ----------
+    strPathStore : str, optional
+        Directory of the store (default: `strPathStoreDef`).
+
+    Returns
+    -------
+    dicStore : dict
+        'path': directory of the store; 'index': list of records; 'coef':
+        coefficients (memory mapped); 'lookup': for each display
+        configuration (tuple of display, coil, filter), the dates of the
+        calibrations (sorted `np.datetime64` array) and the corresponding
+        records (indices into 'index').
+    """
+    if strPathStore is None:
+        strPathStore = strPathStoreDef
+    strPathIdx = os.path.join(strPathStore, 'index.json')
+
+    # Modification time and size of the index, to detect changes:
+    if os.path.isfile(strPathIdx):
+        objStat = os.stat(strPathIdx)
+        varMtm = (objStat.st_mtime_ns, objStat.st_size)
+    else:
+        varMtm = None
+    tplTmp = dicStoreCache.get(strPathStore)
+    if (tplTmp is not None) and (tplTmp[0] == varMtm):
+        return tplTmp[1]
+
+    if varMtm is None:
+        lstIdx = []
+        aryCoef = np.zeros((0, 0))
+    else:
+        with open(strPathIdx, 'r') as objFle:
+            lstIdx = json.load(objFle)
+        aryCoef = np.load(os.path.join(strPathStore, 'coefficients.npy'),
+                          mmap_mode='r')
+
+    # Lookup of calibrations by display configuration, sorted by date:
+    dicLkp = {}
+    for idxRec, dicRec in enumerate(lstIdx):
+        dicLkp.setdefault(tuple(dicRec[strKey] for strKey in tplKey),
+                          []).append(idxRec)
+    for tplCfg, lstRec in dicLkp.items():
+        vecTme = np.array([funcTime(lstIdx[idxRec]['date'])
+                           for idxRec in lstRec])
+        vecSrt = np.argsort(vecTme, kind='stable')
+        dicLkp[tplCfg] = (vecTme[vecSrt], np.array(lstRec)[vecSrt])
+
+    dicStore = {'path': strPathStore,
+                'index': lstIdx,
+                'coef': aryCoef,
+                'lookup': dicLkp}
+    dicStoreCache[strPathStore] = (varMtm, dicStore)
+
+    return dicStore
+
+
+def funcCheckMdl(strMdl, varNumCoef):
+    """
+    Check that a calibration is a polynomial.
+
+    Lookup tables and drift reports evaluate the stored coefficients as a
+    polynomial, so the store only holds the polynomial models of
+    luminance_models.py ('poly2', 'poly3', ...).
+
+    Parameters
+    ----------
+    strMdl : str
+        Model name.
+    varNumCoef : int
+        Number of coefficients.
+
+    Raises
+    ------
+    ValueError
+        If the model is not a polynomial, or if the number of coefficients
+        does not match its degree.
+    """
+    if not (strMdl.startswith('poly') and strMdl[4:].isdigit()):
+        raise ValueError('Model ' + strMdl + ' is not a polynomial; the '
+                         + 'calibration store only holds polynomial models '
+                         + '(e.g. poly3)')
+    varDeg = int(strMdl[4:])
+    if int(varNumCoef) != varDeg + 1:
+        raise ValueError('Model ' + strMdl + ' has ' + str(varDeg + 1)
+                         + ' coefficients, got ' + str(int(varNumCoef)))
+
+
+def funcStoreAdd(vecPrm, strDisplay, strCoil, strFilter, strDate,
+                 strMdl='poly3', strNote='', strPathStore=None):
+    """
+    Add a calibration to the store.
+
+    Parameters
+    ----------
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    strDisplay, strCoil, strFilter : str
+        Display configuration (e.g. '7T', 'NOVA', 'ND.3').
+    strDate : str
+        Date (and optionally time) of the measurement, ISO format (e.g.
+        '2018-09-13').
+    strMdl : str
+        Model name, a polynomial of luminance_models.py (e.g. 'poly3').
+    strNote : str
+        Free text (e.g. source of the calibration).
+    strPathStore : str, optional
+        Directory of the store (default: `strPathStoreDef`).
+
+    Returns
+    -------
+    dicRec : dict
+        Record of the new calibration.
+
+    Raises
+    ------
+    ValueError
+        If the model is not a polynomial (see `funcCheckMdl`).
+    """
+    vecPrm = np.asarray(vecPrm, dtype=np.float64).ravel()
+    funcCheckMdl(strMdl, vecPrm.size)
+
+    if strPathStore is None:
+        strPathStore = strPathStoreDef
+    if not os.path.isdir(strPathStore):
+        os.makedirs(strPathStore)
+
+    # Validate date:
+    funcTime(strDate)
+
+    dicStore = funcStoreLoad(strPathStore)
+    lstIdx = list(dicStore['index'])
+
+    # Coefficient array, NaN-padded to the longest coefficient vector:
+    aryOld = np.asarray(dicStore['coef'])
+    varNumCoef = max(aryOld.shape[1], vecPrm.size)
+    aryCoef = np.full(((len(lstIdx) + 1), varNumCoef), np.nan)
+    aryCoef[:len(lstIdx), :aryOld.shape[1]] = aryOld
+    aryCoef[-1, :vecPrm.size] = vecPrm
+
+    dicRec = {'display': strDisplay,
+              'coil': strCoil,
+              'filter': strFilter,
+              'date': strDate,
+              'model': strMdl,
+              'note': strNote,
+              'row': len(lstIdx),
+              'ncoef': int(vecPrm.size)}
+    lstIdx.append(dicRec)
+
+    # Coefficients first, so that the index never refers to missing rows:
+    funcWriteAtomic(os.path.join(strPathStore, 'coefficients.npy'),
+                    lambda objFle: np.save(objFle, aryCoef))
+    funcWriteAtomic(os.path.join(strPathStore, 'index.json'),
+                    lambda objFle: objFle.write(
+                        json.dumps(lstIdx, indent=1).encode('utf-8')))
+
+    return dicRec
+
+
+def funcStoreQuery(strDisplay, strCoil, strFilter, varTime=None,
+                   lgcPrior=True, strPathStore=None):
+    """
+    Find the calibration that applies at a given time.
+
+    Parameters
+    ----------
+    strDisplay, strCoil, strFilter : str
+        Display configuration (e.g. '7T', 'NOVA', 'ND.3').
+    varTime : str, datetime.datetime, np.datetime64, optional
+        Time (default: now).
+    lgcPrior : bool
+        If True, the most recent calibration at or before `varTime` is
+        returned. If False, the calibration nearest in time (before or after)
+        is returned.
+    strPathStore : str, optional
+        Directory of the store (default: `strPathStoreDef`).
+
+    Returns
+    -------
+    vecPrm : np.ndarray
+        Polynomial coefficients, highest degree first.
+    dicRec : dict
+        Record of the calibration.
+
+    Raises
+    ------
+    LookupError
+        If there is no calibration for the display configuration (before
+        `varTime`).
+    ValueError
+        If the calibration is not a polynomial (see `funcCheckMdl`).
+    """
+    dicStore = funcStoreLoad(strPathStore)
+    tplCfg = (strDisplay, strCoil, strFilter)
+
+    if tplCfg not in dicStore['lookup']:
+        raise LookupError('No calibration for display ' + strDisplay
+                          + ', coil ' + strCoil + ', filter ' + strFilter)
+    vecTme, vecRec = dicStore['lookup'][tplCfg]
+
+    varTime = funcTime(varTime)
+    idxPos = int(np.searchsorted(vecTme, varTime, side='right'))
+
+    if lgcPrior:
+        if idxPos == 0:
+            raise LookupError('No calibration for display ' + strDisplay
+                              + ', coil ' + strCoil + ', filter '
+                              + strFilter + ' before ' + str(varTime)
+                              + ' (first calibration: ' + str(vecTme[0])
+                              + ')')
+        idxSel = idxPos - 1
+    else:
+        lstCnd = [idx for idx in (idxPos - 1, idxPos)
+                  if 0 <= idx < vecTme.size]
+        idxSel = min(lstCnd, key=lambda idx: abs(vecTme[idx] - varTime))
+
+    dicRec = dicStore['index'][vecRec[idxSel]]
+    funcCheckMdl(dicRec['model'], dicRec['ncoef'])
+    vecPrm = np.array(dicStore['coef'][dicRec['row'], :dicRec['ncoef']])
+
+    return vecPrm, dicRec
+
+
+def funcStoreLut(dicRec, varBit=16, strKnd='inv', strPathStore=None):
+    """
+    Lookup table of a calibration (created in the store on first use).
+
+    Parameters
+    ----------
+    dicRec : dict
+        Record of the calibration (see `funcStoreQuery`).
+    varBit : int
+        Resolution of the table, one of 8, 10, or 16 bit.
+    strKnd : str
+        'fwd' (pixel intensity to luminance) or 'inv' (luminance to pixel
+        intensity).
+    strPathStore : str, optional
+        Directory of the store (default: `strPathStoreDef`).
+
+    Returns
+    -------
+    vecLut : np.memmap
+        Lookup table (read-only, memory mapped).
+    varLo, varHi : float
+        Input values corresponding to the first and last table entry.
+    """
+    funcCheckMdl(dicRec['model'], dicRec['ncoef'])
+    dicStore = funcStoreLoad(strPathStore)
+    vecPrm = dicStore['coef'][dicRec['row'], :dicRec['ncoef']]
+    return funcLutLoad(vecPrm, varBit=varBit, strKnd=strKnd,
+                       strPathCache=dicStore['path'])
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** List calibrations
+
+if __name__ == '__main__':
+
+    dicStore = funcStoreLoad()
+    for dicRec in dicStore['index']:
+        print(dicRec['date'] + '  ' + dicRec['display'] + ', '
+              + dicRec['coil'] + ' coil, filter = ' + dicRec['filter'] + ': '
+              + str(dicStore['coef'][dicRec['row'], :dicRec['ncoef']]))
+# *****************************************************************************
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+Derive psychopy pixel intensities for target contrast levels.
+
+Contrast is defined in luminance space, relative to a background luminance
+(which can be given as a pixel intensity or as a luminance value):
+
+- Michelson contrast: a pair of luminance values centred on the background,
+  `L1 = Lb * (1 - c)` and `L2 = Lb * (1 + c)`, so that
+  `(L2 - L1) / (L2 + L1) = c` and the mean luminance equals the background
+  (e.g. the two phases of a grating, or two patches).
+- Weber contrast: a target on the background, `L2 = Lb * (1 + c)`, so that
+  `(L2 - Lb) / Lb = c` (negative for decrements).
+
+The pixel intensities are obtained with the exact inverse of the luminance
+function (`luminance.funcPix`), for whole arrays of target contrasts at once.
+
+Contrast of images (gratings, textures), in luminance space:
+
+- RMS contrast: standard deviation of luminance across the image, divided by
+  its mean luminance,
+- Michelson contrast: `(Lmax - Lmin) / (Lmax + Lmin)`.
+
+Images are scaled around a background pixel intensity (`b + s * (x - b)`,
+for `b = 0` this is the `contrast` attribute of psychopy stimuli). For a
+polynomial luminance function, the mean and mean square of luminance of the
+scaled image are polynomials in the scale factor `s`, with the power moments
+of the image as coefficients. The moments are calculated in one pass over
+the images; the scale factor that gives a target contrast is then solved for
+all images at once, without evaluating the luminance function per pixel.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+from math import factorial
+import numpy as np
+from luminance import funcGamut, funcLum, funcPix
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Supported contrast definitions:
+tplCntrDef = ('michelson', 'weber')
+
+# Supported contrast definitions for images:
+tplImgCntrDef = ('rms', 'michelson')
+
+# Number of pixels processed at once (images are processed in chunks of whole
+# images):
+varSzeChnkImg = 2 ** 22
+
+# Number of bisection steps for the scale factor (relative precision of
+# 2^-60):
+varNumBsc = 60
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcCntr(aryCd1, aryCd2, strDef='michelson'):
+    """
+    Calculate contrast between two luminance values.
+
+    Parameters
+    ----------
+    aryCd1, aryCd2 : array_like
+        Luminance [cd/m^2]. For Weber contrast, `aryCd1` is the background.
+    strDef : str
+        Contrast definition, 'michelson' or 'weber'.
+
+    Returns
+    -------
+    aryCntr : np.ndarray
+        Contrast.
+    """
+    aryCd1 = np.asarray(aryCd1, dtype=np.float64)
+    aryCd2 = np.asarray(aryCd2, dtype=np.float64)
+    if strDef == 'michelson':
+        return (aryCd2 - aryCd1) / (aryCd2 + aryCd1)
+    elif strDef == 'weber':
+        return (aryCd2 - aryCd1) / aryCd1
+    raise ValueError('Contrast definition must be one of ' + str(tplCntrDef))
+
+
+def funcCntrPix(aryCntr, vecPrm, varBckPix=None, varBckCd=None,
+                strDef='michelson', lgcStrict=True):
+    """
+    Calculate pixel intensities for an array of target contrasts.
+
+    Parameters
+    ----------
+    aryCntr : array_like
+        Target contrast values, of any shape.
+    vecPrm : array_like
+        Polynomial coefficients of the luminance function, highest degree
+        first.
+    varBckPix : float, optional
+        Background pixel intensity (between -1 and +1).
+    varBckCd : float, optional
+        Background luminance [cd/m^2]. Only one of `varBckPix` and `varBckCd`
+        can be given. If neither is given, the background is mid-grey (pixel
+        intensity 0).
+    strDef : str
+        Contrast definition, 'michelson' or 'weber'.
+    lgcStrict : bool
+        If True, a ValueError is raised if any target contrast cannot be
+        displayed (luminance out of the range of the display). If False, NaN
+        is returned for those targets.
+
+    Returns
+    -------
+    aryPix1, aryPix2 : np.ndarray
+        Pixel intensities, same shape as `aryCntr`. For Michelson contrast,
+        the darker and brighter member of the pair centred on the background
+        (for positive contrast). For Weber contrast, the background and the
+        target.
+    """
+    if strDef not in tplCntrDef:
+        raise ValueError('Contrast definition must be one of '
+                         + str(tplCntrDef))
+    if (varBckPix is not None) and (varBckCd is not None):
+        raise ValueError('Specify background as pixel intensity or as '
+                         + 'luminance, not both')
+
+    aryCntr = np.asarray(aryCntr, dtype=np.float64)
+
+    # Background luminance:
+    if varBckCd is None:
+        if varBckPix is None:
+            varBckPix = 0.0
+        varBckCd = float(funcLum(float(varBckPix), vecPrm))
+    elif varBckPix is None:
+        varBckPix = float(funcPix(varBckCd, vecPrm))
+
+    if strDef == 'michelson':
+        aryPix1 = funcPix(varBckCd * (1.0 - aryCntr), vecPrm,
+                          lgcStrict=lgcStrict)
+    else:
+        aryPix1 = np.full(aryCntr.shape, varBckPix)
+    aryPix2 = funcPix(varBckCd * (1.0 + aryCntr), vecPrm, lgcStrict=lgcStrict)
+
+    # A pair is only valid if both members can be displayed:
+    lgcNan = np.isnan(aryPix1) | np.isnan(aryPix2)
+    if np.any(lgcNan):
+        aryPix1 = np.where(lgcNan, np.nan, aryPix1)
+        aryPix2 = np.where(lgcNan, np.nan, aryPix2)
+
+    return aryPix1, aryPix2
+
+
+def funcImgChunks(aryImg, varChnk=varSzeChnkImg):
+    """Slices of whole images with about `varChnk` pixels."""
+    varNumImg = aryImg.shape[0]
+    varSzeImg = max(1, int(np.prod(aryImg.shape[1:])))
+    varImgChnk = max(1, varChnk // varSzeImg)
+    return [slice(idxStr, min(idxStr + varImgChnk, varNumImg))
+            for idxStr in range(0, varNumImg, varImgChnk)]
+
+
+def funcImgCntr(aryImg, vecPrm, strDef='rms', varChnk=varSzeChnkImg):
+    """
+    Contrast of images in luminance space.
+
+    Parameters
+    ----------
+    aryImg : array_like
+        Pixel intensities, images x ... (e.g. images x height x width; a
+        single image needs a first axis of length one).
+    vecPrm : array_like
+        Polynomial coefficients of the luminance function, highest degree
+        first.
+    strDef : str
+        Contrast definition, 'rms' or 'michelson'.
+    varChnk : int
+        Number of pixels processed at once.
+
+    Returns
+    -------
+    vecCntr : np.ndarray
+        Contrast of each image.
+    """
+    if strDef not in tplImgCntrDef:
+        raise ValueError('Contrast definition must be one of '
+                         + str(tplImgCntrDef))
+    aryImg = np.asarray(aryImg)
+    vecCntr = np.empty(aryImg.shape[0])
+
+    for objSlc in funcImgChunks(aryImg, varChnk=varChnk):
+        aryLum = funcLum(aryImg[objSlc], vecPrm, dtype=np.float64)
+        aryLum = aryLum.reshape(aryLum.shape[0], -1)
+        if strDef == 'rms':
+            vecCntr[objSlc] = (np.std(aryLum, axis=1)
+                               / np.mean(aryLum, axis=1))
+        else:
+            vecMax = np.max(aryLum, axis=1)
+            vecMin = np.min(aryLum, axis=1)
+            vecCntr[objSlc] = (vecMax - vecMin) / (vecMax + vecMin)
+
+    return vecCntr
+
+
+def funcImgMoments(aryImg, varDeg, varBckPix=0.0, varChnk=varSzeChnkImg):
+    """
+    Power moments of images around the background pixel intensity.
+
+    Parameters
+    ----------
+    aryImg : array_like
+        Pixel intensities, images x ... (see `funcImgCntr`).
+    varDeg : int
+        Degree of the luminance function (moments up to twice the degree are
+        calculated).
+    varBckPix : float
+        Background pixel intensity.
+    varChnk : int
+        Number of pixels processed at once.
+
+    Returns
+    -------
+    dicMom : dict
+        'mom': images x (2 * degree + 1), mean of `(x - b) ^ k`; 'min' and
+        'max': smallest and largest `x - b` per image; 'bck': background.
+    """
+    aryImg = np.asarray(aryImg)
+    varNumImg = aryImg.shape[0]
+    aryMom = np.empty((varNumImg, (2 * varDeg + 1)))
+    vecMin = np.empty(varNumImg)
+    vecMax = np.empty(varNumImg)
+
+    for objSlc in funcImgChunks(aryImg, varChnk=varChnk):
+        aryDev = (aryImg[objSlc].reshape(
+            (objSlc.stop - objSlc.start), -1).astype(np.float64)
+            - varBckPix)
+        vecMin[objSlc] = np.min(aryDev, axis=1)
+        vecMax[objSlc] = np.max(aryDev, axis=1)
+        aryPow = np.ones(aryDev.shape)
+        aryMom[objSlc, 0] = 1.0
+        for idxDeg in range(1, (2 * varDeg + 1)):
+            aryPow *= aryDev
+            aryMom[objSlc, idxDeg] = np.mean(aryPow, axis=1)
+
+    return {'mom': aryMom, 'min': vecMin, 'max': vecMax,
+            'bck': float(varBckPix)}
+
+
+def funcImgCntrScale(dicMom, vecPrm, vecScl, strDef='rms'):
+    """
+    Contrast of scaled images, from their moments.
+
+    Parameters
+    ----------
+    dicMom : dict
+        Moments of the images (see `funcImgMoments`).
+    vecPrm : array_like
+        Polynomial coefficients of the luminance function, highest degree
+        first.
+    vecScl : np.ndarray
+        Scale factor of each image (pixel intensities `b + s * (x - b)`).
+    strDef : str
+        Contrast definition, 'rms' or 'michelson'.
+
+    Returns
+    -------
+    vecCntr : np.ndarray
+        Contrast of each scaled image.
+    """
+    vecPrm = np.asarray(vecPrm, dtype=np.float64).ravel()
+    vecScl = np.asarray(vecScl, dtype=np.float64)
+    varBck = dicMom['bck']
+
+    if strDef == 'michelson':
+        vecLo = funcLum(varBck + vecScl * dicMom['min'], vecPrm)
+        vecHi = funcLum(varBck + vecScl * dicMom['max'], vecPrm)
+        return np.abs(vecHi - vecLo) / (vecHi + vecLo)
+    if strDef != 'rms':
+        raise ValueError('Contrast definition must be one of '
+                         + str(tplImgCntrDef))
+
+    # Luminance function around the background, `f(b + u) = sum e_k u^k`
+    # (Taylor coefficients, lowest degree first):
+    varDeg = vecPrm.size - 1
+    vecTay = np.array([np.polyval(np.polyder(vecPrm, idxDeg), varBck)
+                       / factorial(idxDeg) if idxDeg > 0
+                       else np.polyval(vecPrm, varBck)
+                       for idxDeg in range(varDeg + 1)])
+    aryMom = dicMom['mom'][:, :(2 * varDeg + 1)]
+    aryScl = np.power(vecScl[..., None], np.arange(2 * varDeg + 1))
+
+    # Mean and mean square of luminance:
+    vecAvg = np.dot(aryScl[..., :(varDeg + 1)] * aryMom[..., :(varDeg + 1)],
+                    vecTay)
+    vecSqr = np.dot(aryScl * aryMom, np.convolve(vecTay, vecTay))
+
+    return np.sqrt(np.maximum(vecSqr - np.square(vecAvg), 0.0)) / vecAvg
+
+
+def funcImgScale(aryImg, aryCntr, vecPrm, varBckPix=0.0, strDef='rms',
+                 lgcStrict=True, varChnk=varSzeChnkImg):
+    """
+    Scale factors of images for target contrasts.
+
+    Parameters
+    ----------
+    aryImg : array_like
+        Pixel intensities, images x ... (see `funcImgCntr`).
+    aryCntr : array_like
+        Target contrast, one value for all images, or one per image.
+    vecPrm : array_like
+        Polynomial coefficients of the luminance function, highest degree
+        first.
+    varBckPix : float
+        Background pixel intensity, around which images are scaled (0: mid
+        grey, the scale factor is the `contrast` of a psychopy stimulus).
+    strDef : str
+        Contrast definition, 'rms' or 'michelson'.
+    lgcStrict : bool
+        If True, a ValueError is raised if the target contrast of any image
+        cannot be reached without pixel intensities outside of the monotonic
+        range of the display (see `luminance.funcGamut`). If False, NaN is
+        returned for those images.
+    varChnk : int
+        Number of pixels processed at once.
+
+    Returns
+    -------
+    vecScl : np.ndarray
+        Scale factor of each image; the scaled image is
+        `varBckPix + vecScl * (aryImg - varBckPix)`.
+    """
+    if strDef not in tplImgCntrDef:
+        raise ValueError('Contrast definition must be one of '
+                         + str(tplImgCntrDef))
+    vecPrm = np.asarray(vecPrm, dtype=np.float64).ravel()
+    aryImg = np.asarray(aryImg)
+    varNumImg = aryImg.shape[0]
+    vecCntr = np.broadcast_to(np.asarray(aryCntr, dtype=np.float64),
+                              (varNumImg,))
+
+    dicMom = funcImgMoments(aryImg, (vecPrm.size - 1), varBckPix=varBckPix,
+                            varChnk=varChnk)
+
+    # Largest scale factor that keeps pixel intensities within the monotonic
+    # range of the display:
+    varPixLo, varPixHi = funcGamut(vecPrm)[:2]
+    with np.errstate(divide='ignore'):
+        vecSclMax = np.minimum(
+            np.where(dicMom['max'] > 0.0,
+                     (varPixHi - varBckPix) / dicMom['max'], np.inf),
+            np.where(dicMom['min'] < 0.0,
+                     (varPixLo - varBckPix) / dicMom['min'], np.inf))
+    # Uniform images (no contrast at any scale factor):
+    vecSclMax[~np.isfinite(vecSclMax)] = 0.0
+
+    # Targets that can be reached (contrast increases with the scale
+    # factor):
+    lgcOut = ~((vecCntr >= 0.0)
+               & (vecCntr <= funcImgCntrScale(dicMom, vecPrm, vecSclMax,
+                                              strDef=strDef)))
+    if np.any(lgcOut) and lgcStrict:
+        raise ValueError(str(np.sum(lgcOut)) + ' image(s) cannot reach the '
+                         + 'target contrast within the range of the display')
+
+    # Bisection, all images at once:
+    vecLo = np.zeros(varNumImg)
+    vecHi = vecSclMax.copy()
+    for idxItr in range(varNumBsc):
+        vecMid = 0.5 * (vecLo + vecHi)
+        lgcAbv = funcImgCntrScale(dicMom, vecPrm, vecMid,
+                                  strDef=strDef) > vecCntr
+        vecHi = np.where(lgcAbv, vecMid, vecHi)
+        vecLo = np.where(lgcAbv, vecLo, vecMid)
+
+    vecScl = 0.5 * (vecLo + vecHi)
+    vecScl[lgcOut] = np.nan
+    return vecScl
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Scaling of textures to a target RMS contrast
+
+if __name__ == '__main__':
+
+    import time
+
+    # Random textures (smoothed noise), 128 x 128 pixels:
+    varNumImg = 2000
+    objRng = np.random.default_rng(0)
+    aryImg = objRng.normal(0.0, 1.0, size=(varNumImg, 128, 128))
+    aryImg = 0.25 * (aryImg + np.roll(aryImg, 1, axis=1)
+                     + np.roll(aryImg, 1, axis=2)
+                     + np.roll(aryImg, (1, 1), axis=(1, 2)))
+    aryImg /= np.max(np.abs(aryImg), axis=(1, 2), keepdims=True)
+
+    vecPrm = np.array([-190.2, 227.0, 839.3, 431.3])
+    vecCntr = objRng.uniform(0.05, 0.3, size=varNumImg)
+
+    for strDef in tplImgCntrDef:
+        varTme = time.perf_counter()
+        vecScl = funcImgScale(aryImg, vecCntr, vecPrm, strDef=strDef,
+                              lgcStrict=False)
+        varTme = time.perf_counter() - varTme
+
+        # Contrast of the scaled images, through the luminance function:
+        lgcOk = ~np.isnan(vecScl)
+        vecCntrImg = funcImgCntr(vecScl[lgcOk, None, None] * aryImg[lgcOk],
+                                 vecPrm, strDef=strDef)
+        print(strDef + ': scale factors of ' + str(varNumImg) + ' images '
+              + 'in ' + str(np.around(varTme, 3)) + ' s, '
+              + str(np.sum(~lgcOk)) + ' out of range, maximum contrast '
+              + 'error ' + ('%.1e' % np.max(np.abs(vecCntrImg
+                                                   - vecCntr[lgcOk]))))
+# *****************************************************************************
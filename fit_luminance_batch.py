@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fit luminance models to many measurement sessions in parallel.
+
+All measurement files (`Luminance_measurement_*.csv`, see
+luminance_measurement_20180913/) in a directory tree are fitted with all
+models from luminance_models.py (the same models as in fit_luminance.py).
+Sessions are distributed across a pool of processes. The fitted parameters of
+all sessions and models are saved in one table (csv file, one row per
+session and model). Optionally, a summary figure is rendered for each
+session (see luminance_plot.py).
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import multiprocessing as mp
+import numpy as np
+from luminance_io import (funcFindCsv, funcParseTitle, funcReadCsv,
+                          funcSaveTable, tplMeta)
+from luminance_models import dicMdl, funcFit, varMaxPrm
+from profiling import funcPoolMap, funcStage
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Directory containing measurement files (searched recursively):
+strPathIn = 'luminance_measurement_20180913/'
+
+# Output table (csv):
+strPathOut = 'luminance_fits.csv'
+
+# Output directory for summary figures (one per session; None: no figures):
+strPathPlt = None
+
+# Number of processes (None: number of CPUs):
+varPar = None
+
+# Profiling report of the processing stages (.json or .csv file; None: no
+# profiling, see profiling.py):
+strPathPrf = None
+
+# Columns of the output table:
+lstCol = (['session', 'title'] + list(tplMeta)
+          + ['model', 'levels', 'repetitions']
+          + ['par_' + str(idx) for idx in range(varMaxPrm)]
+          + ['rss', 'r2'])
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcFitSession(strPathCsv):
+    """
+    Fit all models to one measurement session.
+
+    Parameters
+    ----------
+    strPathCsv : str
+        Path of measurement file.
+
+    Returns
+    -------
+    lstRow : list
+        One dictionary per model, with the fields from `lstCol`.
+    """
+    with funcStage('load', session=strPathCsv):
+        vecInd, aryDep, strTtl = funcReadCsv(strPathCsv)
+        dicMeta = funcParseTitle(strTtl)
+
+    # Average across repetitions:
+    with funcStage('average'):
+        vecDepAvg = np.mean(aryDep, axis=0)
+
+    lstRow = []
+    for strMdl in dicMdl:
+        with funcStage('fit', model=strMdl):
+            dicFit = funcFit(strMdl, vecInd, vecDepAvg)
+        with funcStage('row', model=strMdl):
+            vecPrm = dicFit['prm']
+            dicRow = {'session': strPathCsv,
+                      'title': strTtl,
+                      'model': strMdl,
+                      'levels': dicFit['obs'],
+                      'repetitions': aryDep.shape[0],
+                      'rss': dicFit['rss'],
+                      'r2': dicFit['r2']}
+            dicRow.update(dicMeta)
+            for idxPrm in range(varMaxPrm):
+                if idxPrm < vecPrm.size:
+                    dicRow['par_' + str(idxPrm)] = float(vecPrm[idxPrm])
+                else:
+                    dicRow['par_' + str(idxPrm)] = np.nan
+            lstRow.append(dicRow)
+
+    return lstRow
+
+
+def funcFitBatch(lstPathCsv, varPar=None):
+    """
+    Fit all models to several measurement sessions, in parallel.
+
+    Parameters
+    ----------
+    lstPathCsv : list
+        Paths of measurement files.
+    varPar : int, optional
+        Number of processes (default: number of CPUs). With one process, the
+        sessions are fitted serially, without a process pool.
+
+    Returns
+    -------
+    lstRow : list
+        One dictionary per session and model (see `funcFitSession`), in the
+        order of `lstPathCsv`.
+    """
+    if varPar is None:
+        varPar = mp.cpu_count()
+    varPar = max(1, min(varPar, len(lstPathCsv)))
+
+    if varPar == 1:
+        lstRes = [funcFitSession(strPathCsv) for strPathCsv in lstPathCsv]
+    else:
+        # Several sessions per task, to reduce inter-process communication:
+        varChnk = max(1, len(lstPathCsv) // (varPar * 4))
+        with mp.Pool(processes=varPar) as objPool:
+            lstRes = funcPoolMap(objPool, funcFitSession, lstPathCsv,
+                                 chunksize=varChnk)
+
+    return [dicRow for lstTmp in lstRes for dicRow in lstTmp]
+
+
+def funcPlotSessions(lstRow, strPathPlt, strPathIn=None):
+    """
+    Collect fitted parameters per session, for rendering summary figures.
+
+    Parameters
+    ----------
+    lstRow : list
+        Fitted parameters, one dictionary per session and model (see
+        `funcFitSession`).
+    strPathPlt : str
+        Output directory for figures.
+    strPathIn : str, optional
+        Root directory of the measurement files (for unique figure names).
+
+    Returns
+    -------
+    lstSes : list
+        One dictionary per session (see `luminance_plot.funcRenderSession`).
+    """
+    from luminance_plot import funcPathFig
+
+    dicSes = {}
+    for dicRow in lstRow:
+        strPathCsv = dicRow['session']
+        if strPathCsv not in dicSes:
+            dicSes[strPathCsv] = {
+                'path': strPathCsv,
+                'prm': {},
+                'out': funcPathFig(strPathCsv, strPathPlt, strPathIn)}
+        varNumPrm = len(dicMdl[dicRow['model']]['prm'])
+        dicSes[strPathCsv]['prm'][dicRow['model']] = np.array(
+            [dicRow['par_' + str(idx)] for idx in range(varNumPrm)])
+
+    return list(dicSes.values())
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Fit all sessions
+
+if __name__ == '__main__':
+
+    if strPathPrf is not None:
+        from profiling import funcEnable, funcSaveReport
+        funcEnable()
+
+    with funcStage('find'):
+        lstPathCsv = funcFindCsv(strPathIn)
+    print('Number of measurement sessions: ' + str(len(lstPathCsv)))
+
+    with funcStage('fit_batch'):
+        lstRow = funcFitBatch(lstPathCsv, varPar=varPar)
+    with funcStage('save_table'):
+        funcSaveTable(lstRow, strPathOut, lstCol)
+
+    print('Fitted parameters saved to: ' + strPathOut)
+
+    if strPathPlt is not None:
+        # Import plotting only when needed (matplotlib is slow to import):
+        with funcStage('import_plot'):
+            from luminance_plot import funcRenderBatch
+        lstSes = funcPlotSessions(lstRow, strPathPlt, strPathIn=strPathIn)
+        with funcStage('render_batch'):
+            funcRenderBatch(lstSes, varPar=varPar)
+        print('Figures saved to: ' + strPathPlt)
+
+    if strPathPrf is not None:
+        funcSaveReport(strPathPrf)
+        print('Profiling report saved to: ' + strPathPrf)
+# *****************************************************************************
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bootstrap confidence intervals for fitted luminance functions.
+
+Repetitions and intensity levels of a luminance measurement are resampled
+with replacement, and the model is fitted to each resample. Percentile
+confidence intervals are reported for the model parameters and for the
+predicted luminance.
+
+For models that are linear in their parameters (polynomials, logarithmic
+model; see luminance_models.py), all resamples are solved at once, as one
+batched least squares problem. Other models are fitted one resample at a time.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import warnings
+import numpy as np
+from luminance_io import funcReadCsv
+from luminance_models import dicMdl, funcFit, funcPred
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Measurement file:
+strPathCsv = ('luminance_measurement_20180913/'
+              + 'Luminance_measurement_7T_NOVA_coil.csv')
+
+# Model:
+strMdl = 'poly3'
+
+# Number of bootstrap resamples:
+varNumBoot = 10000
+
+# Confidence level:
+varCnf = 0.95
+
+# Seed of random number generator (None for a random seed):
+varSeed = None
+
+# Number of resamples solved at once (limits memory of batched solution):
+varSzeBtch = 2000
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcBootSample(vecInd, aryDep, varNumBoot, objRng):
+    """
+    Draw bootstrap resamples of a luminance measurement.
+
+    Intensity levels are resampled with replacement, and for each resampled
+    level, repetitions are resampled with replacement and averaged.
+
+    Parameters
+    ----------
+    vecInd : np.ndarray
+        Pixel intensities (one per level).
+    aryDep : np.ndarray
+        Measured luminance, repetitions x levels.
+    varNumBoot : int
+        Number of resamples.
+    objRng : np.random.Generator
+        Random number generator.
+
+    Returns
+    -------
+    aryX : np.ndarray
+        Pixel intensities, resamples x levels.
+    aryY : np.ndarray
+        Luminance averaged across resampled repetitions, resamples x levels.
+    """
+    varNumRep, varNumLvl = aryDep.shape
+    aryIdxLvl = objRng.integers(0, varNumLvl, size=(varNumBoot, varNumLvl))
+    aryIdxRep = objRng.integers(0, varNumRep,
+                                size=(varNumBoot, varNumRep, varNumLvl))
+    aryX = vecInd[aryIdxLvl]
+    aryY = np.mean(aryDep[aryIdxRep, aryIdxLvl[:, None, :]], axis=1)
+    return aryX, aryY
+
+
+def funcBootLinear(strMdl, aryX, aryY, varSzeBtch=varSzeBtch):
+    """
+    Fit a linear model to many resamples at once.
+
+    Parameters
+    ----------
+    strMdl : str
+        Model name (key of `luminance_models.dicMdl`), a model with a design
+        matrix ('basis').
+    aryX, aryY : np.ndarray
+        Pixel intensities and luminance, resamples x levels.
+    varSzeBtch : int
+        Number of resamples solved at once.
+
+    Returns
+    -------
+    aryPrm : np.ndarray
+        Fitted parameters, resamples x parameters.
+    """
+    dicTmp = dicMdl[strMdl]
+    varNumBoot = aryX.shape[0]
+    aryPrm = np.empty((varNumBoot, len(dicTmp['prm'])))
+
+    for idxStr in range(0, varNumBoot, varSzeBtch):
+        idxEnd = min(idxStr + varSzeBtch, varNumBoot)
+
+        # Stacked design matrices, resamples x levels x parameters. Data
+        # points outside of the model domain are given zero weight:
+        lgcDom = dicTmp['domain'](aryX[idxStr:idxEnd])
+        with np.errstate(all='ignore'):
+            aryDsgn = dicTmp['basis'](aryX[idxStr:idxEnd])
+        aryDsgn[~lgcDom] = 0.0
+        aryTmpY = np.where(lgcDom, aryY[idxStr:idxEnd], 0.0)
+
+        # Batched least squares solution:
+        aryPrm[idxStr:idxEnd] = np.matmul(np.linalg.pinv(aryDsgn),
+                                          aryTmpY[:, :, None])[:, :, 0]
+
+    return aryPrm
+
+
+def funcBoot(strMdl, vecInd, aryDep, varNumBoot=10000, varCnf=0.95,
+             vecPrd=None, varSeed=None):
+    """
+    Bootstrap confidence intervals of model parameters and predictions.
+
+    Parameters
+    ----------
+    strMdl : str
+        Model name (key of `luminance_models.dicMdl`).
+    vecInd : np.ndarray
+        Pixel intensities (one per level).
+    aryDep : np.ndarray
+        Measured luminance, repetitions x levels.
+    varNumBoot : int
+        Number of resamples.
+    varCnf : float
+        Confidence level (e.g. 0.95).
+    vecPrd : np.ndarray, optional
+        Pixel intensities at which to calculate confidence intervals of the
+        predicted luminance (default: 201 values from -1 to +1).
+    varSeed : int, optional
+        Seed of random number generator.
+
+    Returns
+    -------
+    dicBoot : dict
+        'prm': parameters fitted to the full data; 'prm_boot': parameters of
+        all resamples (resamples x parameters); 'prm_ci': confidence interval
+        of parameters (lower and upper bound x parameters); 'x': `vecPrd`;
+        'prd': prediction of full-data fit; 'prd_ci': confidence interval of
+        prediction (lower and upper bound x `vecPrd`); 'failed': number of
+        resamples for which the fit failed.
+    """
+    if vecPrd is None:
+        vecPrd = np.linspace(-1.0, 1.0, num=201)
+
+    objRng = np.random.default_rng(varSeed)
+    aryX, aryY = funcBootSample(vecInd, aryDep, varNumBoot, objRng)
+
+    if dicMdl[strMdl]['basis'] is not None:
+        aryPrm = funcBootLinear(strMdl, aryX, aryY)
+        with np.errstate(all='ignore'):
+            aryDsgn = dicMdl[strMdl]['basis'](vecPrd)
+        aryDsgn[~dicMdl[strMdl]['domain'](vecPrd)] = np.nan
+        aryPrdBoot = np.dot(aryPrm, aryDsgn.T)
+    else:
+        aryPrm = np.array([funcFit(strMdl, aryX[idx], aryY[idx])['prm']
+                           for idx in range(varNumBoot)])
+        aryPrdBoot = np.array([funcPred(strMdl, vecPrd, vecTmp)
+                               for vecTmp in aryPrm])
+
+    # Resamples with too few distinct levels within the model domain (or
+    # failed fits):
+    lgcFld = ~np.all(np.isfinite(aryPrm), axis=1)
+    aryTmp = np.where(dicMdl[strMdl]['domain'](aryX), aryX, np.nan)
+    aryTmp = np.sort(aryTmp, axis=1)
+    vecNumUnq = np.sum(np.isfinite(aryTmp[:, :1]), axis=1) + np.sum(
+        (np.diff(aryTmp, axis=1) > 0.0), axis=1)
+    lgcFld |= vecNumUnq < len(dicMdl[strMdl]['prm'])
+    aryPrm[lgcFld] = np.nan
+    aryPrdBoot[lgcFld] = np.nan
+
+    vecPct = [50.0 * (1.0 - varCnf), 50.0 * (1.0 + varCnf)]
+    vecPrm = funcFit(strMdl, vecInd, np.mean(aryDep, axis=0))['prm']
+
+    # Predictions outside of the model domain are all NaN:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        aryPrmCi = np.nanpercentile(aryPrm, vecPct, axis=0)
+        aryPrdCi = np.nanpercentile(aryPrdBoot, vecPct, axis=0)
+
+    return {'prm': vecPrm,
+            'prm_boot': aryPrm,
+            'prm_ci': aryPrmCi,
+            'x': vecPrd,
+            'prd': funcPred(strMdl, vecPrd, vecPrm),
+            'prd_ci': aryPrdCi,
+            'failed': int(np.sum(lgcFld))}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Bootstrap
+
+if __name__ == '__main__':
+
+    vecInd, aryDep, strTtl = funcReadCsv(strPathCsv)
+
+    dicBoot = funcBoot(strMdl, vecInd, aryDep, varNumBoot=varNumBoot,
+                       varCnf=varCnf, varSeed=varSeed)
+
+    print(strTtl)
+    print('Model: ' + strMdl + ', ' + str(varNumBoot) + ' resamples, '
+          + str(int(varCnf * 100.0)) + '% confidence intervals')
+    for idxPrm, strPrm in enumerate(dicMdl[strMdl]['prm']):
+        print('    ' + strPrm + ' = '
+              + str(np.around(dicBoot['prm'][idxPrm], 2)) + '  ['
+              + str(np.around(dicBoot['prm_ci'][0, idxPrm], 2)) + ', '
+              + str(np.around(dicBoot['prm_ci'][1, idxPrm], 2)) + ']')
+
+    # Width of confidence interval of predicted luminance:
+    vecWdth = dicBoot['prd_ci'][1] - dicBoot['prd_ci'][0]
+    print('Maximum width of confidence interval of luminance: '
+          + str(np.around(np.nanmax(vecWdth), 2)) + ' cd/m^2')
+# *****************************************************************************
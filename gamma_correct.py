@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+Gamma correction of large stimulus stacks (images or movies).
+
+Stimuli are prepared as stacks of frames (`.npy` files, frames x height x
+width, or frames x height x width x 3 for RGB) of linear luminance values.
+Each value is converted to the psychopy pixel intensity that produces this
+luminance on the display, with the inverse lookup table of the calibration
+(see luminance_lut.py, and rgb_calibration.py for per-channel calibrations).
+
+The input is memory mapped, and processed in chunks of frames by a pool of
+threads (numpy releases the GIL during the lookup). Each corrected chunk is
+written to its place in the output file, so that stacks larger than memory
+can be processed.
+
+Input values are either luminance [cd/m^2], or values in a given range (e.g.
+0 to 255 for 8 bit images, or -1 to 1) that are mapped linearly onto the
+luminance range of the display.
+
+Luminance stacks can be corrected for spatial non-uniformity of the display
+with a gain map (see uniformity.py), applied to each chunk before the lookup.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from luminance_lut import funcLutApply, funcLutLoad, funcLutSlope
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Number of values per chunk (a chunk holds whole frames, at least one):
+varSzeChnkStk = 2 ** 23
+
+# Resolution of lookup table [bit]:
+varBitDef = 16
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcInRange(aryIn, strRng):
+    """
+    Range of input values mapped onto the luminance range of the display.
+
+    Parameters
+    ----------
+    aryIn : np.ndarray
+        Input stack.
+    strRng : str
+        'cd' (input is luminance [cd/m^2], no mapping), 'dtype' (full range
+        of the integer data type, e.g. 0 to 255 for uint8), or 'norm'
+        (-1 to 1).
+
+    Returns
+    -------
+    tplRng : tuple or None
+        Lower and upper bound of the input range (None for 'cd').
+    """
+    if strRng == 'cd':
+        return None
+    if strRng == 'norm':
+        return (-1.0, 1.0)
+    if strRng == 'dtype':
+        if not np.issubdtype(aryIn.dtype, np.integer):
+            raise ValueError('Input range dtype requires integer input, not '
+                             + str(aryIn.dtype))
+        objInf = np.iinfo(aryIn.dtype)
+        return (float(objInf.min), float(objInf.max))
+    raise ValueError('Unknown input range: ' + str(strRng))
+
+
+def funcCorrectStack(strPathIn, strPathOut, vecPrm, strRng='cd',
+                     varBit=varBitDef, varThrd=None, varSzeChnk=varSzeChnkStk,
+                     dtype=np.float32, lgcStrict=True, strPathCache=None,
+                     aryGain=None):
+    """
+    Gamma correct a stack of frames, chunk by chunk, in parallel threads.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Input stack (`.npy`), frames x height x width (grey), or frames x
+        height x width x 3 (RGB, with per-channel calibration).
+    strPathOut : str
+        Output stack (`.npy`), psychopy pixel intensities, same shape as the
+        input.
+    vecPrm : np.ndarray
+        Polynomial coefficients of the luminance function (highest degree
+        first), or channels x coefficients for a per-channel calibration (see
+        rgb_calibration.py).
+    strRng : str
+        Range of input values, see `funcInRange`.
+    varBit : int
+        Resolution of lookup table(s), one of 8, 10, or 16 bit.
+    varThrd : int, optional
+        Number of threads (default: number of CPUs).
+    varSzeChnk : int
+        Number of values per chunk (rounded to whole frames).
+    dtype : np.dtype
+        Data type of output.
+    lgcStrict : bool
+        If True, a ValueError is raised if any value is out of the range of
+        the display. If False, NaN is written for those values.
+    strPathCache : str, optional
+        Cache directory of lookup tables.
+    aryGain : np.ndarray, optional
+        Gain map, height x width, for input luminance (`strRng='cd'`) only
+        (see `uniformity.funcGainMap`). Gains above one raise the luminance
+        (e.g. towards the edges of the screen, for a gain map relative to the
+        centre), so that bright values can be out of the range of the display
+        there (see `lgcStrict`).
+
+    Returns
+    -------
+    dicRes : dict
+        'frames': number of frames; 'seconds': processing time; 'fps':
+        throughput [frames per second]; 'outside': number of NaN output
+        values (out of the range of the display with `lgcStrict=False`, or
+        NaN input).
+    """
+    vecPrm = np.asarray(vecPrm, dtype=np.float64)
+    aryIn = np.load(strPathIn, mmap_mode='r')
+    tplRng = funcInRange(aryIn, strRng)
+    if (aryGain is not None) and (tplRng is not None):
+        raise ValueError('Gain map requires input luminance (range cd)')
+
+    # Lookup table(s), input range of the tables mapped to the input range of
+    # the stack (so that no separate scaling pass is needed), and slopes
+    # between entries (calculated once, for all chunks):
+    if vecPrm.ndim == 2:
+        from rgb_calibration import funcLutApplyRgb, funcLutLoadRgb
+        aryLut, vecLo, vecHi = funcLutLoadRgb(vecPrm, varBit=varBit,
+                                              strPathCache=strPathCache)
+        if tplRng is not None:
+            vecLo = np.full(vecLo.shape, tplRng[0])
+            vecHi = np.full(vecHi.shape, tplRng[1])
+        vecSlp = funcLutSlope(aryLut.ravel())
+
+        def funcChnk(aryTmpIn, aryTmpOut):
+            funcLutApplyRgb(aryTmpIn, aryLut, vecLo, vecHi, out=aryTmpOut,
+                            lgcStrict=lgcStrict, vecSlp=vecSlp)
+    else:
+        vecLut, varLo, varHi = funcLutLoad(vecPrm, varBit=varBit,
+                                           strPathCache=strPathCache)
+        vecLut = np.array(vecLut)
+        if tplRng is not None:
+            varLo, varHi = tplRng
+        vecSlp = funcLutSlope(vecLut)
+
+        def funcChnk(aryTmpIn, aryTmpOut):
+            funcLutApply(aryTmpIn, vecLut, varLo, varHi, out=aryTmpOut,
+                         lgcStrict=lgcStrict, vecSlp=vecSlp)
+
+    if aryGain is not None:
+        from uniformity import funcApplyGain
+        funcChnkLut = funcChnk
+
+        def funcChnk(aryTmpIn, aryTmpOut):
+            funcChnkLut(funcApplyGain(aryTmpIn, aryGain), aryTmpOut)
+
+    varNumFrm = aryIn.shape[0]
+    varSzeFrm = max(1, int(np.prod(aryIn.shape[1:])))
+    varFrmChnk = max(1, varSzeChnk // varSzeFrm)
+    lstChnk = [(idxStr, min(idxStr + varFrmChnk, varNumFrm))
+               for idxStr in range(0, varNumFrm, varFrmChnk)]
+
+    if varThrd is None:
+        varThrd = os.cpu_count() or 1
+
+    # Output file, owned here (and closed before returning): npy header, and
+    # data extended to full size, so that chunks can be written in any order:
+    dtype = np.dtype(dtype)
+    varSzeFrmOut = int(np.prod(aryIn.shape[1:])) * dtype.itemsize
+    objFle = open(strPathOut, 'wb')
+    objLck = threading.Lock()
+
+    def funcTsk(tplChnk):
+        aryTmpOut = np.empty(((tplChnk[1] - tplChnk[0]),) + aryIn.shape[1:],
+                             dtype=dtype)
+        funcChnk(aryIn[tplChnk[0]:tplChnk[1]], aryTmpOut)
+        with objLck:
+            objFle.seek(varOff + tplChnk[0] * varSzeFrmOut)
+            objFle.write(aryTmpOut.data)
+        return int(np.count_nonzero(np.isnan(aryTmpOut)))
+
+    varTme = time.perf_counter()
+    varNumOut = 0
+    lgcDne = False
+    try:
+        np.lib.format.write_array_header_1_0(
+            objFle, {'descr': np.lib.format.dtype_to_descr(dtype),
+                     'fortran_order': False,
+                     'shape': aryIn.shape})
+        varOff = objFle.tell()
+        objFle.truncate(varOff + varNumFrm * varSzeFrmOut)
+        with ThreadPoolExecutor(max_workers=varThrd) as objPool:
+            # Consume results, so that errors are raised here:
+            for varTmp in objPool.map(funcTsk, lstChnk):
+                varNumOut += varTmp
+        lgcDne = True
+    finally:
+        # Close the output (all threads have finished), and remove the
+        # partial output if processing failed:
+        objFle.close()
+        if not lgcDne:
+            os.remove(strPathOut)
+    varTme = time.perf_counter() - varTme
+
+    return {'frames': varNumFrm,
+            'seconds': varTme,
+            'fps': (varNumFrm / varTme) if varTme > 0.0 else np.inf,
+            'outside': varNumOut}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Benchmark
+
+if __name__ == '__main__':
+
+    import tempfile
+
+    # 8 bit movie at the resolution of the projector (see
+    # psychopy_measure_luminance.py), linear luminance from 0 to 255:
+    varNumFrm = 120
+    tplShp = (varNumFrm, 1200, 1920)
+    vecPrm = np.array([-195.9, 246.3, 887.4, 454.4])
+
+    with tempfile.TemporaryDirectory() as strPathTmp:
+        strPathIn = os.path.join(strPathTmp, 'movie.npy')
+        strPathOut = os.path.join(strPathTmp, 'movie_pix.npy')
+        aryTmp = np.lib.format.open_memmap(strPathIn, mode='w+',
+                                           dtype=np.uint8, shape=tplShp)
+        objRng = np.random.default_rng(0)
+        for idxFrm in range(varNumFrm):
+            aryTmp[idxFrm] = objRng.integers(0, 256, size=tplShp[1:],
+                                             dtype=np.uint8)
+        del aryTmp
+
+        dicRes = funcCorrectStack(strPathIn, strPathOut, vecPrm,
+                                  strRng='dtype')
+        print(str(dicRes['frames']) + ' frames (' + str(tplShp[2]) + ' x '
+              + str(tplShp[1]) + ') in ' + str(np.around(dicRes['seconds'], 2))
+              + ' s, ' + str(np.around(dicRes['fps'], 1)) + ' frames/s')
+# *****************************************************************************
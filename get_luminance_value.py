@@ -6,36 +6,31 @@ obtained from fit_luminance.py.
 """
 
 import numpy as np
+from calibration_store import funcStoreQuery
+from luminance import funcLum
 # from scipy.optimize import minimize
 
 
 # %% Set parameters
 
-# Pixel intensity:
+# Pixel intensity (single value, or array of values, e.g. a stimulus frame):
 varPix = -1.0
 
-# Fitted parameter values:
-varA = -195.9
-varB = 246.3
-varC = 887.4
-varD = 454.4
-
-
-def funcPoly3(varX, varA, varB, varC, varD):
-    """3rd deg. polynomial function, relating luminance to pixel intensity."""
+# Display configuration and date (the calibration that applies at this date
+# is taken from the calibration store, see calibration_store.py):
+strDisplay = '7T'
+strCoil = 'NOVA'
+strFilter = 'ND.3'
+strDate = '2018-09-13'
 
-    varOut = (varA * np.power(varX, 3.0)
-              + varB * np.power(varX, 2.0)
-              + varC * np.power(varX, 1.0)
-              + varD)
-
-    return varOut
+# Fitted parameter values:
+vecPrm, dicCal = funcStoreQuery(strDisplay, strCoil, strFilter, strDate)
 
 
 # %%  Calculate luminance
 
 # Luminance for current pixel value:
-varCd = funcPoly3(varPix, varA, varB, varC, varD)
+varCd = funcLum(varPix, vecPrm)
 
 varCd = np.around(varCd, 2)
 
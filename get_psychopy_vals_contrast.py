@@ -7,38 +7,34 @@ script as to obtain the target contrast.
 """
 
 import numpy as np
+from calibration_store import funcStoreQuery
+from contrast import funcCntrPix
 
 # %% Set parameters
 
 # set target contrast value
 trgCntr = 0.05
 
-# set fitted values for function
-b0 = 431.3
-b1 = 839.3
-b2 = 227.0
-b3 = -190.2
+# set display configuration and date (the calibration that applies at this
+# date is taken from the calibration store, see calibration_store.py)
+strDisplay = '7T'
+strCoil = 'vision'
+strFilter = 'ND.3'
+strDate = '2018-09-13'
 
-
-def calc_cntr(x, b0, b1, b2, b3):
-    """Calculate contrast for given parameters of a polynomical function."""
-    # get intensity
-    I1 = b3 * np.power(x, 3.0) + b2 * np.power(x, 2.0) + b1 * x + b0
-    I2 = b3 * np.power(-x, 3.0) + b2 * np.power(-x, 2.0) + b1 * -x + b0
-
-    # calculate contrast
-    cntr = (I1 - I2) / (I1 + I2)
-
-    return cntr
+# get fitted values for function (highest degree first)
+vecPrm, dicCal = funcStoreQuery(strDisplay, strCoil, strFilter, strDate)
 
 # %%  Calculate psychopy color value
-tempdiff = np.ones(10000)
-for ind, x in enumerate(np.linspace(0.0, 1.0, 10000)):
-    cntr = calc_cntr(x, b0, b1, b2, b3)
-    tempdiff[ind] = np.abs(cntr - trgCntr)
 
-out_x = np.linspace(0.0, 1.0, 10000)[np.argmin(tempdiff)]
-out_x = np.round(out_x, 2)
+# Pixel values for a pair of luminance values centred on the background
+# luminance (mid-grey), with the target (Michelson) contrast. Target contrast
+# and background can also be arrays and other pixel values (see
+# contrast.funcCntrPix).
+out_x1, out_x2 = funcCntrPix(trgCntr, vecPrm, varBckPix=0.0,
+                             strDef='michelson')
+out_x1 = np.round(out_x1, 4)
+out_x2 = np.round(out_x2, 4)
 
 print("Given the target value: " + str(trgCntr))
-print("Psychopy should be set to: " + str(-out_x) + " and " + str(out_x))
+print("Psychopy should be set to: " + str(out_x1) + " and " + str(out_x2))
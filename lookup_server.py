@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local lookup server for luminance, pixel intensity, and contrast conversions.
+
+A long-running process that keeps calibrations (see calibration_store.py)
+and lookup tables (see luminance_lut.py) in memory, and answers conversion
+requests from experiment processes. Experiment scripts thus neither import
+scipy nor compute calibrations or tables during a run. The server uses
+asyncio, so that several clients (e.g. experiment and monitoring processes)
+can be connected at the same time.
+
+The protocol is newline-delimited JSON over a Unix socket (default) or a TCP
+socket on localhost. A request is one JSON object per line, for instance
+
+    {"op": "pix", "values": [100.0, 200.0], "coil": "NOVA"}
+
+with the fields
+
+    op          'lum' (pixel intensity to luminance), 'pix' (luminance to
+                pixel intensity), 'contrast' (target contrast to pair of pixel
+                intensities), 'calib' (calibration record and range of the
+                display), or 'ping'
+    values      number or list of numbers
+    display, coil, filter, date
+                calibration in the store (defaults as in psychophysics.py,
+                date defaults to now)
+    prm         polynomial coefficients (instead of the calibration store)
+    strict      fail on values out of range of the display (default: null)
+    lut         resolution of lookup table (8, 10, or 16 bit) for 'lum' and
+                'pix', default: exact calculation
+    definition, bck_pix, bck_lum
+                contrast definition and background (see contrast.py)
+
+The response is one JSON object per line, {"result": ...} (for 'contrast',
+a pair of lists), or {"error": "..."}. Responses are strict JSON: values out
+of range of the display are null (`np.asarray(result, dtype=float)` turns
+them into NaN). Responses are sent in the order of the requests, so that
+several requests can be sent before reading the responses.
+
+Start the server with
+
+    python lookup_server.py [--socket PATH | --port PORT]
+
+and use `LookupClient` from the experiment script:
+
+    from lookup_server import LookupClient
+    objClnt = LookupClient()
+    vecPix = objClnt.pix([100.0, 200.0], coil='NOVA')
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+# The client only needs the standard library; numpy and the conversion
+# modules are imported by the server.
+import os
+import sys
+import json
+import math
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Default Unix socket:
+strPathSockDef = os.path.join(tempfile.gettempdir(), 'psychophysics.sock')
+
+# Host for TCP connections (local only):
+strHostDef = '127.0.0.1'
+
+# Default calibration (as in psychophysics.py):
+dicCalDef = {'display': '7T', 'coil': 'NOVA', 'filter': 'ND.3'}
+
+# Maximum length of a request line [bytes]:
+varMaxLne = 2 ** 24
+
+# Warm calibrations of the server process (hash of coefficients: dict with
+# coefficients, range of display, and lookup tables; the record in the
+# calibration store is not cached, as several records or requests with
+# coefficients can share a hash):
+dicCalWarm = {}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Server
+
+def funcCalib(dicReq, strPathStore=None):
+    """
+    Warm calibration for a request (loaded on first use).
+
+    Parameters
+    ----------
+    dicReq : dict
+        Request, with polynomial coefficients ('prm'), or display
+        configuration and date for the calibration store.
+    strPathStore : str, optional
+        Directory of calibration store.
+
+    Returns
+    -------
+    dicCal : dict
+        'prm': polynomial coefficients; 'gamut': range of the display (see
+        `luminance.funcGamut`); 'lut': lookup tables loaded so far (keys:
+        kind and resolution).
+    dicRec : dict or None
+        Record of the calibration in the store for this request (None for
+        coefficients given in the request).
+    """
+    import numpy as np
+    from calibration_store import funcStoreQuery
+    from luminance import funcGamut
+    from luminance_lut import funcPrmHash
+
+    if dicReq.get('prm') is not None:
+        vecPrm = np.asarray(dicReq['prm'], dtype=np.float64).ravel()
+        dicRec = None
+    else:
+        # The store is indexed in memory, and only reloaded if it changes on
+        # disk, so the query is cheap:
+        vecPrm, dicRec = funcStoreQuery(
+            dicReq.get('display', dicCalDef['display']),
+            dicReq.get('coil', dicCalDef['coil']),
+            dicReq.get('filter', dicCalDef['filter']),
+            dicReq.get('date'), strPathStore=strPathStore)
+
+    strHash = funcPrmHash(vecPrm)
+    if strHash not in dicCalWarm:
+        dicCalWarm[strHash] = {'prm': vecPrm,
+                               'gamut': funcGamut(vecPrm),
+                               'lut': {}}
+
+    return dicCalWarm[strHash], dicRec
+
+
+def funcCalibLut(dicCal, varBit, strKnd, strPathStore=None):
+    """Lookup table of a warm calibration, held in memory (with slopes)."""
+    import numpy as np
+    from calibration_store import funcStoreLoad
+    from luminance_lut import funcLutLoad, funcLutSlope
+
+    tplKey = (strKnd, int(varBit))
+    if tplKey not in dicCal['lut']:
+        # Tables are cached on disk next to the calibrations:
+        vecLut, varLo, varHi = funcLutLoad(
+            dicCal['prm'], varBit=varBit, strKnd=strKnd,
+            strPathCache=funcStoreLoad(strPathStore)['path'])
+        # Copy into memory, so that lookups never wait for the disk:
+        dicCal['lut'][tplKey] = (np.array(vecLut), varLo, varHi,
+                                 funcLutSlope(vecLut))
+
+    return dicCal['lut'][tplKey]
+
+
+def funcHandle(dicReq, strPathStore=None):
+    """
+    Answer one request.
+
+    Parameters
+    ----------
+    dicReq : dict
+        Request (see module docstring).
+    strPathStore : str, optional
+        Directory of calibration store.
+
+    Returns
+    -------
+    dicRes : dict
+        Response, {'result': ...} or {'error': ...}.
+    """
+    import numpy as np
+
+    try:
+        strOp = dicReq.get('op')
+        if strOp == 'ping':
+            return {'result': 'pong'}
+
+        dicCal, dicRec = funcCalib(dicReq, strPathStore=strPathStore)
+
+        if strOp == 'calib':
+            return {'result': {'prm': dicCal['prm'].tolist(),
+                               'record': dicRec,
+                               'gamut': list(dicCal['gamut'])}}
+
+        vecIn = np.asarray(dicReq.get('values', []), dtype=np.float64)
+        lgcStrict = bool(dicReq.get('strict', False))
+        varBit = dicReq.get('lut')
+
+        if strOp in ('lum', 'pix'):
+            strKnd = 'fwd' if strOp == 'lum' else 'inv'
+            if varBit is not None:
+                from luminance_lut import funcLutApply
+                vecLut, varLo, varHi, vecSlp = funcCalibLut(
+                    dicCal, varBit, strKnd, strPathStore=strPathStore)
+                vecOut = funcLutApply(vecIn, vecLut, varLo, varHi,
+                                      lgcStrict=lgcStrict, vecSlp=vecSlp)
+            elif strOp == 'lum':
+                from luminance import funcLum
+                vecOut = funcLum(vecIn, dicCal['prm'], dtype=np.float64)
+            else:
+                from luminance import funcPix
+                vecOut = funcPix(vecIn, dicCal['prm'], lgcStrict=lgcStrict)
+            return {'result': np.asarray(vecOut, dtype=np.float64).tolist()}
+
+        if strOp == 'contrast':
+            from contrast import funcCntrPix
+            vecPix1, vecPix2 = funcCntrPix(
+                vecIn, dicCal['prm'], varBckPix=dicReq.get('bck_pix'),
+                varBckCd=dicReq.get('bck_lum'),
+                strDef=dicReq.get('definition', 'michelson'),
+                lgcStrict=lgcStrict)
+            return {'result': [np.asarray(vecPix1).tolist(),
+                               np.asarray(vecPix2).tolist()]}
+
+        return {'error': 'Unknown operation: ' + str(strOp)}
+
+    except (ValueError, LookupError, TypeError, KeyError,
+            OSError) as objErr:
+        # OSError: reading the store, or writing lookup tables to the cache
+        return {'error': str(objErr)}
+
+
+def funcJsonNull(objVal):
+    """Non-finite numbers replaced by None (null in JSON), recursively."""
+    if isinstance(objVal, float):
+        return objVal if math.isfinite(objVal) else None
+    if isinstance(objVal, (list, tuple)):
+        return [funcJsonNull(objTmp) for objTmp in objVal]
+    if isinstance(objVal, dict):
+        return {objKey: funcJsonNull(objTmp)
+                for objKey, objTmp in objVal.items()}
+    return objVal
+
+
+def funcDumps(dicRes):
+    """Response as strict JSON (NaN and infinity as null)."""
+    try:
+        return json.dumps(dicRes, allow_nan=False)
+    except ValueError:
+        return json.dumps(funcJsonNull(dicRes), allow_nan=False)
+
+
+async def funcServeClient(objRdr, objWrt, strPathStore=None):
+    """Answer requests of one client, until it disconnects."""
+    try:
+        while True:
+            try:
+                bytLne = await objRdr.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                objWrt.write(b'{"error": "Request too long"}\n')
+                break
+            if not bytLne:
+                break
+            if not bytLne.strip():
+                continue
+            try:
+                dicReq = json.loads(bytLne)
+            except ValueError as objErr:
+                dicRes = {'error': 'Invalid request: ' + str(objErr)}
+            else:
+                if isinstance(dicReq, dict):
+                    dicRes = funcHandle(dicReq, strPathStore=strPathStore)
+                else:
+                    dicRes = {'error': 'Request must be a JSON object'}
+            objWrt.write(funcDumps(dicRes).encode('utf-8') + b'\n')
+            await objWrt.drain()
+    except ConnectionError:
+        pass
+    finally:
+        objWrt.close()
+
+
+def funcWarm(varBit=None, strPathStore=None):
+    """
+    Load all calibrations of the store (and their lookup tables) into memory.
+
+    Returns
+    -------
+    varNumCal : int
+        Number of calibrations loaded.
+    """
+    from calibration_store import funcStoreLoad
+
+    dicStore = funcStoreLoad(strPathStore)
+    for dicRec in dicStore['index']:
+        dicCal, _ = funcCalib({'display': dicRec['display'],
+                               'coil': dicRec['coil'],
+                               'filter': dicRec['filter'],
+                               'date': dicRec['date']},
+                              strPathStore=strPathStore)
+        if varBit is not None:
+            for strKnd in ('fwd', 'inv'):
+                funcCalibLut(dicCal, varBit, strKnd,
+                             strPathStore=strPathStore)
+
+    return len(dicStore['index'])
+
+
+async def funcServeAsync(strPathSock=None, varPort=None, strPathStore=None):
+    """Run the server until cancelled."""
+    async def funcCb(objRdr, objWrt):
+        await funcServeClient(objRdr, objWrt, strPathStore=strPathStore)
+
+    if varPort is not None:
+        objSrv = await asyncio.start_server(funcCb, host=strHostDef,
+                                            port=varPort, limit=varMaxLne)
+    else:
+        # Remove socket of a previous server that did not shut down cleanly:
+        if os.path.exists(strPathSock):
+            os.remove(strPathSock)
+        objSrv = await asyncio.start_unix_server(funcCb, path=strPathSock,
+                                                 limit=varMaxLne)
+
+    # Shut down cleanly on SIGTERM (e.g. from a process manager), as on
+    # Ctrl+C:
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel)
+
+    async with objSrv:
+        await objSrv.serve_forever()
+
+
+def funcServe(strPathSock=None, varPort=None, varBit=None,
+              strPathStore=None):
+    """
+    Warm up and run the server (blocks until interrupted).
+
+    Parameters
+    ----------
+    strPathSock : str, optional
+        Path of Unix socket (default: `strPathSockDef`). Ignored if `varPort`
+        is given.
+    varPort : int, optional
+        TCP port on localhost.
+    varBit : int, optional
+        Resolution of lookup tables to load at startup (8, 10, or 16 bit).
+    strPathStore : str, optional
+        Directory of calibration store.
+    """
+    if (varPort is None) and (strPathSock is None):
+        strPathSock = strPathSockDef
+
+    varNumCal = funcWarm(varBit=varBit, strPathStore=strPathStore)
+    sys.stderr.write('lookup_server: ' + str(varNumCal) + ' calibration(s) '
+                     + 'loaded, listening on '
+                     + (strPathSock if varPort is None
+                        else (strHostDef + ':' + str(varPort))) + '\n')
+
+    try:
+        asyncio.run(funcServeAsync(strPathSock=strPathSock, varPort=varPort,
+                                   strPathStore=strPathStore))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        if (varPort is None) and os.path.exists(strPathSock):
+            os.remove(strPathSock)
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Client
+
+class LookupClient(object):
+    """
+    Blocking client of the lookup server (standard library only).
+
+    Parameters
+    ----------
+    strPathSock : str, optional
+        Path of Unix socket (default: `strPathSockDef`). Ignored if `varPort`
+        is given.
+    varPort : int, optional
+        TCP port on localhost.
+    varTmeOut : float, optional
+        Timeout of connection and requests [s].
+    """
+
+    def __init__(self, strPathSock=None, varPort=None, varTmeOut=5.0):
+        if varPort is not None:
+            self.objSck = socket.create_connection((strHostDef, varPort),
+                                                   timeout=varTmeOut)
+            # Requests are small, send them without delay:
+            self.objSck.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.objSck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.objSck.settimeout(varTmeOut)
+            self.objSck.connect(strPathSock or strPathSockDef)
+        self.objFle = self.objSck.makefile('rb')
+
+    def request(self, dicReq):
+        """Send one request, return result (raises ValueError on error)."""
+        self.objSck.sendall(json.dumps(dicReq).encode('utf-8') + b'\n')
+        dicRes = json.loads(self.objFle.readline())
+        if 'error' in dicRes:
+            raise ValueError(dicRes['error'])
+        return dicRes['result']
+
+    def lum(self, values, **kwargs):
+        """Pixel intensity to luminance (see module docstring for kwargs)."""
+        return self.request(dict(kwargs, op='lum', values=values))
+
+    def pix(self, values, **kwargs):
+        """Luminance to pixel intensity (see module docstring for kwargs)."""
+        return self.request(dict(kwargs, op='pix', values=values))
+
+    def contrast(self, values, **kwargs):
+        """Target contrast to pair of pixel intensities."""
+        return self.request(dict(kwargs, op='contrast', values=values))
+
+    def close(self):
+        """Close connection."""
+        self.objFle.close()
+        self.objSck.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Run server
+
+if __name__ == '__main__':
+
+    objParser = argparse.ArgumentParser(
+        description='Lookup server for luminance conversions.')
+    objParser.add_argument('--socket', default=None,
+                           help='Unix socket (default: ' + strPathSockDef
+                           + ').')
+    objParser.add_argument('--port', type=int, default=None,
+                           help='TCP port on localhost (instead of socket).')
+    objParser.add_argument('--lut', type=int, default=None,
+                           help='Load lookup tables of this resolution at '
+                           + 'startup (8, 10, or 16 bit).')
+    objParser.add_argument('--store', default=None,
+                           help='Directory of calibration store.')
+    objArgs = objParser.parse_args()
+
+    funcServe(strPathSock=objArgs.socket, varPort=objArgs.port,
+              varBit=objArgs.lut, strPathStore=objArgs.store)
+# *****************************************************************************
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+Convert between psychopy pixel intensities and luminance, for whole arrays.
+
+The luminance function is a polynomial in the psychopy pixel intensity (e.g.
+the 3rd degree polynomial obtained from fit_luminance.py). Polynomial
+coefficients are passed as a sequence, starting with the highest degree (i.e.
+`(varA, varB, varC, varD)` for `y = A * x^3 + B * x^2 + C * x + D`, same order
+as for `numpy.polyval`).
+
+Arrays are processed in chunks (Horner scheme, in place), so that the memory
+overhead does not depend on the size of the input (e.g. a full movie
+stimulus).
+
+The inverse (pixel intensity for a target luminance) is solved to machine
+precision with a bracketed Newton iteration on the monotonic segment of the
+luminance function within [-1, 1] (see `funcGamut`). Target luminances outside
+of that segment are reported, not clamped.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import numpy as np
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Number of elements processed at once (size of the temporary buffers):
+varSzeChnk = 65536
+
+# Range of psychopy pixel intensities:
+tplPixRng = (-1.0, 1.0)
+
+# Maximum number of iterations for the inverse (bisection alone would need
+# about 55 iterations to reach machine precision on [-1, 1]):
+varMaxItr = 100
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcPoly3(varX, varA, varB, varC, varD):
+    """3rd deg. polynomial function, relating luminance to pixel intensity."""
+    varOut = ((varA * varX + varB) * varX + varC) * varX + varD
+    return varOut
+
+
+def funcLum(aryPix, vecPrm, out=None, dtype=None, varChnk=varSzeChnk):
+    """
+    Calculate luminance for an array of psychopy pixel intensities.
+
+    Parameters
+    ----------
+    aryPix : array_like
+        Psychopy pixel intensities (between -1 and +1), of any shape (single
+        value, frame, stack of frames, RGB, ...).
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    out : np.ndarray, optional
+        Output array, same shape as `aryPix`. If provided, the result is
+        written into `out` (no new array is allocated).
+    dtype : np.dtype, optional
+        Floating point precision of the calculation (e.g. `np.float32`). By
+        default, the dtype of `out` is used if provided, otherwise float32
+        input stays float32 and everything else is calculated in float64.
+    varChnk : int
+        Number of elements processed at once.
+
+    Returns
+    -------
+    out : np.ndarray
+        Luminance [cd/m^2], same shape as `aryPix`.
+    """
+    aryPix = np.asarray(aryPix)
+    lgcScl = (aryPix.ndim == 0) and (out is None)
+
+    if dtype is None:
+        if out is not None:
+            dtype = out.dtype
+        else:
+            dtype = np.result_type(aryPix.dtype, np.float32)
+    dtype = np.dtype(dtype)
+
+    if out is None:
+        out = np.empty(aryPix.shape, dtype=dtype)
+    elif out.shape != aryPix.shape:
+        raise ValueError('Shape of output array ' + str(out.shape)
+                         + ' does not match input ' + str(aryPix.shape))
+
+    # Coefficients in the precision of the calculation (to avoid upcasting of
+    # float32 arrays):
+    vecPrm = np.asarray(vecPrm, dtype=dtype).ravel()
+
+    # The iterator takes care of non-contiguous input and output, and of
+    # casting, chunk by chunk:
+    objIt = np.nditer([aryPix, out],
+                      flags=['external_loop', 'buffered', 'zerosize_ok',
+                             'grow_inner'],
+                      op_flags=[['readonly'], ['writeonly']],
+                      op_dtypes=[dtype, dtype],
+                      casting='same_kind',
+                      buffersize=varChnk)
+
+    with objIt:
+        for vecTmpPix, vecTmpCd in objIt:
+            # Horner scheme, in place on the output chunk:
+            vecTmpCd[...] = vecPrm[0]
+            for varPrm in vecPrm[1:]:
+                np.multiply(vecTmpCd, vecTmpPix, out=vecTmpCd)
+                np.add(vecTmpCd, varPrm, out=vecTmpCd)
+
+    if lgcScl:
+        return out[()]
+    return out
+
+
+def funcFrameStats(aryFrm, vecPrm, dtype=None, varChnk=varSzeChnk):
+    """
+    Calculate luminance statistics for each frame of a stimulus.
+
+    Parameters
+    ----------
+    aryFrm : array_like
+        Stack of frames, psychopy pixel intensities, first axis is time (e.g.
+        frames x height x width, or frames x height x width x RGB). Can be a
+        memory mapped array; only one frame at a time is converted.
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    dtype : np.dtype, optional
+        Floating point precision of the calculation (see `funcLum`).
+    varChnk : int
+        Number of elements processed at once.
+
+    Returns
+    -------
+    dicStats : dict
+        Per-frame mean, standard deviation, minimum and maximum luminance
+        [cd/m^2] (keys 'mean', 'std', 'min', 'max'), each a vector with one
+        entry per frame.
+    """
+    varNumFrm = aryFrm.shape[0]
+
+    if dtype is None:
+        dtype = np.result_type(aryFrm.dtype, np.float32)
+
+    dicStats = {'mean': np.zeros(varNumFrm),
+                'std': np.zeros(varNumFrm),
+                'min': np.zeros(varNumFrm),
+                'max': np.zeros(varNumFrm)}
+
+    # Buffer for luminance of one frame, reused for all frames:
+    aryCd = np.empty(aryFrm.shape[1:], dtype=dtype)
+
+    for idxFrm in range(varNumFrm):
+        funcLum(aryFrm[idxFrm], vecPrm, out=aryCd, varChnk=varChnk)
+        dicStats['mean'][idxFrm] = np.mean(aryCd, dtype=np.float64)
+        dicStats['std'][idxFrm] = np.std(aryCd, dtype=np.float64)
+        dicStats['min'][idxFrm] = np.min(aryCd)
+        dicStats['max'][idxFrm] = np.max(aryCd)
+
+    return dicStats
+
+
+def funcGamut(vecPrm):
+    """
+    Find the monotonic segment of the luminance function within [-1, 1].
+
+    Parameters
+    ----------
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+
+    Returns
+    -------
+    varPixLo, varPixHi : float
+        Pixel intensities at the lower and upper end of the monotonic segment.
+        If the fitted function is not monotonic on [-1, 1] (e.g. the NOVA coil
+        cubic has a local minimum at about -0.88), the segment spanning the
+        largest luminance range is used.
+    varCdLo, varCdHi : float
+        Luminance [cd/m^2] at `varPixLo` and `varPixHi`, respectively.
+    """
+    vecPrm = np.asarray(vecPrm, dtype=np.float64).ravel()
+
+    # Stationary points within the pixel range:
+    lstEdge = list(tplPixRng)
+    if vecPrm.size > 2:
+        vecRoot = np.roots(np.polyder(vecPrm))
+        for varRoot in np.real(vecRoot[np.isreal(vecRoot)]):
+            if tplPixRng[0] < varRoot < tplPixRng[1]:
+                lstEdge.append(varRoot)
+    vecEdge = np.unique(lstEdge)
+
+    # Monotonic segment with the largest luminance range:
+    vecCdEdge = np.polyval(vecPrm, vecEdge)
+    idxSeg = int(np.argmax(np.abs(np.diff(vecCdEdge))))
+
+    return (float(vecEdge[idxSeg]), float(vecEdge[idxSeg + 1]),
+            float(vecCdEdge[idxSeg]), float(vecCdEdge[idxSeg + 1]))
+
+
+def funcPix(aryCd, vecPrm, lgcStrict=True):
+    """
+    Calculate psychopy pixel intensities for an array of target luminances.
+
+    Parameters
+    ----------
+    aryCd : array_like
+        Target luminance values [cd/m^2], of any shape.
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    lgcStrict : bool
+        If True, a ValueError is raised if any target luminance is outside of
+        the range of the display (see `funcGamut`). If False, NaN is returned
+        for those targets.
+
+    Returns
+    -------
+    aryPix : np.ndarray
+        Psychopy pixel intensities (float64), same shape as `aryCd`.
+    """
+    aryCd = np.asarray(aryCd, dtype=np.float64)
+    vecPrm = np.asarray(vecPrm, dtype=np.float64).ravel()
+    vecDer = np.polyder(vecPrm)
+
+    varPixLo, varPixHi, varCdLo, varCdHi = funcGamut(vecPrm)
+
+    # Luminance decreasing with pixel intensity (not expected for a display,
+    # but the inverse is still well defined):
+    lgcDec = varCdHi < varCdLo
+
+    # Targets outside of the display range (including NaN):
+    lgcOut = ~((aryCd >= min(varCdLo, varCdHi))
+               & (aryCd <= max(varCdLo, varCdHi)))
+
+    if np.any(lgcOut):
+        if lgcStrict:
+            raise ValueError(str(np.sum(lgcOut)) + ' target luminance(s) '
+                             + 'out of gamut, range of display is '
+                             + str(min(varCdLo, varCdHi)) + ' to '
+                             + str(max(varCdLo, varCdHi)) + ' cd/m^2')
+        aryCd = np.where(lgcOut, varCdLo, aryCd)
+
+    # Bracket and initial guess (linear interpolation between the ends of the
+    # monotonic segment):
+    aryLo = np.full(aryCd.shape, varPixLo)
+    aryHi = np.full(aryCd.shape, varPixHi)
+    if varCdHi != varCdLo:
+        aryPix = varPixLo + ((aryCd - varCdLo) / (varCdHi - varCdLo)
+                             * (varPixHi - varPixLo))
+    else:
+        aryPix = 0.5 * (aryLo + aryHi)
+
+    # Bracketed Newton iteration: Newton steps that leave the bracket are
+    # replaced by bisection steps.
+    varTol = 4.0 * np.finfo(np.float64).eps
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for idxItr in range(varMaxItr):
+            aryRes = funcLum(aryPix, vecPrm) - aryCd
+            lgcAbv = (aryRes > 0.0) != lgcDec
+            aryHi = np.where(lgcAbv, aryPix, aryHi)
+            aryLo = np.where(lgcAbv, aryLo, aryPix)
+            aryNew = aryPix - aryRes / funcLum(aryPix, vecDer)
+            lgcBsc = ~((aryNew > aryLo) & (aryNew < aryHi))
+            aryNew = np.where(lgcBsc, 0.5 * (aryLo + aryHi), aryNew)
+            lgcCnv = np.abs(aryNew - aryPix) <= varTol
+            aryPix = aryNew
+            if np.all(lgcCnv):
+                break
+
+    aryPix[lgcOut] = np.nan
+
+    if aryPix.ndim == 0:
+        return aryPix[()]
+    return aryPix
+# *****************************************************************************
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+
+"""
+Monotone interpolation of luminance measurements (calibration without model).
+
+Instead of fitting a global function (e.g. the 3rd degree polynomial from
+fit_luminance.py, which is not necessarily monotonic on [-1, 1]), the mean
+luminance per pixel intensity is interpolated:
+
+- 'pchip': piecewise cubic Hermite interpolation with the slopes of Fritsch &
+  Carlson (as `scipy.interpolate.PchipInterpolator`), which is monotonic
+  between knots when the knots are monotonic,
+- 'linear': piecewise linear interpolation.
+
+Measurement noise can make the means non-monotonic (e.g. at the dark end of
+the range). The means are therefore first replaced by their isotonic
+regression (pool adjacent violators), so that the interpolant is monotonic
+and its inverse is well defined.
+
+Forward and inverse are vectorised: the segment of each value is found with
+`np.searchsorted` on the knots (pixel intensities for the forward, luminance
+for the inverse), and evaluated in closed form (linear), or solved for the
+position within the segment with a bracketed Newton iteration on the cubic
+of that segment (pchip, converges to machine precision in a few iterations,
+because the cubic is monotonic on the segment).
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import numpy as np
+from luminance import varSzeChnk, varMaxItr
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Kinds of interpolation:
+tplKind = ('pchip', 'linear')
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Fitting
+
+def funcPava(vecY, vecW):
+    """
+    Isotonic (non-decreasing) regression, pool adjacent violators.
+
+    Parameters
+    ----------
+    vecY : np.ndarray
+        Values, in order of the independent variable.
+    vecW : np.ndarray
+        Weights (e.g. number of readings per value).
+
+    Returns
+    -------
+    vecIso : np.ndarray
+        Non-decreasing values closest to `vecY` (weighted least squares).
+    """
+    # Blocks of pooled values (mean, weight, number of values):
+    lstAvg = []
+    lstWgt = []
+    lstCnt = []
+    for varY, varW in zip(vecY, vecW):
+        lstAvg.append(float(varY))
+        lstWgt.append(float(varW))
+        lstCnt.append(1)
+        # Merge with preceding blocks while they violate the order:
+        while (len(lstAvg) > 1) and (lstAvg[-2] > lstAvg[-1]):
+            varW = lstWgt[-2] + lstWgt[-1]
+            lstAvg[-2] = (lstAvg[-2] * lstWgt[-2]
+                          + lstAvg[-1] * lstWgt[-1]) / varW
+            lstWgt[-2] = varW
+            lstCnt[-2] += lstCnt[-1]
+            del lstAvg[-1], lstWgt[-1], lstCnt[-1]
+    return np.repeat(lstAvg, lstCnt)
+
+
+def funcSlopes(vecX, vecY):
+    """
+    Slopes at the knots of a monotone piecewise cubic (Fritsch & Carlson).
+
+    Same slopes as `scipy.interpolate.PchipInterpolator`: weighted harmonic
+    mean of the adjacent secants at interior knots (zero at local extrema and
+    on flat segments), and a shape-preserving three-point estimate at the
+    ends.
+    """
+    vecH = np.diff(vecX)
+    vecDlt = np.diff(vecY) / vecH
+    vecD = np.zeros(vecX.size)
+
+    if vecX.size == 2:
+        vecD[:] = vecDlt[0]
+        return vecD
+
+    # Interior knots:
+    vecW1 = 2.0 * vecH[1:] + vecH[:-1]
+    vecW2 = vecH[1:] + 2.0 * vecH[:-1]
+    lgcTmp = (vecDlt[:-1] * vecDlt[1:]) > 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vecD[1:-1] = np.where(lgcTmp,
+                              ((vecW1 + vecW2)
+                               / (vecW1 / vecDlt[:-1] + vecW2 / vecDlt[1:])),
+                              0.0)
+
+    # End knots:
+    for idxKnt, varH0, varH1, varD0, varD1 in (
+            (0, vecH[0], vecH[1], vecDlt[0], vecDlt[1]),
+            (-1, vecH[-1], vecH[-2], vecDlt[-1], vecDlt[-2])):
+        varD = ((2.0 * varH0 + varH1) * varD0 - varH0 * varD1) / (varH0
+                                                                  + varH1)
+        if np.sign(varD) != np.sign(varD0):
+            varD = 0.0
+        elif (np.sign(varD0) != np.sign(varD1)) and (abs(varD)
+                                                     > abs(3.0 * varD0)):
+            varD = 3.0 * varD0
+        vecD[idxKnt] = varD
+
+    return vecD
+
+
+def funcInterpFit(vecInd, vecDep, strKind='pchip'):
+    """
+    Monotone interpolant through measured luminance.
+
+    Parameters
+    ----------
+    vecInd : np.ndarray
+        Pixel intensities.
+    vecDep : np.ndarray
+        Luminance [cd/m^2], mean per pixel intensity, or repetitions x levels
+        (see `luminance_io.funcReadCsv`, missing readings as NaN). Repeated
+        pixel intensities are averaged.
+    strKind : str
+        'pchip' or 'linear'.
+
+    Returns
+    -------
+    dicItp : dict
+        'kind': kind of interpolation; 'x': knots (pixel intensities,
+        increasing); 'y': luminance at the knots (isotonic regression of the
+        means); 'd': slopes at the knots; 'sign': 1.0 if luminance increases
+        with pixel intensity, -1.0 otherwise.
+    """
+    if strKind not in tplKind:
+        raise ValueError('Unknown kind of interpolation: ' + str(strKind))
+
+    vecInd = np.asarray(vecInd, dtype=np.float64).ravel()
+    aryDep = np.atleast_2d(np.asarray(vecDep, dtype=np.float64))
+
+    # Mean and number of readings per pixel intensity:
+    vecX, vecInv = np.unique(vecInd, return_inverse=True)
+    vecSum = np.zeros(vecX.size)
+    vecCnt = np.zeros(vecX.size)
+    lgcFin = np.isfinite(aryDep)
+    np.add.at(vecSum, vecInv, np.sum(np.where(lgcFin, aryDep, 0.0), axis=0))
+    np.add.at(vecCnt, vecInv, np.sum(lgcFin, axis=0))
+    lgcTmp = vecCnt > 0
+    vecX = vecX[lgcTmp]
+    vecCnt = vecCnt[lgcTmp]
+    vecY = vecSum[lgcTmp] / vecCnt
+
+    if vecX.size < 2:
+        raise ValueError('Interpolation requires at least two pixel '
+                         + 'intensities with readings')
+
+    # Isotonic regression in the direction of the overall trend:
+    varSgn = 1.0 if vecY[-1] >= vecY[0] else -1.0
+    vecY = varSgn * funcPava(varSgn * vecY, vecCnt)
+
+    if strKind == 'pchip':
+        vecD = funcSlopes(vecX, vecY)
+    else:
+        vecD = np.diff(vecY) / np.diff(vecX)
+        vecD = np.append(vecD, vecD[-1])
+
+    return {'kind': strKind, 'x': vecX, 'y': vecY, 'd': vecD,
+            'sign': varSgn}
+
+
+def funcInterpGamut(dicItp):
+    """
+    Range of the interpolant.
+
+    Returns
+    -------
+    varPixLo, varPixHi : float
+        Lowest and highest pixel intensity (knots).
+    varCdLo, varCdHi : float
+        Luminance [cd/m^2] at `varPixLo` and `varPixHi`, respectively.
+    """
+    return (float(dicItp['x'][0]), float(dicItp['x'][-1]),
+            float(dicItp['y'][0]), float(dicItp['y'][-1]))
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Forward and inverse
+
+def funcSegment(dicItp, vecIdx):
+    """Knots, widths, and cubic coefficients (in t) of segments."""
+    vecX0 = dicItp['x'][vecIdx]
+    vecH = dicItp['x'][vecIdx + 1] - vecX0
+    vecY0 = dicItp['y'][vecIdx]
+    vecDy = dicItp['y'][vecIdx + 1] - vecY0
+    if dicItp['kind'] == 'linear':
+        return vecX0, vecH, vecY0, vecDy, None, None, None
+    # y(t) = y0 + c t + b t^2 + a t^3, with t = (x - x0) / h:
+    vecC = vecH * dicItp['d'][vecIdx]
+    vecE = vecH * dicItp['d'][vecIdx + 1]
+    vecB = 3.0 * vecDy - 2.0 * vecC - vecE
+    vecA = vecC + vecE - 2.0 * vecDy
+    return vecX0, vecH, vecY0, vecDy, vecA, vecB, vecC
+
+
+def funcInterpLum(aryPix, dicItp, lgcStrict=True, varChnk=varSzeChnk):
+    """
+    Luminance for an array of psychopy pixel intensities.
+
+    Parameters
+    ----------
+    aryPix : array_like
+        Pixel intensities, of any shape.
+    dicItp : dict
+        Interpolant (see `funcInterpFit`).
+    lgcStrict : bool
+        If True, a ValueError is raised if any pixel intensity is outside of
+        the knots. If False, NaN is returned for those values.
+    varChnk : int
+        Number of elements processed at once.
+
+    Returns
+    -------
+    aryCd : np.ndarray
+        Luminance [cd/m^2] (float64), same shape as `aryPix`.
+    """
+    aryPix = np.asarray(aryPix, dtype=np.float64)
+    varPixLo, varPixHi = dicItp['x'][0], dicItp['x'][-1]
+    varNumSeg = dicItp['x'].size - 1
+
+    vecPix = aryPix.ravel()
+    vecCd = np.empty(vecPix.size)
+    varNumOut = 0
+
+    for idxStr in range(0, vecPix.size, varChnk):
+        vecTmp = vecPix[idxStr:idxStr + varChnk]
+        lgcOut = ~((vecTmp >= varPixLo) & (vecTmp <= varPixHi))
+        varNumOut += int(np.sum(lgcOut))
+        vecIdx = np.clip(np.searchsorted(dicItp['x'], vecTmp, side='right')
+                         - 1, 0, varNumSeg - 1)
+        vecX0, vecH, vecY0, vecDy, vecA, vecB, vecC = funcSegment(dicItp,
+                                                                  vecIdx)
+        vecT = (vecTmp - vecX0) / vecH
+        if vecA is None:
+            vecRes = vecY0 + vecDy * vecT
+        else:
+            vecRes = vecY0 + vecT * (vecC + vecT * (vecB + vecT * vecA))
+        vecRes[lgcOut] = np.nan
+        vecCd[idxStr:idxStr + varChnk] = vecRes
+
+    if lgcStrict and (varNumOut > 0):
+        raise ValueError(str(varNumOut) + ' pixel intensit(y/ies) out of '
+                         + 'range of the interpolant, ' + str(varPixLo)
+                         + ' to ' + str(varPixHi))
+
+    aryCd = vecCd.reshape(aryPix.shape)
+    if aryCd.ndim == 0:
+        return aryCd[()]
+    return aryCd
+
+
+def funcInterpPix(aryCd, dicItp, lgcStrict=True, varChnk=varSzeChnk):
+    """
+    Psychopy pixel intensities for an array of target luminances.
+
+    Parameters
+    ----------
+    aryCd : array_like
+        Target luminance values [cd/m^2], of any shape.
+    dicItp : dict
+        Interpolant (see `funcInterpFit`).
+    lgcStrict : bool
+        If True, a ValueError is raised if any target luminance is outside of
+        the range of the interpolant (see `funcInterpGamut`). If False, NaN is
+        returned for those targets.
+    varChnk : int
+        Number of elements processed at once.
+
+    Returns
+    -------
+    aryPix : np.ndarray
+        Psychopy pixel intensities (float64), same shape as `aryCd`. On flat
+        segments (pooled by the isotonic regression), the lowest pixel
+        intensity with the target luminance is returned.
+    """
+    aryCd = np.asarray(aryCd, dtype=np.float64)
+    varSgn = dicItp['sign']
+    # Knots in increasing order of (signed) luminance:
+    vecYs = varSgn * dicItp['y']
+    varCdLo, varCdHi = sorted((dicItp['y'][0], dicItp['y'][-1]))
+    varNumSeg = dicItp['x'].size - 1
+    varTol = 4.0 * np.finfo(np.float64).eps
+
+    vecCd = aryCd.ravel()
+    vecPix = np.empty(vecCd.size)
+    varNumOut = 0
+
+    for idxStr in range(0, vecCd.size, varChnk):
+        vecTmp = vecCd[idxStr:idxStr + varChnk]
+        lgcOut = ~((vecTmp >= varCdLo) & (vecTmp <= varCdHi))
+        varNumOut += int(np.sum(lgcOut))
+        vecIdx = np.clip(np.searchsorted(vecYs, varSgn * vecTmp, side='left')
+                         - 1, 0, varNumSeg - 1)
+        vecX0, vecH, vecY0, vecDy, vecA, vecB, vecC = funcSegment(dicItp,
+                                                                  vecIdx)
+
+        # Position within segment, linear interpolation (exact for linear
+        # segments, initial guess for cubic segments):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vecT = np.where(vecDy != 0.0, (vecTmp - vecY0) / vecDy, 0.0)
+        vecT = np.clip(vecT, 0.0, 1.0)
+
+        if vecA is not None:
+            # Bracketed Newton iteration on the (monotonic) cubic of each
+            # segment, Newton steps that leave the bracket are replaced by
+            # bisection steps:
+            vecLo = np.zeros(vecT.shape)
+            vecHi = np.ones(vecT.shape)
+            vecRhs = varSgn * (vecTmp - vecY0)
+            vecA, vecB, vecC = varSgn * vecA, varSgn * vecB, varSgn * vecC
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for idxItr in range(varMaxItr):
+                    vecRes = (vecT * (vecC + vecT * (vecB + vecT * vecA))
+                              - vecRhs)
+                    lgcAbv = vecRes > 0.0
+                    vecHi = np.where(lgcAbv, vecT, vecHi)
+                    vecLo = np.where(lgcAbv, vecLo, vecT)
+                    vecNew = vecT - vecRes / (vecC + vecT * (2.0 * vecB
+                                                             + vecT * 3.0
+                                                             * vecA))
+                    lgcBsc = ~((vecNew >= vecLo) & (vecNew <= vecHi))
+                    vecNew = np.where(lgcBsc, 0.5 * (vecLo + vecHi), vecNew)
+                    # Exact solutions (e.g. on flat segments) are kept:
+                    vecNew = np.where(vecRes == 0.0, vecT, vecNew)
+                    lgcCnv = np.abs(vecNew - vecT) <= varTol
+                    vecT = vecNew
+                    if np.all(lgcCnv):
+                        break
+
+        vecRes = vecX0 + vecT * vecH
+        vecRes[lgcOut] = np.nan
+        vecPix[idxStr:idxStr + varChnk] = vecRes
+
+    if lgcStrict and (varNumOut > 0):
+        raise ValueError(str(varNumOut) + ' target luminance(s) out of '
+                         + 'gamut, range of interpolant is ' + str(varCdLo)
+                         + ' to ' + str(varCdHi) + ' cd/m^2')
+
+    aryPix = vecPix.reshape(aryCd.shape)
+    if aryPix.ndim == 0:
+        return aryPix[()]
+    return aryPix
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Saving and loading
+
+def funcInterpSave(strPathOut, dicItp):
+    """Save interpolant (`.npz`)."""
+    np.savez(strPathOut, kind=dicItp['kind'], x=dicItp['x'], y=dicItp['y'],
+             d=dicItp['d'], sign=dicItp['sign'])
+
+
+def funcInterpLoad(strPathIn):
+    """Load interpolant saved with `funcInterpSave`."""
+    with np.load(strPathIn) as objNpz:
+        return {'kind': str(objNpz['kind']),
+                'x': objNpz['x'],
+                'y': objNpz['y'],
+                'd': objNpz['d'],
+                'sign': float(objNpz['sign'])}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Comparison with cubic polynomial
+
+if __name__ == '__main__':
+
+    import time
+    from scipy.interpolate import PchipInterpolator
+    from luminance import funcPix
+    from luminance_io import funcReadCsv
+    from luminance_models import funcFit
+
+    for strPathCsv in ['luminance_measurement_20180913/'
+                       + 'Luminance_measurement_7T_NOVA_coil.csv',
+                       'luminance_measurement_20180913/'
+                       + 'Luminance_measurement_7T_vision_coil.csv']:
+        vecInd, aryDep, strTtl = funcReadCsv(strPathCsv)
+        vecDepAvg = np.mean(aryDep, axis=0)
+        print(strTtl)
+
+        for strKind in tplKind:
+            dicItp = funcInterpFit(vecInd, aryDep, strKind=strKind)
+
+            # Same curve as scipy (the means of these sessions are
+            # monotonic):
+            vecTmp = np.linspace(-1.0, 1.0, num=1001)
+            vecCd = funcInterpLum(vecTmp, dicItp)
+            if strKind == 'pchip':
+                assert np.allclose(vecCd, PchipInterpolator(
+                    dicItp['x'], dicItp['y'])(vecTmp))
+            assert np.all(np.diff(vecCd) >= 0.0)
+
+            # Round trip:
+            vecCd = np.random.default_rng(0).uniform(dicItp['y'][0],
+                                                     dicItp['y'][-1],
+                                                     size=10 ** 6)
+            varTme = time.perf_counter()
+            vecPix = funcInterpPix(vecCd, dicItp)
+            varTme = time.perf_counter() - varTme
+            varErr = np.max(np.abs(funcInterpLum(vecPix, dicItp) - vecCd))
+            print('    ' + strKind + ': inverse of 10^6 values in '
+                  + str(np.around(varTme * 1000.0, 1)) + ' ms, maximum '
+                  + 'round trip error ' + ('%.1e' % varErr) + ' cd/m^2')
+
+        # Exact inverse of the cubic polynomial, for comparison:
+        vecPrm = funcFit('poly3', vecInd, vecDepAvg)['prm']
+        varTme = time.perf_counter()
+        funcPix(vecCd, vecPrm, lgcStrict=False)
+        varTme = time.perf_counter() - varTme
+        print('    poly3: inverse of 10^6 values in '
+              + str(np.around(varTme * 1000.0, 1)) + ' ms')
+
+    # Noisy, non-monotonic means are made monotonic (isotonic regression):
+    dicItp = funcInterpFit(vecInd, vecDepAvg
+                           + np.random.default_rng(1).normal(0.0, 20.0,
+                                                             vecInd.size))
+    assert np.all(np.diff(dicItp['y']) >= 0.0)
+    vecPix = funcInterpPix(dicItp['y'], dicItp)
+    print('Knots of noisy measurement recovered: '
+          + str(np.all(funcInterpLum(vecPix, dicItp) == dicItp['y'])))
+# *****************************************************************************
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read luminance measurements from csv files.
+
+Format of the csv files (see luminance_measurement_20180913/): a quoted title
+line, a header row, and one row per pixel intensity, with the pixel intensity
+in the first column and the repeated measurements [cd/m^2] in the following
+columns. Metadata (site, coil, filter, date) are parsed from the title, e.g.
+"Luminance measurement at 7T, NOVA coil, filter = ND.3, date: 13.09.2018".
+
+Measurement files are written with `funcWriteCsv` (e.g. by the automated
+acquisition in photometer.py). They can be read one at a time
+(`funcReadCsv`), streamed from a directory tree (`funcIterSessions`), or
+loaded as a whole archive into columnar arrays (`funcLoadArchive`). The
+archive is cached in a single `.npz` file, and only files that were added or
+changed (modification time and size, optionally content hash) since the last
+load are parsed again.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import re
+import csv
+import fnmatch
+import hashlib
+import tempfile
+import numpy as np
+from luminance_lut import strPathCacheDef
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# File name pattern of measurement files:
+strPtrnCsv = 'Luminance_measurement_*.csv'
+
+# Metadata fields parsed from the title of a measurement:
+tplMeta = ('site', 'coil', 'filter', 'date')
+
+# Patterns for metadata in the title (one per comma-separated item):
+dicPtrnMeta = {'site': re.compile(r'^.*\bat\s+(.+)$'),
+               'coil': re.compile(r'^(.+?)\s+coil$', re.IGNORECASE),
+               'filter': re.compile(r'^filter\s*=\s*(.+)$', re.IGNORECASE),
+               'date': re.compile(r'^date:?\s*(\d{1,2})\.(\d{1,2})\.(\d{4})$',
+                                  re.IGNORECASE)}
+
+# Version of the archive cache format (increase when the layout changes):
+varVerCache = 1
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcFindCsv(strPathIn, strPtrn=strPtrnCsv):
+    """
+    Find measurement files in a directory tree.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Root directory (searched recursively), or path of a single file.
+    strPtrn : str
+        File name pattern.
+
+    Returns
+    -------
+    lstPathCsv : list
+        Sorted list of paths of measurement files.
+    """
+    return sorted(funcIterCsv(strPathIn, strPtrn=strPtrn))
+
+
+def funcIterCsv(strPathIn, strPtrn=strPtrnCsv):
+    """
+    Iterate over measurement files in a directory tree (unsorted, streaming).
+
+    Parameters
+    ----------
+    strPathIn : str
+        Root directory (searched recursively), or path of a single file.
+    strPtrn : str
+        File name pattern.
+
+    Yields
+    ------
+    strPathCsv : str
+        Path of measurement file.
+    """
+    if os.path.isfile(strPathIn):
+        yield strPathIn
+        return
+
+    lstDir = [strPathIn]
+    while lstDir:
+        with os.scandir(lstDir.pop()) as objIt:
+            for objEnt in objIt:
+                if objEnt.is_dir():
+                    lstDir.append(objEnt.path)
+                elif fnmatch.fnmatch(objEnt.name, strPtrn):
+                    yield objEnt.path
+
+
+def funcParseTitle(strTtl):
+    """
+    Parse metadata from the title of a measurement.
+
+    Parameters
+    ----------
+    strTtl : str
+        Title, e.g. "Luminance measurement at 7T, NOVA coil, filter = ND.3,
+        date: 13.09.2018".
+
+    Returns
+    -------
+    dicMeta : dict
+        Site, coil, filter, and date (ISO format, YYYY-MM-DD) of the
+        measurement (empty strings for fields not found in the title).
+    """
+    dicMeta = dict.fromkeys(tplMeta, '')
+    for strItm in strTtl.split(','):
+        strItm = strItm.strip()
+        for strKey in tplMeta:
+            objMtch = dicPtrnMeta[strKey].match(strItm)
+            if (objMtch is None) or dicMeta[strKey]:
+                continue
+            if strKey == 'date':
+                dicMeta[strKey] = '{2}-{1:0>2}-{0:0>2}'.format(
+                    *objMtch.groups())
+            else:
+                dicMeta[strKey] = objMtch.group(1).strip()
+            break
+    return dicMeta
+
+
+def funcReadCsv(strPathCsv):
+    """
+    Read luminance measurement from csv file.
+
+    Parameters
+    ----------
+    strPathCsv : str
+        Path of csv file.
+
+    Returns
+    -------
+    vecInd : np.ndarray
+        Pixel intensities (one per measurement level).
+    aryDep : np.ndarray
+        Measured luminance [cd/m^2], shape repetitions x levels (same layout
+        as `vecDep` in fit_luminance.py).
+    strTtl : str
+        Title of the measurement (first line of the file).
+    """
+    with open(strPathCsv, 'r') as objFle:
+        lstLne = objFle.read().splitlines()
+
+    strTtl = lstLne[0].strip().rstrip(',').strip('"')
+
+    # Numeric rows (after title and header); empty cells are missing
+    # measurements:
+    lstRow = [[(float(strTmp) if strTmp.strip() else np.nan)
+               for strTmp in strLne.split(',')]
+              for strLne in lstLne[2:] if strLne.strip()]
+    aryTmp = np.array(lstRow, dtype=np.float64, ndmin=2)
+
+    vecInd = aryTmp[:, 0]
+    aryDep = aryTmp[:, 1:].T
+
+    # Pixel intensities are saved with two decimals. If they are a rounded
+    # linear sequence (e.g. `np.linspace(-1.0, 1.0, num=17)`), use the exact
+    # values:
+    if vecInd.size > 1:
+        vecLin = np.linspace(vecInd[0], vecInd[-1], num=vecInd.size)
+        if np.allclose(vecLin, vecInd, rtol=0.0, atol=0.0051):
+            vecInd = vecLin
+
+    return vecInd, aryDep, strTtl
+
+
+def funcTitle(dicMeta):
+    """
+    Title of a measurement from metadata (inverse of `funcParseTitle`).
+
+    Parameters
+    ----------
+    dicMeta : dict
+        Site, coil, filter, and date (ISO format, YYYY-MM-DD).
+
+    Returns
+    -------
+    strTtl : str
+        Title, e.g. "Luminance measurement at 7T, NOVA coil, filter = ND.3,
+        date: 13.09.2018".
+    """
+    strYr, strMn, strDy = dicMeta['date'].split('-')
+    return ('Luminance measurement at ' + dicMeta['site'] + ', '
+            + dicMeta['coil'] + ' coil, filter = ' + dicMeta['filter']
+            + ', date: ' + strDy + '.' + strMn + '.' + strYr)
+
+
+def funcWriteCsv(strPathCsv, vecInd, aryDep, strTtl):
+    """
+    Write luminance measurement to csv file (format of `funcReadCsv`).
+
+    The file is written to a temporary file and renamed, so that it can be
+    rewritten after every reading of an ongoing measurement, and readers
+    always see a complete file.
+
+    Parameters
+    ----------
+    strPathCsv : str
+        Path of csv file.
+    vecInd : np.ndarray
+        Pixel intensities (one per measurement level).
+    aryDep : np.ndarray
+        Measured luminance [cd/m^2], shape repetitions x levels. NaN (missing
+        or not yet measured) is written as an empty cell.
+    strTtl : str
+        Title of the measurement.
+    """
+    aryDep = np.asarray(aryDep, dtype=np.float64)
+    lstLne = ['"' + strTtl + '"',
+              ','.join(['Pixel intensity']
+                       + ['Measurement ' + str(idxRep + 1) + ' [cd/m^2]'
+                          for idxRep in range(aryDep.shape[0])])]
+    for idxLvl, varInd in enumerate(vecInd):
+        lstLne.append(','.join(
+            ['%.2f' % varInd]
+            + [('' if np.isnan(varDep) else ('%.2f' % varDep))
+               for varDep in aryDep[:, idxLvl]]))
+
+    strPathDir = os.path.dirname(os.path.abspath(strPathCsv))
+    varFd, strPathTmp = tempfile.mkstemp(suffix='.csv', dir=strPathDir)
+    with os.fdopen(varFd, 'w') as objFle:
+        objFle.write('\n'.join(lstLne) + '\n')
+    os.chmod(strPathTmp, 0o644)
+    os.replace(strPathTmp, strPathCsv)
+
+
+def funcSaveTable(lstRow, strPathOut, lstCol):
+    """
+    Save table (csv, one row per dictionary).
+
+    Parameters
+    ----------
+    lstRow : list
+        Rows, dictionaries with the columns as keys.
+    strPathOut : str or file
+        Path, or an open file (e.g. `sys.stdout`).
+    lstCol : list
+        Columns, in order.
+    """
+    if hasattr(strPathOut, 'write'):
+        objWrt = csv.DictWriter(strPathOut, fieldnames=lstCol)
+        objWrt.writeheader()
+        objWrt.writerows(lstRow)
+        return
+    with open(strPathOut, 'w', newline='') as objFle:
+        objWrt = csv.DictWriter(objFle, fieldnames=lstCol)
+        objWrt.writeheader()
+        objWrt.writerows(lstRow)
+
+
+def funcIterSessions(strPathIn, strPtrn=strPtrnCsv):
+    """
+    Read measurement files from a directory tree, one at a time.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Root directory (searched recursively), or path of a single file.
+    strPtrn : str
+        File name pattern.
+
+    Yields
+    ------
+    strPathCsv : str
+        Path of measurement file.
+    vecInd, aryDep : np.ndarray
+        Pixel intensities and measured luminance (see `funcReadCsv`).
+    dicMeta : dict
+        Title ('title') and metadata parsed from the title (see
+        `funcParseTitle`).
+    """
+    for strPathCsv in funcIterCsv(strPathIn, strPtrn=strPtrn):
+        vecInd, aryDep, strTtl = funcReadCsv(strPathCsv)
+        dicMeta = funcParseTitle(strTtl)
+        dicMeta['title'] = strTtl
+        yield strPathCsv, vecInd, aryDep, dicMeta
+
+
+def funcFileHash(strPathCsv):
+    """Hash of the content of a file."""
+    with open(strPathCsv, 'rb') as objFle:
+        return hashlib.sha1(objFle.read()).hexdigest()
+
+
+def funcLoadArchive(strPathIn, strPathCache=None, lgcHash=False,
+                    strPtrn=strPtrnCsv):
+    """
+    Load all measurement files in a directory tree into columnar arrays.
+
+    The archive is cached. Files whose modification time and size (or, if
+    `lgcHash` is True, content hash) did not change since the last load are
+    taken from the cache, all others are parsed again.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Root directory (searched recursively).
+    strPathCache : str, optional
+        Cache directory (default: `luminance_lut.strPathCacheDef`). If False,
+        no cache is used.
+    lgcHash : bool
+        Compare the content hash of files with the cache, instead of
+        modification time and size (e.g. if modification times are not
+        reliable, after copying an archive).
+    strPtrn : str
+        File name pattern.
+
+    Returns
+    -------
+    dicArc : dict
+        Columnar arrays, sorted by path: 'path', 'title', 'site', 'coil',
+        'filter', 'date' (one entry per session); 'ind' (pixel intensities of
+        all sessions, concatenated); 'dep' (measured luminance, levels of all
+        sessions x maximum number of repetitions, NaN-padded); 'offset'
+        (index of the first level of each session in 'ind' and 'dep', plus
+        total number of levels); 'reps' (number of repetitions per session).
+        See `funcArchiveSession` for the data of a single session.
+    """
+    lstPathCsv = sorted(funcIterCsv(strPathIn, strPtrn=strPtrn))
+
+    # Modification time and size of files (and optionally content hash):
+    lstStat = [os.stat(strPathCsv) for strPathCsv in lstPathCsv]
+    vecMtm = np.array([objStat.st_mtime_ns for objStat in lstStat],
+                      dtype=np.int64)
+    vecSze = np.array([objStat.st_size for objStat in lstStat],
+                      dtype=np.int64)
+    vecHsh = np.array([(funcFileHash(strPathCsv) if lgcHash else '')
+                       for strPathCsv in lstPathCsv], dtype='U40')
+
+    # Load previous archive from cache:
+    dicOld = {}
+    if strPathCache is not False:
+        if strPathCache is None:
+            strPathCache = strPathCacheDef
+        strPathCache = os.path.join(strPathCache, 'csv')
+        strPathArc = os.path.join(
+            strPathCache,
+            ('archive_' + hashlib.sha1(os.path.abspath(strPathIn).encode(
+                'utf-8')).hexdigest()[:16] + '.npz'))
+        if os.path.isfile(strPathArc):
+            with np.load(strPathArc) as objNpz:
+                if int(objNpz['version']) == varVerCache:
+                    dicOld = {strKey: objNpz[strKey]
+                              for strKey in objNpz.files}
+
+    # Sessions that can be taken from the cache:
+    dicIdxOld = {}
+    if dicOld:
+        for idxOld, strPathCsv in enumerate(dicOld['path']):
+            dicIdxOld[str(strPathCsv)] = idxOld
+
+    lstSes = []
+    lgcChng = (not dicOld) or (len(dicIdxOld) != len(lstPathCsv))
+    for idxSes, strPathCsv in enumerate(lstPathCsv):
+        idxOld = dicIdxOld.get(strPathCsv)
+        if idxOld is None:
+            lgcOld = False
+        elif lgcHash:
+            lgcOld = dicOld['hash'][idxOld] == vecHsh[idxSes]
+        else:
+            lgcOld = ((dicOld['mtime'][idxOld] == vecMtm[idxSes])
+                      and (dicOld['size'][idxOld] == vecSze[idxSes]))
+        if lgcOld:
+            lstSes.append(funcArchiveSession(dicOld, idxOld))
+            # File was touched, but content did not change (update
+            # modification time in cache):
+            lgcChng = (lgcChng
+                       or (dicOld['mtime'][idxOld] != vecMtm[idxSes])
+                       or (dicOld['hash'][idxOld] != vecHsh[idxSes]))
+        else:
+            lgcChng = True
+            vecInd, aryDep, strTtl = funcReadCsv(strPathCsv)
+            dicMeta = funcParseTitle(strTtl)
+            dicMeta['title'] = strTtl
+            lstSes.append((vecInd, aryDep, dicMeta))
+
+    # Columnar arrays:
+    vecNumLvl = np.array([tplSes[0].size for tplSes in lstSes],
+                         dtype=np.int64)
+    vecNumRep = np.array([tplSes[1].shape[0] for tplSes in lstSes],
+                         dtype=np.int64)
+    vecOff = np.concatenate([[0], np.cumsum(vecNumLvl)]).astype(np.int64)
+    aryDep = np.full((vecOff[-1], max([1] + list(vecNumRep))), np.nan)
+    for idxSes, tplSes in enumerate(lstSes):
+        aryDep[vecOff[idxSes]:vecOff[idxSes + 1], :vecNumRep[idxSes]] = \
+            tplSes[1].T
+
+    dicArc = {'path': np.array(lstPathCsv, dtype=str),
+              'ind': np.concatenate([np.zeros(0)]
+                                    + [tplSes[0] for tplSes in lstSes]),
+              'dep': aryDep,
+              'offset': vecOff,
+              'reps': vecNumRep}
+    for strKey in (('title',) + tplMeta):
+        dicArc[strKey] = np.array([tplSes[2][strKey] for tplSes in lstSes],
+                                  dtype=str)
+
+    # Update cache:
+    if (strPathCache is not False) and lgcChng:
+        if not os.path.isdir(strPathCache):
+            os.makedirs(strPathCache, exist_ok=True)
+        varFd, strPathTmp = tempfile.mkstemp(suffix='.npz', dir=strPathCache)
+        with os.fdopen(varFd, 'wb') as objFle:
+            np.savez(objFle, version=varVerCache, mtime=vecMtm, size=vecSze,
+                     hash=vecHsh, **dicArc)
+        os.replace(strPathTmp, strPathArc)
+
+    return dicArc
+
+
+def funcArchiveSession(dicArc, idxSes):
+    """
+    Data of one session of an archive (see `funcLoadArchive`).
+
+    Returns
+    -------
+    vecInd : np.ndarray
+        Pixel intensities.
+    aryDep : np.ndarray
+        Measured luminance, repetitions x levels.
+    dicMeta : dict
+        Title and metadata of the session.
+    """
+    idxStr = dicArc['offset'][idxSes]
+    idxEnd = dicArc['offset'][idxSes + 1]
+    vecInd = dicArc['ind'][idxStr:idxEnd]
+    aryDep = dicArc['dep'][idxStr:idxEnd, :dicArc['reps'][idxSes]].T
+    dicMeta = {strKey: str(dicArc[strKey][idxSes])
+               for strKey in (('title',) + tplMeta)}
+    return vecInd, aryDep, dicMeta
+# *****************************************************************************
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""
+Precomputed lookup tables (LUTs) for the luminance function and its inverse.
+
+A forward LUT holds the luminance for equally spaced pixel intensities on
+[-1, 1], an inverse LUT holds the pixel intensity for equally spaced luminance
+values across the range of the display (see `luminance.funcGamut`). Tables are
+computed at 8, 10, or 16 bit resolution (256, 1024, or 65536 entries) and
+looked up with linear interpolation. Because the grid is equally spaced, the
+table index is calculated directly, without a search.
+
+Tables are saved as `.npy` files in a cache directory, keyed by a hash of the
+polynomial coefficients, and loaded memory-mapped. Experiment scripts that
+use the same calibration thus share one table on disk, instead of rebuilding
+it at every startup.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+from luminance import funcLum, funcPix, funcGamut, tplPixRng, varSzeChnk
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Default cache directory (can be changed with the environment variable
+# PSYCHOPHYSICS_CACHE):
+strPathCacheDef = os.environ.get(
+    'PSYCHOPHYSICS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'psychophysics'))
+
+# Supported resolutions of the lookup tables [bit]:
+tplLutBit = (8, 10, 16)
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcPrmHash(vecPrm):
+    """Hash of polynomial coefficients, used as key for cached tables."""
+    vecPrm = np.ascontiguousarray(vecPrm, dtype=np.float64).ravel()
+    return hashlib.sha1(vecPrm.tobytes()).hexdigest()[:16]
+
+
+def funcLutRange(vecPrm, strKnd):
+    """
+    Input range covered by a lookup table.
+
+    Parameters
+    ----------
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    strKnd : str
+        'fwd' (pixel intensity to luminance) or 'inv' (luminance to pixel
+        intensity).
+
+    Returns
+    -------
+    varLo, varHi : float
+        Input values corresponding to the first and last table entry.
+    """
+    if strKnd == 'fwd':
+        return tplPixRng
+    elif strKnd == 'inv':
+        varCdLo, varCdHi = funcGamut(vecPrm)[2:]
+        return min(varCdLo, varCdHi), max(varCdLo, varCdHi)
+    raise ValueError('Unknown kind of lookup table: ' + str(strKnd))
+
+
+def funcLutMake(vecPrm, varBit=16, strKnd='inv'):
+    """
+    Calculate a lookup table (without caching).
+
+    Parameters
+    ----------
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    varBit : int
+        Resolution of the table, one of 8, 10, or 16 bit.
+    strKnd : str
+        'fwd' (pixel intensity to luminance) or 'inv' (luminance to pixel
+        intensity).
+
+    Returns
+    -------
+    vecLut : np.ndarray
+        Lookup table (float64), with `2 ** varBit` entries.
+    """
+    if varBit not in tplLutBit:
+        raise ValueError('Resolution of lookup table must be one of '
+                         + str(tplLutBit) + ' bit')
+
+    varLo, varHi = funcLutRange(vecPrm, strKnd)
+    vecGrd = np.linspace(varLo, varHi, num=(2 ** varBit))
+
+    if strKnd == 'fwd':
+        return funcLum(vecGrd, vecPrm, dtype=np.float64)
+    return funcPix(vecGrd, vecPrm)
+
+
+def funcLutLoad(vecPrm, varBit=16, strKnd='inv', strPathCache=None):
+    """
+    Load a lookup table from the cache, create it if it does not exist yet.
+
+    Parameters
+    ----------
+    vecPrm : array_like
+        Polynomial coefficients, highest degree first.
+    varBit : int
+        Resolution of the table, one of 8, 10, or 16 bit.
+    strKnd : str
+        'fwd' (pixel intensity to luminance) or 'inv' (luminance to pixel
+        intensity).
+    strPathCache : str, optional
+        Cache directory, defaults to `strPathCacheDef`.
+
+    Returns
+    -------
+    vecLut : np.memmap
+        Lookup table (read-only, memory mapped).
+    varLo, varHi : float
+        Input values corresponding to the first and last table entry.
+    """
+    if strPathCache is None:
+        strPathCache = strPathCacheDef
+    strPathCache = os.path.join(strPathCache, 'lut')
+
+    strPathLut = os.path.join(strPathCache,
+                              ('lut_' + strKnd + '_' + str(varBit) + 'bit_'
+                               + funcPrmHash(vecPrm) + '.npy'))
+
+    if not os.path.isfile(strPathLut):
+        vecLut = funcLutMake(vecPrm, varBit=varBit, strKnd=strKnd)
+        # Write to temporary file first and rename, so that processes that
+        # build the same table at the same time never see a partial file:
+        if not os.path.isdir(strPathCache):
+            os.makedirs(strPathCache, exist_ok=True)
+        varFd, strPathTmp = tempfile.mkstemp(suffix='.npy', dir=strPathCache)
+        with os.fdopen(varFd, 'wb') as objFle:
+            np.save(objFle, vecLut)
+        os.replace(strPathTmp, strPathLut)
+
+    vecLut = np.load(strPathLut, mmap_mode='r')
+    varLo, varHi = funcLutRange(vecPrm, strKnd)
+
+    return vecLut, varLo, varHi
+
+
+def funcLutSlope(vecLut):
+    """
+    Slopes between neighbouring table entries (last entry: zero).
+
+    Callers that look up many arrays in the same table (e.g. chunks of a
+    stack) calculate the slopes once, and pass them to `funcLutApply`.
+    """
+    return np.diff(np.asarray(vecLut, dtype=np.float64), append=0.0)
+
+
+def funcLutApply(aryIn, vecLut, varLo, varHi, out=None, lgcStrict=True,
+                 varChnk=varSzeChnk, vecSlp=None):
+    """
+    Look up values in a table, with linear interpolation.
+
+    Parameters
+    ----------
+    aryIn : array_like
+        Input values (pixel intensities for a forward table, luminance for an
+        inverse table), of any shape.
+    vecLut : np.ndarray
+        Lookup table (see `funcLutLoad`).
+    varLo, varHi : float
+        Input values corresponding to the first and last table entry.
+    out : np.ndarray, optional
+        Output array, same shape as `aryIn`. Float32 output is supported.
+    lgcStrict : bool
+        If True, a ValueError is raised if any input value is outside of the
+        range of the table. If False, NaN is returned for those values.
+    varChnk : int
+        Number of elements processed at once.
+    vecSlp : np.ndarray, optional
+        Slopes between neighbouring entries (see `funcLutSlope`), calculated
+        if not given.
+
+    Returns
+    -------
+    out : np.ndarray
+        Interpolated table values, same shape as `aryIn`.
+    """
+    aryIn = np.asarray(aryIn)
+    lgcScl = (aryIn.ndim == 0) and (out is None)
+
+    if out is None:
+        out = np.empty(aryIn.shape,
+                       dtype=np.result_type(aryIn.dtype, np.float32))
+    elif out.shape != aryIn.shape:
+        raise ValueError('Shape of output array ' + str(out.shape)
+                         + ' does not match input ' + str(aryIn.shape))
+
+    varMaxIdx = vecLut.shape[0] - 1
+    varScl = varMaxIdx / (varHi - varLo)
+    # Slope between neighbouring entries, so that each lookup only needs one
+    # gather per table:
+    vecLut = np.asarray(vecLut)
+    if vecSlp is None:
+        vecSlp = funcLutSlope(vecLut)
+
+    objIt = np.nditer([aryIn, out],
+                      flags=['external_loop', 'buffered', 'zerosize_ok',
+                             'grow_inner'],
+                      op_flags=[['readonly'], ['writeonly']],
+                      op_dtypes=[np.float64, out.dtype],
+                      casting='same_kind',
+                      buffersize=varChnk)
+
+    with objIt:
+        for vecTmpIn, vecTmpOut in objIt:
+            # Fractional table index:
+            vecPos = (vecTmpIn - varLo) * varScl
+            lgcOut = ~((vecPos >= 0.0) & (vecPos <= varMaxIdx))
+            if np.any(lgcOut):
+                if lgcStrict:
+                    raise ValueError(str(np.sum(lgcOut)) + ' value(s) out '
+                                     + 'of range of lookup table ('
+                                     + str(varLo) + ' to ' + str(varHi)
+                                     + ')')
+                vecPos[lgcOut] = 0.0
+            vecIdx = vecPos.astype(np.intp)
+            np.subtract(vecPos, vecIdx, out=vecPos)
+            np.multiply(vecSlp[vecIdx], vecPos, out=vecPos)
+            np.add(vecPos, vecLut[vecIdx], out=vecTmpOut, casting='unsafe')
+            if np.any(lgcOut):
+                vecTmpOut[lgcOut] = np.nan
+
+    if lgcScl:
+        return out[()]
+    return out
+# *****************************************************************************
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+"""
+Models of projector luminance as a function of psychopy pixel intensity.
+
+The model functions are fitted to luminance measurements by fit_luminance.py
+and fit_luminance_batch.py. Each model is registered in `dicMdl`, with
+
+- 'func': the model function, `func(varX, *parameters)`,
+- 'prm': names of the parameters,
+- 'basis': for models that are linear in their parameters (polynomials, and
+  the logarithmic model), a function returning the design matrix. These
+  models are fitted directly with linear least squares.
+- 'jac': for nonlinear models, the analytic Jacobian (derivatives of the
+  model with respect to the parameters),
+- 'init': for nonlinear models, a function returning starting values for a
+  given dataset,
+- 'bounds': for nonlinear models, a function returning lower and upper
+  bounds of the parameters for a given dataset,
+- 'domain': a function returning which pixel intensities the model is
+  defined for (e.g. only positive values for the logarithmic model),
+- 'label': template and number of decimals for a string representation of
+  the fitted model (see `funcLabel`).
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import warnings
+import numpy as np
+from scipy.optimize import curve_fit, OptimizeWarning
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Model functions
+
+def funcExp(varX, varA, varB, varC):
+    """Exponential function to be fitted to the data."""
+    varOut = varA * np.exp(varB * varX) + varC
+    return varOut
+
+
+def funcLn(varX, varA, varB):
+    """Logarithmic function to be fitted to the data."""
+    varOut = varA * np.log(varX) + varB
+    return varOut
+
+
+def funcPoly2(varX, varA, varB, varC):
+    """2nd degree polynomial function to be fitted to the data."""
+    varOut = (varA * np.power(varX, 2) +
+              varB * np.power(varX, 1) +
+              varC)
+    return varOut
+
+
+def funcPoly3(varX, varA, varB, varC, varD):
+    """3rd degree polynomial function to be fitted to the data."""
+    varOut = (varA * np.power(varX, 3) +
+              varB * np.power(varX, 2) +
+              varC * np.power(varX, 1) +
+              varD)
+    return varOut
+
+
+def funcPow(varX, varA, varB, varC, varD):
+    """Power function to be fitted to the data."""
+    varOut = (varA * np.power((varX + varB), varC) + varD)
+    return varOut
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Jacobians, design matrices, starting values, bounds, and domains
+
+def funcExpJac(varX, varA, varB, varC):
+    """Jacobian of the exponential function."""
+    vecExp = np.exp(varB * varX)
+    return np.stack([vecExp, varA * varX * vecExp, np.ones_like(vecExp)],
+                    axis=-1)
+
+
+def funcPowJac(varX, varA, varB, varC, varD):
+    """Jacobian of the power function."""
+    vecBse = varX + varB
+    vecPow = np.power(vecBse, varC)
+    return np.stack([vecPow,
+                     varA * varC * np.power(vecBse, (varC - 1.0)),
+                     varA * vecPow * np.log(vecBse),
+                     np.ones_like(vecPow)],
+                    axis=-1)
+
+
+def funcLnBasis(vecX):
+    """Design matrix of the logarithmic function."""
+    vecX = np.asarray(vecX, dtype=np.float64)
+    return np.stack([np.log(vecX), np.ones_like(vecX)], axis=-1)
+
+
+def funcPoly2Basis(vecX):
+    """Design matrix of the 2nd degree polynomial function."""
+    vecX = np.asarray(vecX, dtype=np.float64)
+    return np.power(vecX[..., None], np.arange(2, -1, -1))
+
+
+def funcPoly3Basis(vecX):
+    """Design matrix of the 3rd degree polynomial function."""
+    vecX = np.asarray(vecX, dtype=np.float64)
+    return np.power(vecX[..., None], np.arange(3, -1, -1))
+
+
+def funcExpInit(vecX, vecY):
+    """Starting values for the exponential function."""
+    # With a fixed exponent, the remaining parameters are linear:
+    varB = 1.0 / np.ptp(vecX)
+    aryDsgn = np.stack([np.exp(varB * vecX), np.ones_like(vecX)], axis=-1)
+    varA, varC = np.linalg.lstsq(aryDsgn, vecY, rcond=None)[0]
+    return [varA, varB, varC]
+
+
+def funcPowInit(vecX, vecY):
+    """Starting values for the power function."""
+    # Offset slightly below the smallest pixel intensity, and quadratic
+    # exponent; the remaining parameters are linear:
+    varB = 0.01 * np.ptp(vecX) - np.min(vecX)
+    varC = 2.0
+    aryDsgn = np.stack([np.power(vecX + varB, varC), np.ones_like(vecX)],
+                       axis=-1)
+    varA, varD = np.linalg.lstsq(aryDsgn, vecY, rcond=None)[0]
+    return [varA, varB, varC, varD]
+
+
+def funcExpBounds(vecX):
+    """Bounds of the parameters of the exponential function."""
+    return ([-np.inf, -np.inf, -np.inf], [np.inf, np.inf, np.inf])
+
+
+def funcPowBounds(vecX):
+    """Bounds of the parameters of the power function."""
+    # The base of the power has to be positive for all pixel intensities, and
+    # the exponent positive:
+    return ([-np.inf, (1e-6 - np.min(vecX)), 1e-6, -np.inf],
+            [np.inf, np.inf, np.inf, np.inf])
+
+
+def funcDomAll(vecX):
+    """Domain of models defined for all pixel intensities."""
+    return np.isfinite(vecX)
+
+
+def funcDomPos(vecX):
+    """Domain of models defined for positive pixel intensities only."""
+    return np.isfinite(vecX) & (vecX > 0.0)
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Model registry
+
+# Models, in the order in which they are fitted and plotted:
+dicMdl = {'exp': {'func': funcExp,
+                  'prm': ('a', 'b', 'c'),
+                  'basis': None,
+                  'jac': funcExpJac,
+                  'init': funcExpInit,
+                  'bounds': funcExpBounds,
+                  'domain': funcDomAll,
+                  'label': ('y = {} e ^ ( {} * x ) + {}', (0, 2, 0))},
+          'ln': {'func': funcLn,
+                 'prm': ('a', 'b'),
+                 'basis': funcLnBasis,
+                 'jac': None,
+                 'init': None,
+                 'bounds': None,
+                 'domain': funcDomPos,
+                 'label': ('y = {} * ln(x) + {}', (0, 0))},
+          'poly2': {'func': funcPoly2,
+                    'prm': ('a', 'b', 'c'),
+                    'basis': funcPoly2Basis,
+                    'jac': None,
+                    'init': None,
+                    'bounds': None,
+                    'domain': funcDomAll,
+                    'label': ('y = {} * x^2 + {} * x + {}', (2, 2, 2))},
+          'poly3': {'func': funcPoly3,
+                    'prm': ('a', 'b', 'c', 'd'),
+                    'basis': funcPoly3Basis,
+                    'jac': None,
+                    'init': None,
+                    'bounds': None,
+                    'domain': funcDomAll,
+                    'label': ('y = {} * x^3 + {} * x^2 + {} * x + {}',
+                              (1, 1, 1, 1))},
+          'pow': {'func': funcPow,
+                  'prm': ('a', 'b', 'c', 'd'),
+                  'basis': None,
+                  'jac': funcPowJac,
+                  'init': funcPowInit,
+                  'bounds': funcPowBounds,
+                  'domain': funcDomAll,
+                  'label': ('y = {} * (x + {}) ^ {} + {}', (1, 1, 1, 1))}}
+
+# Maximum number of parameters of any model (width of result tables):
+varMaxPrm = max(len(dicTmp['prm']) for dicTmp in dicMdl.values())
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcPred(strMdl, vecX, vecPrm):
+    """
+    Model prediction (NaN for pixel intensities outside of model domain).
+
+    Parameters
+    ----------
+    strMdl : str
+        Model name (key of `dicMdl`).
+    vecX : np.ndarray
+        Pixel intensities.
+    vecPrm : np.ndarray
+        Model parameters.
+
+    Returns
+    -------
+    vecY : np.ndarray
+        Predicted luminance [cd/m^2].
+    """
+    dicTmp = dicMdl[strMdl]
+    vecX = np.asarray(vecX, dtype=np.float64)
+    lgcDom = dicTmp['domain'](vecX)
+    vecY = np.full(vecX.shape, np.nan)
+    with np.errstate(all='ignore'):
+        vecY[lgcDom] = dicTmp['func'](vecX[lgcDom], *vecPrm)
+    return vecY
+
+
+def funcLabel(strMdl, vecPrm):
+    """String representation of a fitted model, e.g. for plot legends."""
+    strTpl, tplDec = dicMdl[strMdl]['label']
+    return strTpl.format(*[str(np.around(varPrm, varDec))
+                           for varPrm, varDec in zip(vecPrm, tplDec)])
+
+
+def funcFit(strMdl, vecX, vecY):
+    """
+    Fit a model to luminance data.
+
+    Models that are linear in their parameters are solved directly with
+    linear least squares, the others with `scipy.optimize.curve_fit` (with
+    analytic Jacobian, starting values, and bounds). Only data points within
+    the domain of the model are used.
+
+    Parameters
+    ----------
+    strMdl : str
+        Model name (key of `dicMdl`).
+    vecX : np.ndarray
+        Pixel intensities.
+    vecY : np.ndarray
+        Luminance [cd/m^2] (e.g. average across repetitions).
+
+    Returns
+    -------
+    dicFit : dict
+        Fitted parameters ('prm'), their covariance ('cov'), residual sum of
+        squares ('rss'), coefficient of determination ('r2'), and number of
+        data points used ('obs'). Parameters are NaN if the fit failed.
+    """
+    dicTmp = dicMdl[strMdl]
+    varNumPrm = len(dicTmp['prm'])
+
+    vecX = np.asarray(vecX, dtype=np.float64)
+    vecY = np.asarray(vecY, dtype=np.float64)
+    lgcDom = dicTmp['domain'](vecX) & np.isfinite(vecY)
+    vecX = vecX[lgcDom]
+    vecY = vecY[lgcDom]
+    varNumObs = vecX.size
+
+    vecPrm = np.full(varNumPrm, np.nan)
+    aryCov = np.full((varNumPrm, varNumPrm), np.nan)
+
+    if varNumObs >= varNumPrm:
+
+        if dicTmp['basis'] is not None:
+            # Linear least squares:
+            aryDsgn = dicTmp['basis'](vecX)
+            vecPrm = np.linalg.lstsq(aryDsgn, vecY, rcond=None)[0]
+            # Covariance scaled by residual variance (same convention as
+            # `curve_fit`):
+            varRss = float(np.sum(np.square(vecY - np.dot(aryDsgn, vecPrm))))
+            if varNumObs > varNumPrm:
+                aryCov = (np.linalg.pinv(np.dot(aryDsgn.T, aryDsgn))
+                          * (varRss / (varNumObs - varNumPrm)))
+            else:
+                aryCov = np.full((varNumPrm, varNumPrm), np.inf)
+
+        else:
+            # Nonlinear least squares:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', OptimizeWarning)
+                warnings.simplefilter('ignore', RuntimeWarning)
+                try:
+                    vecPrm, aryCov = curve_fit(
+                        dicTmp['func'], vecX, vecY,
+                        p0=dicTmp['init'](vecX, vecY),
+                        bounds=dicTmp['bounds'](vecX),
+                        jac=dicTmp['jac'])
+                except (RuntimeError, ValueError):
+                    pass
+
+    with np.errstate(all='ignore'):
+        varRss = float(np.sum(np.square(
+            vecY - dicTmp['func'](vecX, *vecPrm))))
+    varTss = float(np.sum(np.square(vecY - np.mean(vecY))))
+
+    if not np.isfinite(varRss):
+        vecPrm = np.full(varNumPrm, np.nan)
+        aryCov = np.full((varNumPrm, varNumPrm), np.nan)
+        varRss = np.nan
+
+    return {'prm': vecPrm,
+            'cov': aryCov,
+            'rss': varRss,
+            'r2': 1.0 - varRss / varTss,
+            'obs': varNumObs}
+# *****************************************************************************
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental fit of luminance models, as repetitions and sessions arrive.
+
+fit_luminance.py averages all repetitions per pixel intensity, and fits the
+models to these averages. `OnlineFit` gives the same result without storing
+or re-reading earlier repetitions: it keeps running statistics per intensity
+level (number of readings, mean, and sum of squared deviations, Welford's
+algorithm), and for models that are linear in their parameters the normal
+equations of the fit (X'X and X'y of the level means). A new repetition
+changes the mean of its levels, and the normal equations are updated with the
+change, so that the cost of an update does not depend on the number of
+repetitions or sessions seen so far.
+
+Models that are not linear in their parameters are refitted from the level
+means (cost depends on the number of levels, not on the history).
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import numpy as np
+from luminance_models import dicMdl, funcFit
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Decimals to which pixel intensities are rounded to identify levels (the
+# measurement files store two decimals):
+varDecLvl = 6
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Online fit
+
+class OnlineFit(object):
+    """
+    Running fit of luminance models.
+
+    Parameters
+    ----------
+    lstMdl : list, optional
+        Names of the models (default: all models from
+        `luminance_models.dicMdl`).
+    """
+
+    def __init__(self, lstMdl=None):
+        if lstMdl is None:
+            lstMdl = list(dicMdl.keys())
+        self.lstMdl = list(lstMdl)
+
+        # Levels (pixel intensity: index), and running statistics per level:
+        self.dicLvl = {}
+        self.vecInd = np.zeros(0)
+        self.vecCnt = np.zeros(0, dtype=np.int64)
+        self.vecAvg = np.zeros(0)
+        self.vecM2 = np.zeros(0)
+
+        # Normal equations of the linear models (on the level means), and sum
+        # of squared level means (for the residual sum of squares):
+        self.dicNrm = {}
+        for strMdl in self.lstMdl:
+            if dicMdl[strMdl]['basis'] is not None:
+                varNumPrm = len(dicMdl[strMdl]['prm'])
+                self.dicNrm[strMdl] = {'xtx': np.zeros((varNumPrm,
+                                                        varNumPrm)),
+                                       'xty': np.zeros(varNumPrm),
+                                       'yty': 0.0,
+                                       'sy': 0.0,
+                                       'lvl': 0,
+                                       'dsgn': np.zeros((0, varNumPrm))}
+
+    def funcLevel(self, varInd):
+        """Index of a level (new levels are added)."""
+        varKey = round(float(varInd), varDecLvl)
+        idxLvl = self.dicLvl.get(varKey)
+        if idxLvl is not None:
+            return idxLvl
+
+        idxLvl = self.vecInd.size
+        self.dicLvl[varKey] = idxLvl
+        self.vecInd = np.append(self.vecInd, varInd)
+        self.vecCnt = np.append(self.vecCnt, 0)
+        self.vecAvg = np.append(self.vecAvg, 0.0)
+        self.vecM2 = np.append(self.vecM2, 0.0)
+        for strMdl, dicTmp in self.dicNrm.items():
+            vecX = np.array([varInd], dtype=np.float64)
+            if dicMdl[strMdl]['domain'](vecX)[0]:
+                vecB = dicMdl[strMdl]['basis'](vecX)[0]
+            else:
+                # Outside of the model domain, level does not contribute:
+                vecB = np.zeros(dicTmp['xty'].size)
+            dicTmp['dsgn'] = np.vstack([dicTmp['dsgn'], vecB])
+        return idxLvl
+
+    def add(self, vecInd, vecDep):
+        """
+        Add one repetition (readings at one or several levels).
+
+        Parameters
+        ----------
+        vecInd : array_like
+            Pixel intensities.
+        vecDep : array_like
+            Luminance [cd/m^2], NaN for missing readings.
+        """
+        vecInd = np.atleast_1d(np.asarray(vecInd, dtype=np.float64))
+        vecDep = np.atleast_1d(np.asarray(vecDep, dtype=np.float64))
+
+        for varInd, varDep in zip(vecInd, vecDep):
+            if not np.isfinite(varDep):
+                continue
+            idxLvl = self.funcLevel(varInd)
+
+            # Welford update of level statistics:
+            varAvgOld = self.vecAvg[idxLvl]
+            self.vecCnt[idxLvl] += 1
+            varDlt = varDep - varAvgOld
+            varAvgNew = varAvgOld + varDlt / self.vecCnt[idxLvl]
+            self.vecM2[idxLvl] += varDlt * (varDep - varAvgNew)
+            self.vecAvg[idxLvl] = varAvgNew
+
+            # Update normal equations with the change of the level mean:
+            for dicTmp in self.dicNrm.values():
+                vecB = dicTmp['dsgn'][idxLvl]
+                if not np.any(vecB):
+                    continue
+                if self.vecCnt[idxLvl] == 1:
+                    # New level enters the fit:
+                    dicTmp['xtx'] += np.outer(vecB, vecB)
+                    dicTmp['lvl'] += 1
+                dicTmp['xty'] += vecB * (varAvgNew - varAvgOld)
+                dicTmp['yty'] += varAvgNew ** 2 - varAvgOld ** 2
+                dicTmp['sy'] += varAvgNew - varAvgOld
+
+    def add_session(self, vecInd, aryDep):
+        """
+        Add all repetitions of a session.
+
+        Parameters
+        ----------
+        vecInd : np.ndarray
+            Pixel intensities (one per level).
+        aryDep : np.ndarray
+            Luminance [cd/m^2], repetitions x levels (see
+            `luminance_io.funcReadCsv`).
+        """
+        for vecDep in np.atleast_2d(aryDep):
+            self.add(vecInd, vecDep)
+
+    def levels(self):
+        """
+        Running statistics per level, sorted by pixel intensity.
+
+        Returns
+        -------
+        vecInd : np.ndarray
+            Pixel intensities of levels with readings.
+        vecDepAvg : np.ndarray
+            Mean luminance [cd/m^2].
+        vecStd : np.ndarray
+            Standard deviation of luminance (population, as `np.std` in
+            fit_luminance.py).
+        vecCnt : np.ndarray
+            Number of readings.
+        """
+        lgcTmp = self.vecCnt > 0
+        vecSrt = np.argsort(self.vecInd[lgcTmp], kind='stable')
+        vecCnt = self.vecCnt[lgcTmp][vecSrt]
+        return (self.vecInd[lgcTmp][vecSrt],
+                self.vecAvg[lgcTmp][vecSrt],
+                np.sqrt(self.vecM2[lgcTmp][vecSrt] / vecCnt),
+                vecCnt)
+
+    def fit(self, strMdl):
+        """
+        Current fit of a model (same result as `luminance_models.funcFit` on
+        the level means).
+
+        Returns
+        -------
+        dicFit : dict
+            Fitted parameters ('prm'), residual sum of squares ('rss'),
+            coefficient of determination ('r2'), and number of levels used
+            ('obs').
+        """
+        if strMdl not in self.dicNrm:
+            # Nonlinear model, refit from level means:
+            vecInd, vecDepAvg = self.levels()[:2]
+            dicFit = funcFit(strMdl, vecInd, vecDepAvg)
+            return {'prm': dicFit['prm'], 'rss': dicFit['rss'],
+                    'r2': dicFit['r2'], 'obs': dicFit['obs']}
+
+        dicTmp = self.dicNrm[strMdl]
+        varNumPrm = dicTmp['xty'].size
+        vecPrm = np.full(varNumPrm, np.nan)
+        varRss = np.nan
+        if dicTmp['lvl'] >= varNumPrm:
+            vecPrm = np.linalg.lstsq(dicTmp['xtx'], dicTmp['xty'],
+                                     rcond=None)[0]
+            # RSS from the normal equations (y'y - 2 b'X'y + b'X'X b):
+            varRss = max(0.0, float(dicTmp['yty']
+                                    - 2.0 * np.dot(vecPrm, dicTmp['xty'])
+                                    + np.dot(vecPrm, np.dot(dicTmp['xtx'],
+                                                            vecPrm))))
+        varTss = dicTmp['yty'] - dicTmp['sy'] ** 2 / max(dicTmp['lvl'], 1)
+
+        return {'prm': vecPrm,
+                'rss': varRss,
+                'r2': (1.0 - varRss / varTss) if varTss > 0.0 else np.nan,
+                'obs': dicTmp['lvl']}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Comparison with batch fit
+
+if __name__ == '__main__':
+
+    import time
+    from luminance_io import funcReadCsv
+
+    # Repetitions of the 2018 sessions arrive one at a time:
+    objOnl = OnlineFit()
+    lstRep = []
+    for strPathCsv in ['luminance_measurement_20180913/'
+                       + 'Luminance_measurement_7T_NOVA_coil.csv',
+                       'luminance_measurement_20180913/'
+                       + 'Luminance_measurement_7T_vision_coil.csv']:
+        vecInd, aryDep, _ = funcReadCsv(strPathCsv)
+        for vecDep in aryDep:
+            objOnl.add(vecInd, vecDep)
+            lstRep.append(vecDep)
+
+            # Batch fit of all repetitions so far:
+            vecDepAvg = np.mean(lstRep, axis=0)
+            for strMdl in objOnl.lstMdl:
+                vecPrmBtc = funcFit(strMdl, vecInd, vecDepAvg)['prm']
+                vecPrmOnl = objOnl.fit(strMdl)['prm']
+                varDev = np.max(np.abs(vecPrmOnl - vecPrmBtc)
+                                / np.maximum(np.abs(vecPrmBtc), 1.0))
+                print(str(len(lstRep)) + ' repetition(s), ' + strMdl
+                      + ': relative deviation from batch fit '
+                      + ('%.1e' % varDev))
+            assert np.allclose(objOnl.levels()[2],
+                               np.std(lstRep, axis=0))
+
+    # Cost of an update, with short and long history:
+    objRng = np.random.default_rng(0)
+    for varNumRep in (10, 10000):
+        objOnl = OnlineFit(['poly3'])
+        objOnl.add_session(vecInd, vecDepAvg[None, :]
+                           + objRng.normal(0.0, 5.0,
+                                           size=(varNumRep, vecInd.size)))
+        varTme = time.perf_counter()
+        for idxRep in range(100):
+            objOnl.add(vecInd, vecDepAvg)
+            objOnl.fit('poly3')
+        varTme = (time.perf_counter() - varTme) / 100.0
+        print('Update and refit after ' + str(varNumRep) + ' repetitions: '
+              + str(np.around(varTme * 1000.0, 3)) + ' ms')
+# *****************************************************************************
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+"""
+Plot luminance measurements and fitted models (headless, Agg backend).
+
+One summary figure per measurement session, with one panel per model (mean
+and standard deviation of the measurement, and model prediction). The static
+layout of the figure (axes, ticks, labels, grid, legend) is created once, and
+only the data artists are updated for each session. When rendering many
+sessions, each worker process of a pool creates its own figure once and
+reuses it for all sessions it renders.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import multiprocessing as mp
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from luminance_io import funcReadCsv
+from luminance_models import dicMdl, funcLabel, funcPred
+from profiling import funcPoolMap, funcStage
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Label for x-axis (independent variable):
+strLblX = 'Psychopy pixel intensity'
+
+# Label for y-axis (dependent variable):
+strLblY = 'Luminance [cd/m^2]'
+
+# Limits of x-axis:
+vecXlim = [-1.1, 1.1]
+
+# Limits of y-axis:
+vecYlim = [-10.0, 1500.0]
+
+# Figure dimensions (one panel has the size of the former single-model
+# figures):
+varSizeX = 1200.0
+varSizeY = 1000.0
+varDpi = 120.0
+
+# Layout of panels (rows, columns):
+tplPnl = (2, 3)
+
+# Line colour:
+vecClr = np.divide(np.array([56.0, 132.0, 184.0]), 255.0)
+vecClrSd = np.divide(np.array([250.0, 138.0, 53.0]), 255.0)
+
+# Figure of the current worker process (see `funcInitWorker`):
+dicFigWrk = None
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcFigCreate(lstMdl=None):
+    """
+    Create summary figure with static layout.
+
+    Parameters
+    ----------
+    lstMdl : list, optional
+        Names of the models (one panel per model), default: all models from
+        `luminance_models.dicMdl`.
+
+    Returns
+    -------
+    dicFig : dict
+        Figure ('fig'), names of models ('mdl'), and per-panel lists of axes
+        ('axs'), mean lines ('avg'), error shadings ('sd'), model lines
+        ('pre'), and legends ('lgd').
+    """
+    if lstMdl is None:
+        lstMdl = list(dicMdl.keys())
+
+    varNumRow, varNumCol = tplPnl
+    fig01 = Figure(figsize=((varSizeX * 0.5 * varNumCol) / varDpi,
+                            (varSizeY * 0.5 * varNumRow) / varDpi),
+                   dpi=varDpi)
+    FigureCanvasAgg(fig01)
+
+    dicFig = {'fig': fig01, 'mdl': lstMdl, 'axs': [], 'avg': [], 'sd': [],
+              'pre': [], 'lgd': []}
+
+    # Placeholder data (replaced for each session):
+    vecTmp = np.zeros(2)
+
+    for idxPnl in range(varNumRow * varNumCol):
+
+        axs01 = fig01.add_subplot(varNumRow, varNumCol, (idxPnl + 1))
+
+        # Unused panels:
+        if idxPnl >= len(lstMdl):
+            axs01.set_axis_off()
+            continue
+
+        # Plot mean:
+        plt01, = axs01.plot(vecTmp, vecTmp, color=vecClr, alpha=0.9,
+                            label='Mean (SD)', linewidth=5.0,
+                            antialiased=True)
+
+        # Plot error shading:
+        plt02 = axs01.fill_between(vecTmp, vecTmp, vecTmp, alpha=0.2,
+                                   edgecolor=vecClr, facecolor=vecClr,
+                                   linewidth=0, antialiased=True)
+
+        # Plot model prediction:
+        plt03, = axs01.plot(vecTmp, vecTmp, color=vecClrSd, alpha=0.9,
+                            label=' ', linewidth=3.0, antialiased=True)
+
+        # Limits of the axes:
+        axs01.set_xlim([vecXlim[0], vecXlim[1]])
+        axs01.set_ylim([vecYlim[0], vecYlim[1]])
+
+        # Which values to label with ticks:
+        axs01.set_yticks(np.linspace(0, vecYlim[1], num=4, endpoint=True))
+        axs01.set_xticks(np.around(np.linspace(vecXlim[0], vecXlim[1], num=3,
+                                               endpoint=True), decimals=0))
+
+        # Adjust labels:
+        axs01.tick_params(labelsize=16)
+        axs01.set_xlabel(strLblX, fontsize=13)
+        axs01.set_ylabel(strLblY, fontsize=13)
+        axs01.set_title(lstMdl[idxPnl], fontsize=13)
+
+        # Add legend (fixed location, so that updating the label text does
+        # not require a new layout):
+        lgd01 = axs01.legend(loc='upper left', prop={'size': 9})
+
+        # Add grid lines:
+        axs01.xaxis.grid(which=u'major', color=([0.2, 0.2, 0.2]),
+                         linestyle=':', linewidth=0.2)
+        axs01.yaxis.grid(which=u'major', color=([0.2, 0.2, 0.2]),
+                         linestyle=':', linewidth=0.2)
+
+        # Reduce framing box:
+        axs01.spines['top'].set_visible(False)
+        axs01.spines['right'].set_visible(False)
+
+        dicFig['axs'].append(axs01)
+        dicFig['avg'].append(plt01)
+        dicFig['sd'].append(plt02)
+        dicFig['pre'].append(plt03)
+        dicFig['lgd'].append(lgd01)
+
+    # Session title:
+    dicFig['ttl'] = fig01.suptitle(' ', fontsize=13)
+
+    # Make plot & axis labels fit into figure (matplotlib sometimes throws a
+    # ValueError ("left cannot be >= right"):
+    try:
+        fig01.tight_layout(pad=0.5, rect=(0.0, 0.0, 1.0, 0.96))
+    except ValueError:
+        pass
+
+    return dicFig
+
+
+def funcFigUpdate(dicFig, vecInd, vecDepAvg, vecStd, lstModPre, lstModPar,
+                  strTtl=''):
+    """
+    Update data artists of summary figure.
+
+    Parameters
+    ----------
+    dicFig : dict
+        Figure created with `funcFigCreate`.
+    vecInd : np.ndarray
+        Pixel intensities.
+    vecDepAvg, vecStd : np.ndarray
+        Mean and standard deviation of measured luminance.
+    lstModPre : list
+        Model predictions (one vector per model, same order as the panels).
+    lstModPar : list
+        Strings describing the fitted models (legend).
+    strTtl : str
+        Figure title.
+    """
+    # Outline of error shading (lower bound, then upper bound in reverse):
+    aryVrt = np.concatenate(
+        [np.stack([vecInd, (vecDepAvg - vecStd)], axis=1),
+         np.stack([vecInd[::-1], (vecDepAvg + vecStd)[::-1]], axis=1)])
+
+    for idxPnl in range(len(dicFig['axs'])):
+        dicFig['avg'][idxPnl].set_data(vecInd, vecDepAvg)
+        dicFig['sd'][idxPnl].set_verts([aryVrt])
+        dicFig['pre'][idxPnl].set_data(vecInd, lstModPre[idxPnl])
+        dicFig['lgd'][idxPnl].get_texts()[1].set_text(lstModPar[idxPnl])
+
+    dicFig['ttl'].set_text(strTtl)
+
+
+def funcFigSave(dicFig, strPathFig):
+    """Save summary figure."""
+    dicFig['fig'].savefig(strPathFig, dpi=varDpi, facecolor='w',
+                          edgecolor='w', transparent=False)
+
+
+def funcInitWorker():
+    """Create figure once per worker process."""
+    global dicFigWrk
+    dicFigWrk = funcFigCreate()
+
+
+def funcRenderSession(dicSes, dicFig=None):
+    """
+    Render summary figure of one measurement session.
+
+    Parameters
+    ----------
+    dicSes : dict
+        Path of measurement file ('path'), fitted parameters per model
+        ('prm', dictionary with model names as keys), and path of the output
+        figure ('out').
+    dicFig : dict, optional
+        Figure created with `funcFigCreate` (default: figure of the worker
+        process).
+
+    Returns
+    -------
+    strPathFig : str
+        Path of the saved figure.
+    """
+    if dicFig is None:
+        dicFig = dicFigWrk
+
+    with funcStage('load', session=dicSes['path']):
+        vecInd, aryDep, strTtl = funcReadCsv(dicSes['path'])
+
+    lstModPre = []
+    lstModPar = []
+    for strMdl in dicFig['mdl']:
+        with funcStage('predict', model=strMdl):
+            lstModPre.append(funcPred(strMdl, vecInd, dicSes['prm'][strMdl]))
+        with funcStage('label', model=strMdl):
+            lstModPar.append(funcLabel(strMdl, dicSes['prm'][strMdl]))
+
+    with funcStage('update'):
+        funcFigUpdate(dicFig, vecInd, np.mean(aryDep, axis=0),
+                      np.std(aryDep, axis=0), lstModPre, lstModPar, strTtl)
+    with funcStage('savefig'):
+        funcFigSave(dicFig, dicSes['out'])
+
+    return dicSes['out']
+
+
+def funcRenderBatch(lstSes, varPar=None):
+    """
+    Render summary figures of several sessions, in parallel.
+
+    Parameters
+    ----------
+    lstSes : list
+        Sessions to render (see `funcRenderSession`).
+    varPar : int, optional
+        Number of processes (default: number of CPUs). With one process, the
+        sessions are rendered serially, without a process pool.
+
+    Returns
+    -------
+    lstPathFig : list
+        Paths of saved figures.
+    """
+    if varPar is None:
+        varPar = mp.cpu_count()
+    varPar = max(1, min(varPar, len(lstSes)))
+
+    if varPar == 1:
+        with funcStage('figure'):
+            dicFig = funcFigCreate()
+        return [funcRenderSession(dicSes, dicFig) for dicSes in lstSes]
+
+    varChnk = max(1, len(lstSes) // (varPar * 4))
+    with mp.Pool(processes=varPar, initializer=funcInitWorker) as objPool:
+        return funcPoolMap(objPool, funcRenderSession, lstSes,
+                           chunksize=varChnk)
+
+
+def funcPathFig(strPathCsv, strPathOut, strPathIn=None):
+    """
+    Path of summary figure for a measurement file.
+
+    If `strPathIn` (root directory of the measurement files) is given, the
+    file name includes the subdirectories (e.g. session dates), so that files
+    with the same name in different directories do not overwrite each other.
+    """
+    if (strPathIn is None) or os.path.isfile(strPathIn):
+        strFle = os.path.basename(strPathCsv)
+    else:
+        strFle = os.path.relpath(strPathCsv, strPathIn).replace(os.sep, '_')
+    return os.path.join(strPathOut, (os.path.splitext(strFle)[0] + '.png'))
+# *****************************************************************************
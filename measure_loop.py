@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+"""
+Render loop for luminance measurements, with frame timing.
+
+The loop presents one full-screen intensity level at a time (see
+psychopy_measure_luminance.py), or, in grid mode, one patch position at a
+time (see uniformity.py). All per-step states (colours and info text
+stimuli) are created before the loop, and the stimulus colour is only updated
+when the step changes, so that no text is re-rendered and no objects are
+created during the loop. The time of each flip is recorded in a preallocated
+array, from which flip intervals and dropped frames are calculated and saved
+to a log file.
+
+The window and stimuli are passed in, so that the loop can be run with the
+mock window and stimuli from this module (no display, no psychopy), e.g. for
+benchmarks:
+
+    python measure_loop.py
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import time
+import numpy as np
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Default frame period [s] (60 Hz), if the frame rate of the display is not
+# known:
+varFrmPrdDef = 1.0 / 60.0
+
+# Flip intervals longer than this multiple of the frame period count as
+# dropped frames:
+varDrpThr = 1.5
+
+# Maximum number of frames recorded in one run (one hour at 120 Hz):
+varMaxFrm = 432000
+
+# Colour channels (in the order of RGB triplets):
+tplChn = ('red', 'green', 'blue')
+
+# Keys (step down, step up, toggle info text, quit):
+tplKeyDwn = ('1',)
+tplKeyUp = ('2',)
+tplKeyTxt = ('4',)
+tplKeyQut = ('escape', 'q')
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcColorStates(varNumStp, strChn='gray'):
+    """
+    Colours of all steps, linearly spaced from black to full intensity.
+
+    Parameters
+    ----------
+    varNumStp : int
+        Number of steps.
+    strChn : str
+        'gray' (r = g = b), or one colour channel ('red', 'green', 'blue'),
+        with the other channels at black (-1).
+
+    Returns
+    -------
+    aryClr : np.ndarray
+        RGB triplets, steps x 3.
+    """
+    vecClr = np.linspace(-1.0, 1.0, num=varNumStp)
+    if strChn == 'gray':
+        return np.repeat(vecClr[:, None], 3, axis=1)
+    if strChn not in tplChn:
+        raise ValueError('Channel must be gray or one of ' + str(tplChn))
+    aryClr = np.full((varNumStp, 3), -1.0)
+    aryClr[:, tplChn.index(strChn)] = vecClr
+    return aryClr
+
+
+def funcTextStates(aryClr):
+    """Info text of all steps (colour and step number)."""
+    varNumStp = aryClr.shape[0]
+    return [('RGB: ' + str(aryClr[idxStp]) + '\n'
+             + 'Step %s out of %s' % ((idxStp + 1), varNumStp))
+            for idxStp in range(varNumStp)]
+
+
+def funcRenderLoop(objWin, objStim, lstStimTxt, aryClr, funcGetKeys,
+                   idxStp=0, lgcTxt=True, varMaxFrm=varMaxFrm, aryPos=None):
+    """
+    Present intensity levels until quit, record flip times.
+
+    Parameters
+    ----------
+    objWin : psychopy.visual.Window or MockWindow
+        Window; `flip()` returns the time of the flip [s].
+    objStim : psychopy.visual.GratingStim or MockStim
+        Full-screen stimulus.
+    lstStimTxt : list
+        Info text stimuli, one per step (created before the loop, so that
+        text is never re-rendered during the loop).
+    aryClr : np.ndarray
+        Colours of the steps, steps x 3 (see `funcColorStates`).
+    funcGetKeys : function
+        Returns the list of keys pressed since the last call (e.g.
+        `psychopy.event.getKeys`).
+    idxStp : int
+        Initial step.
+    lgcTxt : bool
+        Whether the info text is shown initially.
+    varMaxFrm : int
+        Maximum number of frames (the loop ends after that many frames, see
+        'full' below).
+    aryPos : np.ndarray, optional
+        Position of the stimulus at each step, steps x 2 (grid mode, see
+        `uniformity.funcGridPos`).
+
+    Returns
+    -------
+    dicLog : dict
+        'flip': flip times [s]; 'step': step presented in each frame;
+        'full': True if the loop ended because `varMaxFrm` frames were
+        recorded (rather than by the quit key).
+    """
+    varNumStp = aryClr.shape[0]
+
+    # Preallocated log:
+    vecFlp = np.empty(varMaxFrm, dtype=np.float64)
+    vecStp = np.empty(varMaxFrm, dtype=np.int16)
+
+    idxStpShw = -1
+    idxFrm = 0
+    lgcRun = True
+
+    while lgcRun and (idxFrm < varMaxFrm):
+
+        # Update stimulus only if the step has changed:
+        if idxStp != idxStpShw:
+            objStim.setColor(aryClr[idxStp])
+            if aryPos is not None:
+                objStim.setPos(aryPos[idxStp])
+            idxStpShw = idxStp
+
+        # The window is cleared at each flip, so stimuli are drawn in every
+        # frame (drawing does not re-render text):
+        objStim.draw()
+        if lgcTxt:
+            lstStimTxt[idxStp].draw()
+
+        vecFlp[idxFrm] = objWin.flip()
+        vecStp[idxFrm] = idxStp
+        idxFrm += 1
+
+        for strKey in funcGetKeys():
+            if strKey in tplKeyUp:
+                idxStp = min((idxStp + 1), (varNumStp - 1))
+            elif strKey in tplKeyDwn:
+                idxStp = max((idxStp - 1), 0)
+            elif strKey in tplKeyTxt:
+                lgcTxt = not lgcTxt
+            elif strKey in tplKeyQut:
+                lgcRun = False
+
+    return {'flip': vecFlp[:idxFrm],
+            'step': vecStp[:idxFrm],
+            'full': lgcRun}
+
+
+def funcFrameTiming(dicLog, varFrmPrd=varFrmPrdDef):
+    """
+    Flip intervals and dropped frames.
+
+    Parameters
+    ----------
+    dicLog : dict
+        Log of the render loop (see `funcRenderLoop`).
+    varFrmPrd : float
+        Frame period of the display [s].
+
+    Returns
+    -------
+    dicTme : dict
+        'interval': flip intervals [s] (first frame: NaN); 'dropped': number
+        of frames dropped before each frame; and summary statistics
+        'frames', 'dropped_total', 'late_flips', 'mean', 'sd', 'max' (of the
+        flip intervals [s]).
+    """
+    vecFlp = dicLog['flip']
+    vecItv = np.full(vecFlp.shape, np.nan)
+    vecItv[1:] = np.diff(vecFlp)
+
+    # An interval of n frame periods means that n - 1 frames were dropped:
+    vecDrp = np.zeros(vecFlp.shape, dtype=np.int64)
+    lgcLte = vecItv[1:] > (varDrpThr * varFrmPrd)
+    vecDrp[1:][lgcLte] = np.maximum(
+        np.rint(vecItv[1:][lgcLte] / varFrmPrd).astype(np.int64) - 1, 1)
+
+    dicTme = {'interval': vecItv,
+              'dropped': vecDrp,
+              'frames': int(vecFlp.size),
+              'dropped_total': int(np.sum(vecDrp)),
+              'late_flips': int(np.sum(lgcLte))}
+    if vecFlp.size > 1:
+        dicTme.update({'mean': float(np.mean(vecItv[1:])),
+                       'sd': float(np.std(vecItv[1:])),
+                       'max': float(np.max(vecItv[1:]))})
+    else:
+        dicTme.update({'mean': np.nan, 'sd': np.nan, 'max': np.nan})
+
+    return dicTme
+
+
+def funcSaveLog(strPathLog, dicLog, varFrmPrd=varFrmPrdDef):
+    """
+    Save frame timing log (csv, one row per frame).
+
+    Columns: frame, flip time [s], flip interval [ms], dropped frames, step.
+
+    Returns
+    -------
+    dicTme : dict
+        Frame timing (see `funcFrameTiming`).
+    """
+    dicTme = funcFrameTiming(dicLog, varFrmPrd=varFrmPrd)
+    # Time relative to first flip:
+    vecTme = dicLog['flip'] - (dicLog['flip'][0] if dicTme['frames'] else 0.0)
+    aryLog = np.stack([np.arange(dicTme['frames']),
+                       vecTme,
+                       (dicTme['interval'] * 1000.0),
+                       dicTme['dropped'],
+                       dicLog['step']], axis=1)
+    np.savetxt(strPathLog, aryLog, fmt=['%d', '%.6f', '%.3f', '%d', '%d'],
+               delimiter=',', header='frame,time,interval_ms,dropped,step',
+               comments='')
+    return dicTme
+
+
+def funcTimingSummary(dicTme, varFrmPrd=varFrmPrdDef):
+    """One-line summary of frame timing."""
+    return (str(dicTme['frames']) + ' frames, flip interval '
+            + str(np.around(dicTme['mean'] * 1000.0, 3)) + ' +/- '
+            + str(np.around(dicTme['sd'] * 1000.0, 3)) + ' ms (max '
+            + str(np.around(dicTme['max'] * 1000.0, 3)) + ' ms, expected '
+            + str(np.around(varFrmPrd * 1000.0, 3)) + ' ms), '
+            + str(dicTme['dropped_total']) + ' dropped frame(s)')
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Mock window
+
+class MockWindow(object):
+    """
+    Stand-in for `psychopy.visual.Window` (no display).
+
+    `flip()` waits for the next simulated vertical blank, and returns its
+    time. If the caller misses a blank (the frame took longer than one
+    period), the flip happens at the next one, as on a real display.
+
+    Parameters
+    ----------
+    varFrmPrd : float
+        Frame period [s].
+    lgcWait : bool
+        If False, `flip()` does not wait, but returns the time of the next
+        blank (simulated clock), which is useful for fast functional runs.
+    """
+
+    def __init__(self, varFrmPrd=varFrmPrdDef, lgcWait=True):
+        self.monitorFramePeriod = varFrmPrd
+        self.lgcWait = lgcWait
+        self.varNumFlp = 0
+        self.varTmeBlk = time.perf_counter()
+
+    def flip(self):
+        """Wait for next blank, return its time [s]."""
+        if self.lgcWait:
+            varNow = time.perf_counter()
+            # Next blank after the current time:
+            varNumPrd = np.floor((varNow - self.varTmeBlk)
+                                 / self.monitorFramePeriod) + 1.0
+            self.varTmeBlk += varNumPrd * self.monitorFramePeriod
+            varSlp = self.varTmeBlk - time.perf_counter()
+            if varSlp > 0.0:
+                time.sleep(varSlp)
+        else:
+            self.varTmeBlk += self.monitorFramePeriod
+        self.varNumFlp += 1
+        return self.varTmeBlk
+
+    def close(self):
+        """Close window (no effect)."""
+        pass
+
+
+class MockStim(object):
+    """Stand-in for a psychopy stimulus, counts method calls."""
+
+    def __init__(self, varTmeDrw=0.0):
+        self.varTmeDrw = varTmeDrw
+        self.dicCnt = {'setColor': 0, 'setPos': 0, 'setText': 0, 'draw': 0}
+
+    def setColor(self, vecClr):
+        self.dicCnt['setColor'] += 1
+
+    def setPos(self, vecPos):
+        self.dicCnt['setPos'] += 1
+
+    def setText(self, strTxt):
+        self.dicCnt['setText'] += 1
+
+    def draw(self):
+        self.dicCnt['draw'] += 1
+        if self.varTmeDrw > 0.0:
+            time.sleep(self.varTmeDrw)
+
+
+def funcMockKeys(dicKey):
+    """
+    Scripted key presses.
+
+    Parameters
+    ----------
+    dicKey : dict
+        Keys pressed after a given frame (frame number: list of keys).
+
+    Returns
+    -------
+    funcGetKeys : function
+        Replacement for `psychopy.event.getKeys`.
+    """
+    lstFrm = [0]
+
+    def funcGetKeys():
+        lstFrm[0] += 1
+        return dicKey.get(lstFrm[0], [])
+
+    return funcGetKeys
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Benchmark with mock window
+
+if __name__ == '__main__':
+
+    # Step up through all levels (one step every 30 frames), toggle the text
+    # once, and quit:
+    varNumStp = 17
+    varFrmStp = 30
+    dicKey = {(varFrmStp * (idxStp + 1)): ['2']
+              for idxStp in range(varNumStp - 1)}
+    dicKey[varFrmStp * 5 + 1] = ['4']
+    dicKey[varFrmStp * 6 + 1] = ['4']
+    dicKey[varFrmStp * varNumStp] = ['q']
+
+    aryClr = funcColorStates(varNumStp)
+    objWin = MockWindow()
+    objStim = MockStim()
+    lstStimTxt = [MockStim() for strTxt in funcTextStates(aryClr)]
+
+    dicLog = funcRenderLoop(objWin, objStim, lstStimTxt, aryClr,
+                            funcMockKeys(dicKey))
+    dicTme = funcFrameTiming(dicLog, varFrmPrd=objWin.monitorFramePeriod)
+
+    print(funcTimingSummary(dicTme, varFrmPrd=objWin.monitorFramePeriod))
+    if dicLog['full']:
+        print('Frame log full, loop ended after ' + str(dicTme['frames'])
+              + ' frames')
+    print('Stimulus updates: ' + str(objStim.dicCnt['setColor'])
+          + ' colour, '
+          + str(sum(objTmp.dicCnt['setText'] for objTmp in lstStimTxt))
+          + ' text')
+# *****************************************************************************
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cross-validated selection of luminance models across measurement sessions.
+
+All models from luminance_models.py are compared on every session of an
+archive of measurement files (see `luminance_io.funcLoadArchive`), by
+
+- leave-one-out cross validation: each intensity level is predicted by the
+  model fitted to all other levels,
+- k-fold cross validation: levels are assigned to k folds in turn (level 0
+  to fold 0, level 1 to fold 1, ...), so that each training set spans the
+  whole range of pixel intensities, and each fold is predicted by the model
+  fitted to the other folds,
+- information criteria of the fit to all levels (AIC and BIC, least squares
+  form, the residual variance counted as a parameter).
+
+Models are fitted to the mean luminance per level. Cross validation errors
+are root mean squared prediction errors [cd/m^2], across all held-out levels
+within the domain of the model. A fold in which the model cannot predict a
+held-out level (non-finite prediction, e.g. the power function below the
+offset fitted to the training levels) is a failed fold; the number of failed
+folds is reported, and the error is calculated over the other folds.
+
+Criteria are only ranked if they are comparable between models: calculated
+on all levels of the session (not so for the logarithmic model, defined for
+positive pixel intensities only), without failed folds, and finite. Other
+criteria are reported, but have no rank (empty cell).
+
+Each fit (session x model x fold) is a separate task of a process pool. For
+every session, the models are ranked by each criterion (1: best), and the
+ranks are summarised across sessions.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import multiprocessing as mp
+import numpy as np
+from luminance_io import funcSaveTable, tplMeta
+from luminance_models import dicMdl, funcFit, funcPred
+from profiling import funcPoolMap, funcStage
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Directory containing measurement files (searched recursively):
+strPathIn = 'luminance_measurement_20180913/'
+
+# Output table (csv, one row per session and model):
+strPathOut = 'model_selection.csv'
+
+# Number of folds of k-fold cross validation:
+varNumFld = 5
+
+# Number of processes (None: number of CPUs):
+varPar = None
+
+# Criteria by which models are ranked (lower is better):
+tplCrt = ('loo_rmse', 'kfold_rmse', 'aic', 'bic')
+
+# Columns of the output table:
+lstColSel = (['session', 'title'] + list(tplMeta)
+             + ['model', 'levels', 'rss', 'r2']
+             + list(tplCrt) + ['loo_failed_folds', 'kfold_failed_folds']
+             + ['rank_' + strCrt.split('_')[0] for strCrt in tplCrt])
+
+# Columns of the summary across sessions:
+lstColSum = (['model', 'sessions']
+             + ['mean_rank_' + strCrt.split('_')[0] for strCrt in tplCrt]
+             + ['ranked_' + strCrt.split('_')[0] for strCrt in tplCrt]
+             + ['best_' + strCrt.split('_')[0] for strCrt in tplCrt])
+
+# Data of the current worker process (see `funcInitWorker`):
+dicDatWrk = None
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcFoldMask(varNumLvl, strSch, idxFld, varNumFld=varNumFld):
+    """
+    Held-out levels of a fold.
+
+    Parameters
+    ----------
+    varNumLvl : int
+        Number of levels of the session.
+    strSch : str
+        'loo' (leave one out), 'kfold', or 'full' (no levels held out).
+    idxFld : int
+        Index of the fold.
+    varNumFld : int
+        Number of folds of k-fold cross validation.
+
+    Returns
+    -------
+    lgcTst : np.ndarray
+        True for held-out levels.
+    """
+    vecLvl = np.arange(varNumLvl)
+    if strSch == 'loo':
+        return vecLvl == idxFld
+    if strSch == 'kfold':
+        return (vecLvl % min(varNumFld, varNumLvl)) == idxFld
+    if strSch == 'full':
+        return np.zeros(varNumLvl, dtype=bool)
+    raise ValueError('Unknown validation scheme: ' + str(strSch))
+
+
+def funcTasks(vecNumLvl, lstMdl, varNumFld=varNumFld):
+    """
+    Grid of fits (session x model x fold).
+
+    Returns
+    -------
+    lstTsk : list
+        Tuples of session index, model name, validation scheme, and fold
+        index.
+    """
+    lstTsk = []
+    for idxSes, varNumLvl in enumerate(vecNumLvl):
+        for strMdl in lstMdl:
+            lstTsk.append((idxSes, strMdl, 'full', 0))
+            for idxFld in range(varNumLvl):
+                lstTsk.append((idxSes, strMdl, 'loo', idxFld))
+            for idxFld in range(min(varNumFld, varNumLvl)):
+                lstTsk.append((idxSes, strMdl, 'kfold', idxFld))
+    return lstTsk
+
+
+def funcInitWorker(dicDat):
+    """Set session data of a worker process."""
+    global dicDatWrk
+    dicDatWrk = dicDat
+
+
+def funcFitFold(tplTsk):
+    """
+    Fit one model to the training levels of one fold of one session.
+
+    Parameters
+    ----------
+    tplTsk : tuple
+        Session index, model name, validation scheme, and fold index (see
+        `funcTasks`).
+
+    Returns
+    -------
+    tplRes : tuple
+        The task, followed by the sum of squared prediction errors on the
+        held-out levels (residual sum of squares of the fit for 'full'), the
+        number of levels it is calculated on, whether the fold failed (any
+        non-finite prediction of a held-out level; its errors are then not
+        included), and the coefficient of determination of the fit (NaN for
+        cross validation folds).
+    """
+    idxSes, strMdl, strSch, idxFld = tplTsk
+    idxStr = dicDatWrk['offset'][idxSes]
+    idxEnd = dicDatWrk['offset'][idxSes + 1]
+    vecInd = dicDatWrk['ind'][idxStr:idxEnd]
+    vecDepAvg = dicDatWrk['avg'][idxStr:idxEnd]
+
+    with funcStage(strSch, model=strMdl):
+        lgcTst = funcFoldMask(vecInd.size, strSch, idxFld,
+                              varNumFld=dicDatWrk['folds'])
+        dicFit = funcFit(strMdl, vecInd[~lgcTst], vecDepAvg[~lgcTst])
+
+        if strSch == 'full':
+            return tplTsk + (dicFit['rss'], dicFit['obs'], False,
+                             dicFit['r2'])
+
+        # Held-out levels within the domain of the model, with readings:
+        lgcTst = (lgcTst & dicMdl[strMdl]['domain'](vecInd)
+                  & np.isfinite(vecDepAvg))
+        with np.errstate(all='ignore'):
+            vecErr = (funcPred(strMdl, vecInd[lgcTst], dicFit['prm'])
+                      - vecDepAvg[lgcTst])
+        if not np.all(np.isfinite(vecErr)):
+            return tplTsk + (0.0, 0, True, np.nan)
+        return tplTsk + (float(np.sum(np.square(vecErr))), int(vecErr.size),
+                         False, np.nan)
+
+
+def funcRank(vecVal, lgcCmp):
+    """
+    Ranks of models within a session (1: best).
+
+    Parameters
+    ----------
+    vecVal : np.ndarray
+        Criterion (lower is better).
+    lgcCmp : np.ndarray
+        Whether the criterion of the model is comparable (calculated on all
+        levels, without failed folds). Only comparable, finite criteria are
+        ranked.
+
+    Returns
+    -------
+    vecRnk : np.ndarray
+        Ranks (ties share the lower rank), NaN for criteria that are not
+        ranked.
+    """
+    lgcCmp = lgcCmp & np.isfinite(vecVal)
+    vecRnk = np.full(vecVal.size, np.nan)
+    vecTmp = vecVal[lgcCmp]
+    vecRnk[lgcCmp] = np.searchsorted(np.sort(vecTmp), vecTmp, side='left') + 1
+    return vecRnk
+
+
+def funcSelect(dicArc, lstMdl=None, varNumFld=varNumFld, varPar=None):
+    """
+    Cross-validated comparison of models on all sessions of an archive.
+
+    Parameters
+    ----------
+    dicArc : dict
+        Archive of measurement sessions (see `luminance_io.funcLoadArchive`).
+    lstMdl : list, optional
+        Names of the models (default: all models from
+        `luminance_models.dicMdl`).
+    varNumFld : int
+        Number of folds of k-fold cross validation.
+    varPar : int, optional
+        Number of processes (default: number of CPUs). With one process, the
+        fits are run serially, without a process pool.
+
+    Returns
+    -------
+    lstRow : list
+        One dictionary per session and model, with the fields from
+        `lstColSel` (in the order of the sessions and of `lstMdl`).
+    """
+    if lstMdl is None:
+        lstMdl = list(dicMdl.keys())
+
+    # Mean luminance per level (levels of all sessions, concatenated):
+    with np.errstate(all='ignore'):
+        vecAvg = np.nanmean(dicArc['dep'], axis=1)
+    dicDat = {'ind': dicArc['ind'], 'avg': vecAvg,
+              'offset': dicArc['offset'], 'folds': varNumFld}
+    vecNumLvl = np.diff(dicArc['offset'])
+    lstTsk = funcTasks(vecNumLvl, lstMdl, varNumFld=varNumFld)
+
+    if varPar is None:
+        varPar = mp.cpu_count()
+    varPar = max(1, min(varPar, len(lstTsk)))
+
+    if varPar == 1:
+        funcInitWorker(dicDat)
+        lstRes = [funcFitFold(tplTsk) for tplTsk in lstTsk]
+    else:
+        varChnk = max(1, len(lstTsk) // (varPar * 4))
+        with mp.Pool(processes=varPar, initializer=funcInitWorker,
+                     initargs=(dicDat,)) as objPool:
+            lstRes = funcPoolMap(objPool, funcFitFold, lstTsk,
+                                 chunksize=varChnk)
+
+    # Sum of squared errors, number of levels, and number of failed folds
+    # per session, model, and scheme:
+    dicAcc = {}
+    for idxSes, strMdl, strSch, _, varSse, varNum, lgcFld, varR2 in lstRes:
+        lstAcc = dicAcc.setdefault((idxSes, strMdl, strSch),
+                                   [0.0, 0, 0, np.nan])
+        lstAcc[0] += varSse
+        lstAcc[1] += varNum
+        lstAcc[2] += int(lgcFld)
+        lstAcc[3] = varR2
+
+    lstRow = []
+    for idxSes in range(vecNumLvl.size):
+        # Number of levels with readings:
+        varNumAll = int(np.sum(np.isfinite(
+            vecAvg[dicArc['offset'][idxSes]:dicArc['offset'][idxSes + 1]])))
+        lstRowSes = []
+        for strMdl in lstMdl:
+            varRss, varNumObs, _, varR2 = dicAcc[(idxSes, strMdl, 'full')]
+            # Number of parameters, including the residual variance:
+            varNumPrm = len(dicMdl[strMdl]['prm']) + 1
+            with np.errstate(all='ignore'):
+                varLik = varNumObs * np.log(varRss / varNumObs)
+            dicRow = {'session': str(dicArc['path'][idxSes]),
+                      'title': str(dicArc['title'][idxSes]),
+                      'model': strMdl,
+                      'levels': varNumObs,
+                      'rss': varRss,
+                      'r2': varR2,
+                      'aic': varLik + 2.0 * varNumPrm,
+                      'bic': varLik + np.log(varNumObs) * varNumPrm}
+            for strKey in tplMeta:
+                dicRow[strKey] = str(dicArc[strKey][idxSes])
+            for strSch in ('loo', 'kfold'):
+                varSse, varNum, varNumFail, _ = dicAcc[(idxSes, strMdl,
+                                                        strSch)]
+                dicRow[strSch + '_rmse'] = (np.sqrt(varSse / varNum)
+                                            if varNum > 0 else np.nan)
+                dicRow[strSch + '_failed_folds'] = varNumFail
+            lstRowSes.append(dicRow)
+
+        lgcAll = np.array([(dicRow['levels'] == varNumAll)
+                           for dicRow in lstRowSes])
+        for strCrt in tplCrt:
+            strKey = strCrt.split('_')[0]
+            lgcCmp = lgcAll.copy()
+            if strCrt.endswith('_rmse'):
+                lgcCmp &= np.array([(dicRow[strKey + '_failed_folds'] == 0)
+                                    for dicRow in lstRowSes])
+            vecRnk = funcRank(np.array([dicRow[strCrt]
+                                        for dicRow in lstRowSes]), lgcCmp)
+            # Criteria that are not ranked are written as empty cells:
+            for dicRow, varRnk in zip(lstRowSes, vecRnk):
+                dicRow['rank_' + strKey] = (int(varRnk) if np.isfinite(varRnk)
+                                            else None)
+
+        lstRow.extend(lstRowSes)
+
+    return lstRow
+
+
+def funcSummary(lstRow):
+    """
+    Ranks of models summarised across sessions.
+
+    Returns
+    -------
+    lstSum : list
+        One dictionary per model, with the fields from `lstColSum` (mean rank
+        over the sessions in which the criterion was ranked, NaN if it was
+        never ranked; number of sessions in which it was ranked; and number
+        of sessions in which the model ranks first, per criterion), sorted by
+        mean leave-one-out rank (models never ranked last).
+    """
+    dicSum = {}
+    for dicRow in lstRow:
+        dicTmp = dicSum.setdefault(dicRow['model'], {'model': dicRow['model'],
+                                                     'sessions': 0})
+        dicTmp['sessions'] += 1
+        for strCrt in tplCrt:
+            strKey = strCrt.split('_')[0]
+            varRnk = dicRow['rank_' + strKey]
+            dicTmp.setdefault('mean_rank_' + strKey, 0.0)
+            dicTmp.setdefault('ranked_' + strKey, 0)
+            dicTmp.setdefault('best_' + strKey, 0)
+            if varRnk is None:
+                continue
+            dicTmp['mean_rank_' + strKey] += varRnk
+            dicTmp['ranked_' + strKey] += 1
+            dicTmp['best_' + strKey] += int(varRnk == 1)
+
+    for dicTmp in dicSum.values():
+        for strCrt in tplCrt:
+            strKey = strCrt.split('_')[0]
+            if dicTmp['ranked_' + strKey] > 0:
+                dicTmp['mean_rank_' + strKey] /= dicTmp['ranked_' + strKey]
+            else:
+                dicTmp['mean_rank_' + strKey] = np.nan
+
+    return sorted(dicSum.values(),
+                  key=lambda dicTmp: (np.isnan(dicTmp['mean_rank_loo']),
+                                      dicTmp['mean_rank_loo']))
+
+
+def funcFormatSummary(lstSum):
+    """
+    Summary as text table (one line per model; mean rank, and in brackets
+    the number of sessions in which the criterion was ranked; '-' if it was
+    never ranked).
+    """
+    lstLne = ['{:<8}{:>10}'.format('model', 'sessions')
+              + ''.join('{:>14}'.format('rank_' + strCrt.split('_')[0])
+                        for strCrt in tplCrt)]
+    for dicTmp in lstSum:
+        lstTmp = []
+        for strCrt in tplCrt:
+            strKey = strCrt.split('_')[0]
+            if dicTmp['ranked_' + strKey] > 0:
+                lstTmp.append('{:>14}'.format(
+                    ('%.2f' % dicTmp['mean_rank_' + strKey]) + ' ('
+                    + str(dicTmp['ranked_' + strKey]) + ')'))
+            else:
+                lstTmp.append('{:>14}'.format('-'))
+        lstLne.append('{:<8}{:>10}'.format(dicTmp['model'],
+                                           dicTmp['sessions'])
+                      + ''.join(lstTmp))
+    return '\n'.join(lstLne)
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Compare models on all sessions
+
+if __name__ == '__main__':
+
+    import time
+    from luminance_io import funcLoadArchive
+
+    dicArc = funcLoadArchive(strPathIn)
+    print('Number of measurement sessions: ' + str(dicArc['path'].size))
+
+    varTme = time.perf_counter()
+    lstRow = funcSelect(dicArc, varNumFld=varNumFld, varPar=varPar)
+    varTme = time.perf_counter() - varTme
+    funcSaveTable(lstRow, strPathOut, lstColSel)
+
+    for dicRow in lstRow:
+        print(dicRow['title'] + ', ' + dicRow['model'] + ': leave-one-out '
+              + ('%.1f' % dicRow['loo_rmse']) + ' cd/m^2 ('
+              + str(dicRow['loo_failed_folds']) + ' failed folds), '
+              + str(varNumFld) + '-fold ' + ('%.1f' % dicRow['kfold_rmse'])
+              + ' cd/m^2 (' + str(dicRow['kfold_failed_folds'])
+              + ' failed folds), AIC ' + ('%.1f' % dicRow['aic']) + ', BIC '
+              + ('%.1f' % dicRow['bic']))
+    print(funcFormatSummary(funcSummary(lstRow)))
+    print('Model selection took ' + str(np.around(varTme, 2)) + ' s, table '
+          + 'saved to: ' + strPathOut)
+# *****************************************************************************
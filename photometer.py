@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+Automated luminance measurement with a photometer.
+
+The display is stepped through a sequence of pixel intensities, and the
+luminance at each step is read from a photometer, without manual key presses
+and transcription (compare psychopy_measure_luminance.py). Readings are
+written to a measurement file (csv, see luminance_io.py) at every step, so
+that an interrupted session leaves a valid file with the steps measured so
+far.
+
+The photometer is read continuously by a reader thread, so that serial
+communication overlaps with the settling time of the display: while the
+display settles after a change of intensity, the next reading is already in
+progress, and readings that started before the display had settled are
+discarded.
+
+Photometers:
+
+    SerialPhotometer     photometer on a serial port (requires pyserial),
+                         queried with a command and answering with one line
+                         containing the luminance
+    SimulatedPhotometer  readings calculated from a known luminance function
+                         (with display settling and measurement noise), for
+                         offline tests and benchmarks
+
+Simulated session (runs in a few seconds, no hardware):
+
+    python photometer.py
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import re
+import time
+import queue
+import threading
+import numpy as np
+from luminance import funcLum
+from luminance_io import funcWriteCsv
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Number of linear steps from black to white (as in
+# psychopy_measure_luminance.py):
+varNumStp = 17
+
+# Number of repetitions:
+varNumRep = 2
+
+# Time for the display (and photometer) to settle after a change of
+# intensity [s]:
+varTmeSttl = 0.5
+
+# Number of readings averaged per step:
+varNumSmp = 1
+
+# Timeout for one reading [s]:
+varTmeOut = 10.0
+
+# Number in the answer of a photometer:
+strPtrnNum = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Photometers
+
+class SerialPhotometer(object):
+    """
+    Photometer on a serial port.
+
+    Each reading sends a command and parses the first number of the answer
+    line as luminance [cd/m^2]. The defaults need to be adjusted to the
+    protocol of the device.
+
+    Parameters
+    ----------
+    strPort : str
+        Serial port, e.g. '/dev/ttyUSB0' or 'COM3'.
+    varBaud : int
+        Baud rate.
+    bytCmd : bytes
+        Command that triggers a measurement.
+    strPtrn : str
+        Regular expression for the luminance in the answer (first group, or
+        whole match).
+    varTmeOut : float
+        Timeout for one reading [s].
+    """
+
+    def __init__(self, strPort, varBaud=9600, bytCmd=b'M\r\n',
+                 strPtrn=strPtrnNum, varTmeOut=varTmeOut):
+        # Optional dependency, only needed with a real device:
+        import serial
+        self.objSrl = serial.Serial(strPort, baudrate=varBaud,
+                                    timeout=varTmeOut)
+        self.bytCmd = bytCmd
+        self.objPtrn = re.compile(strPtrn)
+
+    def read(self):
+        """Trigger a measurement and return the luminance [cd/m^2]."""
+        self.objSrl.reset_input_buffer()
+        self.objSrl.write(self.bytCmd)
+        strAns = self.objSrl.readline().decode('ascii', 'replace')
+        objMtch = self.objPtrn.search(strAns)
+        if objMtch is None:
+            raise IOError('No reading from photometer (answer: '
+                          + repr(strAns) + ')')
+        return float(objMtch.group(objMtch.lastindex or 0))
+
+    def close(self):
+        """Close serial port."""
+        self.objSrl.close()
+
+
+class SimulatedDisplay(object):
+    """
+    Display with a known luminance function, settling exponentially.
+
+    Parameters
+    ----------
+    vecPrm : array_like
+        Polynomial coefficients of the luminance function, highest degree
+        first.
+    varTau : float
+        Time constant of settling after a change of intensity [s].
+    """
+
+    def __init__(self, vecPrm, varTau=0.05):
+        self.vecPrm = np.asarray(vecPrm, dtype=np.float64)
+        self.varTau = varTau
+        self.varCdOld = self.varCdNew = float(funcLum(0.0, self.vecPrm))
+        self.varTmeChg = time.perf_counter()
+        self.objLck = threading.Lock()
+
+    def set(self, varPix):
+        """Change pixel intensity."""
+        varCdNew = float(funcLum(float(varPix), self.vecPrm))
+        with self.objLck:
+            self.varCdOld = self.lum()
+            self.varCdNew = varCdNew
+            self.varTmeChg = time.perf_counter()
+
+    def lum(self, varTme=None):
+        """Luminance at a time (default: now)."""
+        if varTme is None:
+            varTme = time.perf_counter()
+        varWgt = np.exp(-max(0.0, (varTme - self.varTmeChg)) / self.varTau)
+        return self.varCdNew + varWgt * (self.varCdOld - self.varCdNew)
+
+
+class SimulatedPhotometer(object):
+    """
+    Photometer reading a simulated display.
+
+    A reading integrates the luminance over the integration time, plus
+    proportional (and a small constant) Gaussian noise.
+
+    Parameters
+    ----------
+    objDsp : SimulatedDisplay
+        Display.
+    varTmeInt : float
+        Integration time of one reading [s].
+    varNoise : float
+        Standard deviation of noise, relative to luminance.
+    varNoiseAbs : float
+        Standard deviation of constant noise [cd/m^2].
+    varSeed : int, optional
+        Seed of random number generator.
+    """
+
+    def __init__(self, objDsp, varTmeInt=0.1, varNoise=0.005,
+                 varNoiseAbs=0.05, varSeed=None):
+        self.objDsp = objDsp
+        self.varTmeInt = varTmeInt
+        self.varNoise = varNoise
+        self.varNoiseAbs = varNoiseAbs
+        self.objRng = np.random.default_rng(varSeed)
+
+    def read(self):
+        """Measure and return the luminance [cd/m^2]."""
+        varTmeStr = time.perf_counter()
+        time.sleep(self.varTmeInt)
+        vecTme = np.linspace(varTmeStr, time.perf_counter(), num=8)
+        varCd = np.mean([self.objDsp.lum(varTme) for varTme in vecTme])
+        return float(varCd
+                     + self.objRng.normal(0.0, (self.varNoise * abs(varCd)
+                                                + self.varNoiseAbs)))
+
+    def close(self):
+        """Close photometer (no effect)."""
+        pass
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Acquisition
+
+class PhotometerReader(object):
+    """
+    Read a photometer continuously in a background thread.
+
+    Readings are put into a queue as tuples of (start time, end time,
+    luminance, error), with times from `time.perf_counter`.
+
+    Parameters
+    ----------
+    objPht : photometer
+        Object with a `read()` method (e.g. `SerialPhotometer`).
+    """
+
+    def __init__(self, objPht):
+        self.objPht = objPht
+        self.objQue = queue.Queue()
+        self.objStp = threading.Event()
+        self.objThrd = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """Reader loop (runs in the background thread)."""
+        while not self.objStp.is_set():
+            varTmeStr = time.perf_counter()
+            try:
+                varCd = self.objPht.read()
+                objErr = None
+            except (IOError, ValueError) as objTmp:
+                varCd = np.nan
+                objErr = objTmp
+            self.objQue.put((varTmeStr, time.perf_counter(), varCd, objErr))
+
+    def start(self):
+        """Start reading."""
+        self.objThrd.start()
+        return self
+
+    def stop(self):
+        """Stop reading (after the current reading)."""
+        self.objStp.set()
+        self.objThrd.join()
+
+    def get(self, varTmeMin, varNumSmp=1, varTmeOut=varTmeOut):
+        """
+        Readings that started at or after a given time.
+
+        Parameters
+        ----------
+        varTmeMin : float
+            Earliest start time of a valid reading (`time.perf_counter`).
+        varNumSmp : int
+            Number of readings.
+        varTmeOut : float
+            Timeout per reading [s].
+
+        Returns
+        -------
+        vecCd : np.ndarray
+            Luminance [cd/m^2] of the readings.
+        """
+        lstCd = []
+        while len(lstCd) < varNumSmp:
+            try:
+                varTmeStr, _, varCd, objErr = self.objQue.get(
+                    timeout=varTmeOut)
+            except queue.Empty:
+                raise IOError('No reading from photometer within '
+                              + str(varTmeOut) + ' s')
+            if objErr is not None:
+                raise IOError('Photometer error: ' + str(objErr))
+            # Reading started before the display had settled:
+            if varTmeStr < varTmeMin:
+                continue
+            lstCd.append(varCd)
+        return np.array(lstCd)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def funcAcquire(objPht, funcSetPix, vecInd, varNumRep=varNumRep,
+                varTmeSttl=varTmeSttl, varNumSmp=varNumSmp, strPathCsv=None,
+                strTtl='Luminance measurement', funcProgress=None):
+    """
+    Measure luminance at a sequence of pixel intensities.
+
+    Each repetition steps through all intensities (as in the manual
+    measurement). After each change of intensity, readings are only used if
+    they started at least `varTmeSttl` later.
+
+    Parameters
+    ----------
+    objPht : photometer
+        Object with a `read()` method (e.g. `SerialPhotometer`).
+    funcSetPix : function
+        Sets the pixel intensity of the display, e.g. returned by
+        `funcPsychopySetter`; returns when the new intensity is displayed.
+    vecInd : np.ndarray
+        Pixel intensities.
+    varNumRep : int
+        Number of repetitions.
+    varTmeSttl : float
+        Settling time after a change of intensity [s].
+    varNumSmp : int
+        Number of readings averaged per step.
+    strPathCsv : str, optional
+        Measurement file, rewritten at every step (while the display
+        settles), and at the end (also if the acquisition fails).
+    strTtl : str
+        Title of the measurement (see `luminance_io.funcTitle`).
+    funcProgress : function, optional
+        Called after every step with repetition, level, and luminance.
+
+    Returns
+    -------
+    aryDep : np.ndarray
+        Measured luminance [cd/m^2], repetitions x levels (NaN for steps not
+        measured, if the acquisition was interrupted by an error).
+    """
+    vecInd = np.asarray(vecInd, dtype=np.float64)
+    aryDep = np.full((varNumRep, vecInd.size), np.nan)
+
+    try:
+        with PhotometerReader(objPht) as objRdr:
+            for idxRep in range(varNumRep):
+                for idxLvl in range(vecInd.size):
+                    funcSetPix(vecInd[idxLvl])
+                    varTmeMin = time.perf_counter() + varTmeSttl
+                    # Save the readings so far while the display settles:
+                    if (strPathCsv is not None) and ((idxRep + idxLvl) > 0):
+                        funcWriteCsv(strPathCsv, vecInd, aryDep, strTtl)
+                    aryDep[idxRep, idxLvl] = np.mean(
+                        objRdr.get(varTmeMin, varNumSmp=varNumSmp))
+                    if funcProgress is not None:
+                        funcProgress(idxRep, idxLvl, aryDep[idxRep, idxLvl])
+    finally:
+        if strPathCsv is not None:
+            funcWriteCsv(strPathCsv, vecInd, aryDep, strTtl)
+
+    return aryDep
+
+
+def funcPsychopySetter(objWin, objStim, strChn='gray'):
+    """
+    Display setter for `funcAcquire` with a psychopy window.
+
+    Parameters
+    ----------
+    objWin : psychopy.visual.Window
+        Window.
+    objStim : psychopy.visual.GratingStim
+        Full-screen stimulus.
+    strChn : str
+        'gray' (r = g = b), or one colour channel ('red', 'green', 'blue'),
+        with the other channels at black (see `measure_loop.funcColorStates`).
+
+    Returns
+    -------
+    funcSetPix : function
+        Sets the colour of the stimulus, and returns after the flip.
+    """
+    from measure_loop import tplChn
+
+    if strChn == 'gray':
+        idxChn = None
+    else:
+        idxChn = tplChn.index(strChn)
+
+    def funcSetPix(varPix):
+        if idxChn is None:
+            lstClr = [varPix, varPix, varPix]
+        else:
+            lstClr = [-1.0, -1.0, -1.0]
+            lstClr[idxChn] = varPix
+        objStim.setColor(lstClr)
+        objStim.draw()
+        objWin.flip()
+        # The window keeps showing the last frame until the next flip.
+
+    return funcSetPix
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Simulated session
+
+if __name__ == '__main__':
+
+    from luminance_models import funcFit
+
+    # Known luminance function (7T, NOVA coil, filter ND.3):
+    vecPrmTrue = np.array([-195.9, 246.3, 887.4, 454.4])
+
+    objDsp = SimulatedDisplay(vecPrmTrue, varTau=0.005)
+    objPht = SimulatedPhotometer(objDsp, varTmeInt=0.02, varSeed=0)
+    vecInd = np.linspace(-1.0, 1.0, num=varNumStp)
+
+    varTme = time.perf_counter()
+    aryDep = funcAcquire(objPht, objDsp.set, vecInd, varNumRep=varNumRep,
+                         varTmeSttl=0.05,
+                         strPathCsv='Luminance_measurement_simulated.csv',
+                         strTtl='Luminance measurement at simulation, '
+                         + 'simulated coil, filter = none, date: 13.09.2018')
+    varTme = time.perf_counter() - varTme
+
+    vecPrm = funcFit('poly3', vecInd, np.mean(aryDep, axis=0))['prm']
+    print('Simulated session: ' + str(varNumRep) + ' x ' + str(varNumStp)
+          + ' steps in ' + str(np.around(varTme, 2)) + ' s')
+    print('True parameters:   ' + str(vecPrmTrue))
+    print('Fitted parameters: ' + str(np.around(vecPrm, 1)))
+# *****************************************************************************
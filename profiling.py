@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stage-level profiling of the fitting and plotting pipeline.
+
+Processing stages (loading of measurement files, fitting of each model,
+formatting of model labels, rendering and saving of figures) are wrapped in
+timers:
+
+    from profiling import funcStage
+
+    with funcStage('fit', model=strMdl):
+        dicFit = funcFit(strMdl, vecInd, vecDepAvg)
+
+Profiling is disabled by default, and `funcStage` then returns a shared
+context manager that does nothing (cost of a function call). After
+`funcEnable()`, each stage records wall time and CPU time, and optionally
+peak memory allocated during the stage (tracemalloc) and function-level
+profiles (cProfile, outermost profiled stage only, nested stages are included
+in its profile). Stages are nested: a stage opened within another stage is
+recorded as 'outer/inner'.
+
+Stages that run in worker processes (see `funcPoolMap`) are recorded by the
+worker and returned to the profiler of the main process.
+
+The report (`funcSaveReport`) is a json file (system information, summary per
+stage and model, all records, and the most expensive functions per stage), or
+a csv file (summary only, one row per stage and model).
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import csv
+import json
+import time
+import pstats
+import cProfile
+import datetime
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Number of functions per stage in the report (cProfile, sorted by cumulative
+# time):
+varNumTop = 20
+
+# Tags by which the summary is grouped (in addition to the stage):
+tplKeySum = ('model',)
+
+# Columns of the summary:
+lstColSum = (['stage'] + list(tplKeySum)
+             + ['count', 'wall_total', 'wall_mean', 'wall_min', 'wall_max',
+                'cpu_total', 'mem_peak_max'])
+
+# Active profiler (None: profiling disabled, see `funcEnable`):
+objPrf = None
+
+# Context manager of disabled stages:
+objNull = contextlib.nullcontext()
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Profiler
+
+class Profiler(object):
+    """
+    Records of processing stages.
+
+    Parameters
+    ----------
+    lgcCprf : bool
+        Whether to record function-level profiles (cProfile).
+    lgcMem : bool
+        Whether to record peak memory allocated per stage (tracemalloc).
+    strPrfx : str
+        Prefix of stage names (stage of the main process in which a worker
+        process runs).
+    """
+
+    def __init__(self, lgcCprf=False, lgcMem=False, strPrfx=''):
+        self.lgcCprf = lgcCprf
+        self.lgcMem = lgcMem
+        self.strPrfx = strPrfx
+
+        # One dictionary per completed stage:
+        self.lstRec = []
+        # Function statistics per stage (raw cProfile statistics):
+        self.dicCprf = {}
+        # Open stages (innermost last):
+        self.lstStk = []
+        # Running cProfile profiler (outermost profiled stage):
+        self.objCprf = None
+
+        self.strDate = datetime.datetime.now().isoformat()
+        self.varTme = time.perf_counter()
+
+        # Start tracemalloc (unless already tracing, e.g. in a process forked
+        # from a profiled process):
+        self.lgcMemOwn = lgcMem and not tracemalloc.is_tracing()
+        if self.lgcMemOwn:
+            tracemalloc.start()
+
+    def funcPath(self):
+        """Name of the innermost open stage (including prefix)."""
+        if self.lstStk:
+            return self.lstStk[-1]['stage']
+        return self.strPrfx
+
+    @contextlib.contextmanager
+    def stage(self, strStg, **dicTag):
+        """
+        Record one stage.
+
+        Parameters
+        ----------
+        strStg : str
+            Name of the stage.
+        **dicTag
+            Tags of the record (e.g. model name, session).
+        """
+        strPath = self.funcPath()
+        dicStg = {'stage': (strPath + '/' + strStg) if strPath else strStg}
+
+        if self.lgcMem:
+            varCur, varPk = tracemalloc.get_traced_memory()
+            # Peak of the enclosing stage so far (the peak is reset for this
+            # stage):
+            if self.lstStk:
+                self.lstStk[-1]['peak'] = max(self.lstStk[-1]['peak'], varPk)
+            tracemalloc.reset_peak()
+            dicStg['mem'] = varCur
+            dicStg['peak'] = varCur
+
+        lgcCprf = self.lgcCprf and (self.objCprf is None)
+        if lgcCprf:
+            self.objCprf = cProfile.Profile()
+            self.objCprf.enable()
+
+        self.lstStk.append(dicStg)
+        varTmeCpu = time.process_time()
+        varTme = time.perf_counter()
+        try:
+            yield
+        finally:
+            varTme = time.perf_counter() - varTme
+            varTmeCpu = time.process_time() - varTmeCpu
+            self.lstStk.pop()
+
+            if lgcCprf:
+                self.objCprf.disable()
+                self.objCprf.create_stats()
+                self.funcAddStats(dicStg['stage'], self.objCprf.stats)
+                self.objCprf = None
+
+            dicRec = {'stage': dicStg['stage'],
+                      'tags': dicTag,
+                      'wall': varTme,
+                      'cpu': varTmeCpu,
+                      'pid': os.getpid()}
+
+            if self.lgcMem:
+                varCur, varPk = tracemalloc.get_traced_memory()
+                varPk = max(varPk, dicStg['peak'])
+                dicRec['mem_peak'] = varPk - dicStg['mem']
+                dicRec['mem_delta'] = varCur - dicStg['mem']
+                if self.lstStk:
+                    self.lstStk[-1]['peak'] = max(self.lstStk[-1]['peak'],
+                                                  varPk)
+
+            self.lstRec.append(dicRec)
+
+    def funcAddStats(self, strStg, dicStat):
+        """Add raw cProfile statistics to those of a stage."""
+        dicTmp = self.dicCprf.setdefault(strStg, {})
+        for tplFnc, tplStat in dicStat.items():
+            if tplFnc in dicTmp:
+                dicTmp[tplFnc] = pstats.add_func_stats(dicTmp[tplFnc],
+                                                       tplStat)
+            else:
+                dicTmp[tplFnc] = tplStat
+
+    def merge(self, lstRec, dicCprf):
+        """Add records and statistics of another profiler (worker)."""
+        self.lstRec.extend(lstRec)
+        for strStg, dicStat in dicCprf.items():
+            self.funcAddStats(strStg, dicStat)
+
+    def close(self):
+        """Stop tracemalloc (if started by this profiler)."""
+        if self.lgcMemOwn:
+            tracemalloc.stop()
+            self.lgcMemOwn = False
+
+    def report(self):
+        """
+        Profiling report.
+
+        Returns
+        -------
+        dicRpt : dict
+            'meta': system information and total wall time since the
+            profiler was created; 'summary': one row per stage and model (see
+            `funcSummary`); 'records': all stage records; 'profile': most
+            expensive functions per stage (if cProfile was enabled).
+        """
+        dicPrf = {}
+        for strStg, dicStat in self.dicCprf.items():
+            lstTmp = sorted(dicStat.items(), key=lambda tplTmp: tplTmp[1][3],
+                            reverse=True)[:varNumTop]
+            dicPrf[strStg] = [
+                {'function': pstats.func_std_string(tplFnc),
+                 'calls': tplStat[1],
+                 'primitive_calls': tplStat[0],
+                 'tottime': tplStat[2],
+                 'cumtime': tplStat[3]}
+                for tplFnc, tplStat in lstTmp]
+
+        return {'meta': {'date': self.strDate,
+                         'wall': time.perf_counter() - self.varTme,
+                         'python': platform.python_version(),
+                         'platform': platform.platform(),
+                         'cpus': os.cpu_count(),
+                         'processes': len(set(dicRec['pid']
+                                              for dicRec in self.lstRec)),
+                         'cprofile': self.lgcCprf,
+                         'tracemalloc': self.lgcMem},
+                'summary': funcSummary(self.lstRec),
+                'records': self.lstRec,
+                'profile': dicPrf}
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcEnable(lgcCprf=False, lgcMem=False):
+    """
+    Enable profiling (replaces a profiler that is already active).
+
+    Parameters
+    ----------
+    lgcCprf : bool
+        Whether to record function-level profiles (cProfile).
+    lgcMem : bool
+        Whether to record peak memory per stage (tracemalloc, slows down
+        allocations considerably).
+
+    Returns
+    -------
+    objPrf : Profiler
+        Active profiler.
+    """
+    global objPrf
+    if objPrf is not None:
+        objPrf.close()
+    objPrf = Profiler(lgcCprf=lgcCprf, lgcMem=lgcMem)
+    return objPrf
+
+
+def funcDisable():
+    """Disable profiling, and return the profiler (None if not enabled)."""
+    global objPrf
+    objTmp = objPrf
+    objPrf = None
+    if objTmp is not None:
+        objTmp.close()
+    return objTmp
+
+
+def funcStage(strStg, **dicTag):
+    """
+    Context manager recording one stage (no-op if profiling is disabled).
+
+    Parameters
+    ----------
+    strStg : str
+        Name of the stage.
+    **dicTag
+        Tags of the record (e.g. `model=strMdl`).
+    """
+    if objPrf is None:
+        return objNull
+    return objPrf.stage(strStg, **dicTag)
+
+
+def funcWorkerCall(tplTmp):
+    """
+    Call a function in a worker process with a fresh profiler.
+
+    Parameters
+    ----------
+    tplTmp : tuple
+        Function, argument, and options of the profiler.
+
+    Returns
+    -------
+    tplRes : tuple
+        Return value of the function, stage records, and cProfile
+        statistics.
+    """
+    global objPrf
+    funcTmp, varArg, dicOpt = tplTmp
+
+    # Profiler inherited from the main process (fork) must not record:
+    if (objPrf is not None) and (objPrf.objCprf is not None):
+        objPrf.objCprf.disable()
+
+    objPrf = Profiler(**dicOpt)
+    try:
+        varRes = funcTmp(varArg)
+    finally:
+        objTmp = funcDisable()
+    return varRes, objTmp.lstRec, objTmp.dicCprf
+
+
+def funcPoolMap(objPool, funcTmp, lstArg, chunksize=1):
+    """
+    `Pool.map` that collects stage records from the worker processes.
+
+    If profiling is disabled, this is `objPool.map(funcTmp, lstArg,
+    chunksize=chunksize)`.
+    """
+    if objPrf is None:
+        return objPool.map(funcTmp, lstArg, chunksize=chunksize)
+
+    dicOpt = {'lgcCprf': objPrf.lgcCprf, 'lgcMem': objPrf.lgcMem,
+              'strPrfx': objPrf.funcPath()}
+    lstRes = objPool.map(funcWorkerCall,
+                         [(funcTmp, varArg, dicOpt) for varArg in lstArg],
+                         chunksize=chunksize)
+    for _, lstRec, dicCprf in lstRes:
+        objPrf.merge(lstRec, dicCprf)
+    return [tplRes[0] for tplRes in lstRes]
+
+
+def funcSummary(lstRec, tplKey=tplKeySum):
+    """
+    Summary of stage records.
+
+    Parameters
+    ----------
+    lstRec : list
+        Stage records (see `Profiler.stage`).
+    tplKey : tuple
+        Tags by which records are grouped (in addition to the stage).
+
+    Returns
+    -------
+    lstSum : list
+        One dictionary per stage and tag values (in order of first
+        occurrence), with the fields from `lstColSum` (times in seconds,
+        memory in bytes).
+    """
+    dicSum = {}
+    for dicRec in lstRec:
+        tplGrp = ((dicRec['stage'],)
+                  + tuple(dicRec['tags'].get(strKey) for strKey in tplKey))
+        dicTmp = dicSum.get(tplGrp)
+        if dicTmp is None:
+            dicTmp = dict(zip((('stage',) + tplKey), tplGrp))
+            dicTmp.update({'count': 0, 'wall_total': 0.0,
+                           'wall_min': dicRec['wall'],
+                           'wall_max': dicRec['wall'], 'cpu_total': 0.0,
+                           'mem_peak_max': None})
+            dicSum[tplGrp] = dicTmp
+        dicTmp['count'] += 1
+        dicTmp['wall_total'] += dicRec['wall']
+        dicTmp['wall_min'] = min(dicTmp['wall_min'], dicRec['wall'])
+        dicTmp['wall_max'] = max(dicTmp['wall_max'], dicRec['wall'])
+        dicTmp['cpu_total'] += dicRec['cpu']
+        if 'mem_peak' in dicRec:
+            dicTmp['mem_peak_max'] = max(dicTmp['mem_peak_max'] or 0,
+                                         dicRec['mem_peak'])
+
+    for dicTmp in dicSum.values():
+        dicTmp['wall_mean'] = dicTmp['wall_total'] / dicTmp['count']
+
+    return list(dicSum.values())
+
+
+def funcSaveReport(strPathOut, objTmp=None):
+    """
+    Save profiling report.
+
+    Parameters
+    ----------
+    strPathOut : str
+        Output file, json (full report) or csv (summary, one row per stage
+        and model). The file is replaced atomically.
+    objTmp : Profiler, optional
+        Profiler (default: active profiler).
+
+    Returns
+    -------
+    dicRpt : dict
+        Report (see `Profiler.report`).
+    """
+    if objTmp is None:
+        objTmp = objPrf
+    if objTmp is None:
+        raise ValueError('Profiling is not enabled')
+    dicRpt = objTmp.report()
+
+    strPathDir = os.path.dirname(os.path.abspath(strPathOut))
+    varFd, strPathTmp = tempfile.mkstemp(dir=strPathDir)
+    try:
+        with os.fdopen(varFd, 'w', newline='') as objFle:
+            if strPathOut.lower().endswith('.json'):
+                json.dump(dicRpt, objFle, indent=1)
+            else:
+                objWrt = csv.DictWriter(objFle, fieldnames=lstColSum)
+                objWrt.writeheader()
+                objWrt.writerows(dicRpt['summary'])
+        os.replace(strPathTmp, strPathOut)
+    except BaseException:
+        os.remove(strPathTmp)
+        raise
+
+    return dicRpt
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Overhead of disabled and enabled stages
+
+if __name__ == '__main__':
+
+    varNumIt = 100000
+    for lgcEnb in (False, True):
+        if lgcEnb:
+            funcEnable()
+        varTme = time.perf_counter()
+        for idxIt in range(varNumIt):
+            with funcStage('stage', model='poly3'):
+                pass
+        varTme = (time.perf_counter() - varTme) / varNumIt
+        print(('Enabled' if lgcEnb else 'Disabled') + ': '
+              + str(round(varTme * 1e6, 3)) + ' us per stage')
+    funcDisable()
+# *****************************************************************************
@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command line interface for luminance conversions and fitting.
+
+Subcommands:
+
+    lum       psychopy pixel intensity -> luminance [cd/m^2]
+    pix       luminance [cd/m^2] -> psychopy pixel intensity
+    contrast  target contrast -> pair of psychopy pixel intensities
+    fit       fit luminance models to measurement files (csv)
+    select    rank models by cross validation and AIC/BIC (model_selection.py)
+    drift     compare calibrations over time (calibration_drift.py)
+    uniformity  gain map from grid measurement of luminance (uniformity.py)
+    correct   gamma correct stacks of frames (.npy, see gamma_correct.py)
+    serve     run lookup server for experiment processes (lookup_server.py)
+
+Values are given as arguments, or streamed from a file or stdin (`-i -`), one
+or several values per line (separated by whitespace or commas). Results are
+written as csv (input value and result(s), one row per value) to stdout or
+to a file (`-o`). The calibration is taken from the calibration store (see
+calibration_store.py), or given directly as polynomial coefficients (`--prm`).
+
+Examples:
+
+    python psychophysics.py lum -0.5 0.0 0.5 --coil NOVA
+    cat targets.txt | python psychophysics.py pix -i - --coil NOVA > pix.csv
+    python psychophysics.py contrast 0.01 0.05 0.1 --coil vision --bck-pix 0
+    python psychophysics.py fit luminance_measurement_20180913/ -o fits.csv
+    python psychophysics.py select luminance_measurement_20180913/
+    python psychophysics.py drift --tolerance 10
+    python psychophysics.py uniformity luminance_grid.csv -o gain.npz
+
+Heavy dependencies (scipy, matplotlib) are only imported by the subcommands
+that need them, so that conversions start quickly.
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+# Only light-weight modules at startup; numpy and the conversion modules are
+# imported by the subcommands.
+import sys
+import argparse
+from itertools import islice
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Number of input lines converted at once in batch mode:
+varSzeChnk = 65536
+
+# Output format of numbers:
+strFmt = '%.10g'
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcGetPrm(objArgs):
+    """Polynomial coefficients from command line or calibration store."""
+    if objArgs.prm is not None:
+        return objArgs.prm
+    from calibration_store import funcStoreQuery
+    vecPrm, _ = funcStoreQuery(objArgs.display, objArgs.coil,
+                               objArgs.filter, objArgs.date,
+                               strPathStore=objArgs.store)
+    return vecPrm
+
+
+def funcIterChunks(objArgs):
+    """
+    Input values, in chunks.
+
+    Yields
+    ------
+    vecIn : np.ndarray
+        Input values (float64).
+    """
+    import numpy as np
+
+    if objArgs.input is None:
+        yield np.array(objArgs.values, dtype=np.float64)
+        return
+
+    if objArgs.input == '-':
+        objFle = sys.stdin
+    else:
+        objFle = open(objArgs.input, 'r')
+
+    try:
+        while True:
+            lstLne = list(islice(objFle, varSzeChnk))
+            if not lstLne:
+                break
+            lstVal = ' '.join(lstLne).replace(',', ' ').split()
+            yield np.array(lstVal, dtype=np.float64)
+    finally:
+        if objFle is not sys.stdin:
+            objFle.close()
+
+
+def funcConvert(objArgs, funcChnk, lstHdr):
+    """
+    Stream input values through a conversion, write csv output.
+
+    Parameters
+    ----------
+    objArgs : argparse.Namespace
+        Command line arguments.
+    funcChnk : function
+        Conversion, takes a vector of input values and returns a list of
+        output vectors.
+    lstHdr : list
+        Column names (input and outputs).
+    """
+    import numpy as np
+
+    if objArgs.output is None:
+        objOut = sys.stdout
+    else:
+        objOut = open(objArgs.output, 'w')
+
+    varNumNan = 0
+    try:
+        if objArgs.header:
+            objOut.write(','.join(lstHdr) + '\n')
+        for vecIn in funcIterChunks(objArgs):
+            lstOut = funcChnk(vecIn)
+            aryOut = np.stack([vecIn] + list(lstOut), axis=1)
+            varNumNan += int(np.sum(np.isnan(lstOut[-1])))
+            # One format operation per chunk (faster than `np.savetxt`,
+            # which formats row by row):
+            strRow = ','.join([strFmt] * aryOut.shape[1]) + '\n'
+            objOut.write((strRow * aryOut.shape[0]) % tuple(aryOut.ravel()))
+    finally:
+        if objOut is not sys.stdout:
+            objOut.close()
+
+    if varNumNan > 0:
+        sys.stderr.write(str(varNumNan) + ' value(s) out of range of the '
+                         + 'display (NaN)\n')
+
+
+def funcCmdLum(objArgs):
+    """Subcommand lum: pixel intensity to luminance."""
+    from luminance import funcLum
+    vecPrm = funcGetPrm(objArgs)
+    funcConvert(objArgs,
+                lambda vecIn: [funcLum(vecIn, vecPrm)],
+                ['pixel', 'luminance'])
+
+
+def funcCmdPix(objArgs):
+    """Subcommand pix: luminance to pixel intensity."""
+    from luminance import funcPix
+    vecPrm = funcGetPrm(objArgs)
+    funcConvert(objArgs,
+                lambda vecIn: [funcPix(vecIn, vecPrm,
+                                       lgcStrict=objArgs.strict)],
+                ['luminance', 'pixel'])
+
+
+def funcCmdContrast(objArgs):
+    """Subcommand contrast: target contrast to pair of pixel intensities."""
+    from contrast import funcCntrPix
+    vecPrm = funcGetPrm(objArgs)
+    funcConvert(objArgs,
+                lambda vecIn: list(funcCntrPix(vecIn, vecPrm,
+                                               varBckPix=objArgs.bck_pix,
+                                               varBckCd=objArgs.bck_lum,
+                                               strDef=objArgs.definition,
+                                               lgcStrict=objArgs.strict)),
+                ['contrast', 'pixel_1', 'pixel_2'])
+
+
+def funcCmdFit(objArgs):
+    """Subcommand fit: fit luminance models to measurement files."""
+    from fit_luminance_batch import (funcFindCsv, funcFitBatch,
+                                     funcPlotSessions, lstCol)
+    from luminance_io import funcSaveTable
+
+    from profiling import funcEnable, funcSaveReport, funcStage
+
+    if objArgs.profile is not None:
+        funcEnable(lgcCprf=objArgs.cprofile, lgcMem=objArgs.tracemalloc)
+
+    with funcStage('find'):
+        lstPathCsv = funcFindCsv(objArgs.path)
+    with funcStage('fit_batch'):
+        lstRow = funcFitBatch(lstPathCsv, varPar=objArgs.processes)
+    with funcStage('save_table'):
+        funcSaveTable(lstRow, (objArgs.output or sys.stdout), lstCol)
+
+    if objArgs.plots is not None:
+        with funcStage('import_plot'):
+            from luminance_plot import funcRenderBatch
+        with funcStage('render_batch'):
+            funcRenderBatch(funcPlotSessions(lstRow, objArgs.plots,
+                                             strPathIn=objArgs.path),
+                            varPar=objArgs.processes)
+
+    if objArgs.profile is not None:
+        funcSaveReport(objArgs.profile)
+
+
+def funcCmdSelect(objArgs):
+    """Subcommand select: rank models by cross validation and AIC/BIC."""
+    from luminance_io import funcLoadArchive, funcSaveTable
+    from model_selection import (funcFormatSummary, funcSelect, funcSummary,
+                                 lstColSel, lstColSum)
+
+    lstRow = funcSelect(funcLoadArchive(objArgs.path), varNumFld=objArgs.folds,
+                        varPar=objArgs.processes)
+    funcSaveTable(lstRow, (objArgs.output or sys.stdout), lstColSel)
+
+    lstSum = funcSummary(lstRow)
+    if objArgs.summary is not None:
+        funcSaveTable(lstSum, objArgs.summary, lstColSum)
+    sys.stderr.write('Mean rank across sessions (1: best; in brackets: '
+                     + 'sessions in which the criterion was comparable and '
+                     + 'ranked; -: never ranked):\n'
+                     + funcFormatSummary(lstSum) + '\n')
+
+
+def funcCmdDrift(objArgs):
+    """
+    Subcommand drift: compare calibrations of the store over time.
+
+    Returns exit status 2 if any calibration deviates from the previous
+    calibration by more than the tolerance.
+    """
+    import numpy as np
+    from calibration_drift import (funcDrift, funcDriftLoad, funcDriftRows,
+                                   lstColDrf)
+    from luminance_io import funcSaveTable
+
+    dicCol = funcDriftLoad(objArgs.store)
+    dicDrf = funcDrift(dicCol, varTol=objArgs.tolerance)
+    funcSaveTable(funcDriftRows(dicCol, dicDrf),
+                  (objArgs.output or sys.stdout), lstColDrf)
+
+    varNumFlg = int(np.sum(dicDrf['flag']))
+    if varNumFlg > 0:
+        sys.stderr.write(str(varNumFlg) + ' calibration(s) deviate from the '
+                         + 'previous calibration by more than '
+                         + str(objArgs.tolerance) + ' cd/m^2\n')
+        return 2
+    return 0
+
+
+def funcCmdUniformity(objArgs):
+    """Subcommand uniformity: fit gain map to grid measurement."""
+    import numpy as np
+    from uniformity import (funcGainMap, funcGainSave, funcReadGrid,
+                            funcSurfFit)
+
+    aryPos, vecCd = funcReadGrid(objArgs.path)
+    dicSrf = funcSurfFit(aryPos, vecCd, objArgs.size[0], objArgs.size[1],
+                         varDeg=objArgs.degree)
+    aryGain = funcGainMap(dicSrf, strRef=objArgs.reference)
+    funcGainSave(objArgs.output, aryGain, dicSrf)
+    sys.stderr.write('Surface of degree ' + str(dicSrf['deg']) + ' fitted to '
+                     + str(dicSrf['obs']) + ' positions (R2 = '
+                     + ('%.4f' % dicSrf['r2']) + '), gain '
+                     + ('%.3f' % np.min(aryGain)) + ' to '
+                     + ('%.3f' % np.max(aryGain)) + ', saved to '
+                     + objArgs.output + '\n')
+
+
+def funcCmdCorrect(objArgs):
+    """Subcommand correct: gamma correct a stack of frames."""
+    import numpy as np
+    from gamma_correct import funcCorrectStack
+    vecPrm = funcGetPrm(objArgs)
+    if objArgs.gain is None:
+        aryGain = None
+    else:
+        from luminance import funcGamut
+        from uniformity import funcGainCdMax, funcGainLoad
+        aryGain = funcGainLoad(objArgs.gain)[0]
+        # Gains above one push bright values out of the range of the display:
+        varCdHi = funcGamut(vecPrm)[3]
+        sys.stderr.write('Gain ' + ('%.3f' % np.min(aryGain)) + ' to '
+                         + ('%.3f' % np.max(aryGain)) + ', highest luminance '
+                         + 'reachable everywhere: '
+                         + ('%.1f' % funcGainCdMax(aryGain, varCdHi))
+                         + ' cd/m^2 (display: ' + ('%.1f' % varCdHi)
+                         + ' cd/m^2)\n')
+    dicRes = funcCorrectStack(objArgs.input, objArgs.output, vecPrm,
+                              strRng=objArgs.range, varBit=objArgs.bits,
+                              varThrd=objArgs.threads,
+                              lgcStrict=objArgs.strict, aryGain=aryGain)
+    sys.stderr.write(str(dicRes['frames']) + ' frames in '
+                     + ('%.2f' % dicRes['seconds']) + ' s ('
+                     + ('%.1f' % dicRes['fps']) + ' frames/s)\n')
+    if dicRes['outside'] > 0:
+        sys.stderr.write('Warning: ' + str(dicRes['outside'])
+                         + ' value(s) out of the range of the display, '
+                         + 'written as NaN\n')
+
+
+def funcCmdServe(objArgs):
+    """Subcommand serve: run lookup server."""
+    from lookup_server import funcServe
+    funcServe(strPathSock=objArgs.socket, varPort=objArgs.port,
+              varBit=objArgs.lut, strPathStore=objArgs.store)
+
+
+def funcParser():
+    """Command line parser."""
+    objParser = argparse.ArgumentParser(
+        prog='psychophysics',
+        description='Luminance conversions and fitting for psychopy.')
+    objSub = objParser.add_subparsers(dest='command')
+    objSub.required = True
+
+    # Calibration (shared by conversions and gamma correction):
+    objCal = argparse.ArgumentParser(add_help=False)
+    objCal.add_argument('--prm', nargs='+', type=float, default=None,
+                        help='Polynomial coefficients, highest degree first '
+                        + '(instead of calibration store).')
+    objCal.add_argument('--display', default='7T',
+                        help='Display (calibration store, default: 7T).')
+    objCal.add_argument('--coil', default='NOVA',
+                        help='Coil (calibration store, default: NOVA).')
+    objCal.add_argument('--filter', default='ND.3',
+                        help='Filter (calibration store, default: ND.3).')
+    objCal.add_argument('--date', default=None,
+                        help='Date of experiment, ISO format (calibration '
+                        + 'store, default: now).')
+    objCal.add_argument('--store', default=None,
+                        help='Directory of calibration store.')
+    objCal.add_argument('--strict', action='store_true',
+                        help='Fail on values out of range of the display '
+                        + '(default: NaN).')
+
+    # Arguments shared by conversions:
+    objCnv = argparse.ArgumentParser(add_help=False, parents=[objCal])
+    objCnv.add_argument('values', nargs='*', type=float,
+                        help='Input values (alternatively use -i).')
+    objCnv.add_argument('-i', '--input', default=None,
+                        help='File with input values, - for stdin.')
+    objCnv.add_argument('-o', '--output', default=None,
+                        help='Output csv file (default: stdout).')
+    objCnv.add_argument('--header', action='store_true',
+                        help='Write header row.')
+
+    objTmp = objSub.add_parser('lum', parents=[objCnv],
+                               help='Pixel intensity to luminance.')
+    objTmp.set_defaults(func=funcCmdLum)
+
+    objTmp = objSub.add_parser('pix', parents=[objCnv],
+                               help='Luminance to pixel intensity.')
+    objTmp.set_defaults(func=funcCmdPix)
+
+    objTmp = objSub.add_parser('contrast', parents=[objCnv],
+                               help='Contrast to pair of pixel intensities.')
+    objTmp.add_argument('--definition', default='michelson',
+                        choices=['michelson', 'weber'],
+                        help='Contrast definition (default: michelson).')
+    objTmp.add_argument('--bck-pix', type=float, default=None,
+                        help='Background pixel intensity (default: 0).')
+    objTmp.add_argument('--bck-lum', type=float, default=None,
+                        help='Background luminance [cd/m^2].')
+    objTmp.set_defaults(func=funcCmdContrast)
+
+    objTmp = objSub.add_parser('fit', help='Fit models to measurements.')
+    objTmp.add_argument('path',
+                        help='Measurement file or directory (recursive).')
+    objTmp.add_argument('-o', '--output', default=None,
+                        help='Output csv file (default: stdout).')
+    objTmp.add_argument('--plots', default=None,
+                        help='Output directory for summary figures.')
+    objTmp.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of processes (default: number of CPUs).')
+    objTmp.add_argument('--profile', default=None,
+                        help='Profiling report of processing stages (.json '
+                        + 'or .csv).')
+    objTmp.add_argument('--cprofile', action='store_true',
+                        help='Add function-level profiles per stage to the '
+                        + 'report (cProfile).')
+    objTmp.add_argument('--tracemalloc', action='store_true',
+                        help='Add peak memory per stage to the report '
+                        + '(tracemalloc).')
+    objTmp.set_defaults(func=funcCmdFit)
+
+    objTmp = objSub.add_parser('select',
+                               help='Rank models by cross validation.')
+    objTmp.add_argument('path', help='Directory of measurement files '
+                        + '(recursive).')
+    objTmp.add_argument('-o', '--output', default=None,
+                        help='Output csv file, one row per session and model '
+                        + '(default: stdout).')
+    objTmp.add_argument('--summary', default=None,
+                        help='Output csv file, ranks per model summarised '
+                        + 'across sessions.')
+    objTmp.add_argument('-k', '--folds', type=int, default=5,
+                        help='Number of folds of k-fold cross validation '
+                        + '(default: 5).')
+    objTmp.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of processes (default: number of CPUs).')
+    objTmp.set_defaults(func=funcCmdSelect)
+
+    objTmp = objSub.add_parser('drift',
+                               help='Compare calibrations over time.')
+    objTmp.add_argument('--store', default=None,
+                        help='Directory of calibration store.')
+    objTmp.add_argument('--tolerance', type=float, default=10.0,
+                        help='Maximum deviation from previous calibration '
+                        + '[cd/m^2] (default: 10).')
+    objTmp.add_argument('-o', '--output', default=None,
+                        help='Output csv file (default: stdout).')
+    objTmp.set_defaults(func=funcCmdDrift)
+
+    objTmp = objSub.add_parser('uniformity',
+                               help='Fit gain map to grid measurement.')
+    objTmp.add_argument('path', help='Grid measurement file (csv).')
+    objTmp.add_argument('-o', '--output', default='gain_map.npz',
+                        help='Output gain map (.npz, default: '
+                        + 'gain_map.npz).')
+    objTmp.add_argument('--size', nargs=2, type=float, default=[1920, 1200],
+                        help='Display resolution, width and height [pix] '
+                        + '(default: 1920 1200).')
+    objTmp.add_argument('--degree', type=int, default=2,
+                        help='Degree of the surface (default: 2).')
+    objTmp.add_argument('--reference', default='centre',
+                        choices=['centre', 'min', 'mean'],
+                        help='Reference luminance of the gain (default: '
+                        + 'centre, luminance at the centre unchanged; min '
+                        + 'keeps all gains at most one, but scales all '
+                        + 'luminance down).')
+    objTmp.set_defaults(func=funcCmdUniformity)
+
+    objTmp = objSub.add_parser('correct', parents=[objCal],
+                               help='Gamma correct a stack of frames.')
+    objTmp.add_argument('input',
+                        help='Input stack (.npy), frames x height x width.')
+    objTmp.add_argument('output', help='Output stack (.npy).')
+    objTmp.add_argument('--range', default='cd',
+                        choices=['cd', 'dtype', 'norm'],
+                        help='Input values: luminance [cd/m^2] (default), '
+                        + 'full range of integer type, or -1 to 1, mapped '
+                        + 'onto the luminance range of the display.')
+    objTmp.add_argument('--bits', type=int, default=16,
+                        help='Resolution of lookup table (default: 16).')
+    objTmp.add_argument('-j', '--threads', type=int, default=None,
+                        help='Number of threads (default: number of CPUs).')
+    objTmp.add_argument('--gain', default=None,
+                        help='Gain map for spatial non-uniformity (.npz, see '
+                        + 'uniformity), luminance input only. Gains above '
+                        + 'one can push bright values out of the range of '
+                        + 'the display (see --strict).')
+    objTmp.set_defaults(func=funcCmdCorrect)
+
+    objTmp = objSub.add_parser('serve', help='Run lookup server.')
+    objTmp.add_argument('--socket', default=None,
+                        help='Unix socket (default: in temporary directory).')
+    objTmp.add_argument('--port', type=int, default=None,
+                        help='TCP port on localhost (instead of socket).')
+    objTmp.add_argument('--lut', type=int, default=None,
+                        help='Load lookup tables of this resolution at '
+                        + 'startup (8, 10, or 16 bit).')
+    objTmp.add_argument('--store', default=None,
+                        help='Directory of calibration store.')
+    objTmp.set_defaults(func=funcCmdServe)
+
+    return objParser
+
+
+def main(lstArgs=None):
+    """Run command line interface."""
+    objArgs = funcParser().parse_args(lstArgs)
+    try:
+        varRet = objArgs.func(objArgs)
+    except (ValueError, LookupError, IOError) as objErr:
+        sys.stderr.write('psychophysics: error: ' + str(objErr) + '\n')
+        sys.exit(1)
+    if varRet:
+        sys.exit(varRet)
+# *****************************************************************************
+
+
+if __name__ == '__main__':
+    main()
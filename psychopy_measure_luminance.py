@@ -4,6 +4,14 @@
 Psychopy script to present and measure luminance levels (with a light meter).
 Press buttons 1 and 2 to move from darker to brighter, or vice verser.
 Press button 4 to switch on or off the info for the current intensity level.
+Press escape or q to quit. Flip intervals and dropped frames are saved to a
+log file.
+
+In grid mode, a patch of one intensity is stepped across a grid of screen
+positions instead (buttons 1 and 2 move to the previous or next position), to
+measure the spatial non-uniformity of the display. A measurement file with
+the grid positions is saved, in which the luminance at each position is
+entered (see uniformity.py for the surface fit and correction gain map).
 """
 
 # Copyright (C) 2018  Ingo Marquardt & Marian Schneider
@@ -24,17 +32,36 @@ Press button 4 to switch on or off the info for the current intensity level.
 
 from psychopy import visual, monitors, core, event
 import numpy as np
+from measure_loop import (funcColorStates, funcTextStates, funcRenderLoop,
+                          funcSaveLog, funcTimingSummary, varFrmPrdDef)
+from uniformity import funcGridPos, funcGridTextStates, funcWriteGrid
 
 # %% GENERAL PARAMETERS
 
 # set number of linear steps from black to white
 steps = 17
 
-# space linearly
-colorArray = np.linspace(-1.0, 1.0, num=steps)
+# colour channel to measure: 'gray' (r=g=b), or 'red', 'green', 'blue' (one
+# channel, the others at black) for per-channel calibration
+channel = 'gray'
 
-# repeat and reshape array so that it confirms to rgb triplet where r=g=b
-colorArray = np.tile(colorArray, 3).reshape(3, -1).T
+# colour of each step, rgb triplets (steps x 3)
+colorArray = funcColorStates(steps, strChn=channel)
+
+# measurement mode: 'full' (full-screen intensity levels), or 'grid' (patch
+# stepped across screen positions, for spatial non-uniformity)
+mode = 'full'
+
+# grid mode: number of positions (horizontal, vertical), and intensity of the
+# patch (rgb)
+gridSize = (5, 5)
+gridColor = [1.0, 1.0, 1.0]
+
+# grid mode: measurement file (positions, luminance to be entered)
+pathGrid = 'luminance_grid_' + core.getDateStr() + '.csv'
+
+# frame timing log (flip intervals and dropped frames, one row per frame)
+pathLog = 'frame_timing_' + core.getDateStr() + '.csv'
 
 # %% MONITOR
 
@@ -64,24 +91,44 @@ mywin = visual.Window(
 
 # %% STIMULUS
 
+# grid mode: one step per position, patch of constant intensity
+if mode == 'grid':
+    gridPos, stimSize = funcGridPos(PixW, PixH, tplGrd=gridSize)
+    colorArray = np.repeat(np.array([gridColor]), gridPos.shape[0], axis=0)
+    stepTexts = funcGridTextStates(gridPos)
+    funcWriteGrid(pathGrid, gridPos, np.full(gridPos.shape[0], np.nan))
+else:
+    gridPos = None
+    stimSize = (PixW, PixH)
+    stepTexts = funcTextStates(colorArray)
+
 # Squares
 testStim1 = visual.GratingStim(
     win=mywin,
     tex=None,
     units='pix',
-    size=(PixW, PixH),
+    size=stimSize,
     colorSpace='rgb'
     )
 
-# Text
-RGBText = visual.TextStim(
+# Text, one stimulus per step (created once, so that no text is rendered
+# during the render loop)
+RGBTexts = [visual.TextStim(
     win=mywin,
+    text=stepText,
     color='green',
     height=30,
     units='pix',
     opacity=1,
     pos=(0, -PixH/2+50)
-    )
+    ) for stepText in stepTexts]
+
+# frame period of the display (measured)
+frameRate = mywin.getActualFrameRate()
+if frameRate is None:
+    framePeriod = varFrmPrdDef
+else:
+    framePeriod = 1.0 / frameRate
 
 # %% TIME
 # give the system time to settle
@@ -89,51 +136,20 @@ core.wait(0.5)
 
 # %% RENDER_LOOP
 
-trigCount = 0
-textCount = 0
-presentation = True
-
-while presentation:
+# present steps until escape or q is pressed (see measure_loop.py)
+frameLog = funcRenderLoop(mywin, testStim1, RGBTexts, colorArray,
+                          event.getKeys, aryPos=gridPos)
 
-    # set colour
-    testStim1.setColor(colorArray[trigCount])
-    testStim1.draw()
-
-    # update text text
-    StepText = 'Step %s out of %s' % (trigCount+1, steps)
-    RGBText.setText('RGB: ' + str(colorArray[trigCount]) + '\n' + StepText)
-    RGBText.draw()
-
-    mywin.flip()
-
-    # handle key presses each frame
-    for keys in event.getKeys():
-
-        # if 2 was pressed: increase RGB value
-        if keys[0] in ['2']:
-            if trigCount < steps-1:
-                trigCount = trigCount+1
-
-        # if 1 was pressed: decrease RGB value
-        if keys[0] in ['1']:
-            if trigCount > 0:
-                trigCount = trigCount-1
-
-        # if 4 was pressed: toggle RGB value shown/hidden
-        if keys[0] in ['4']:
-            textCount += 1
-            if textCount % 2 == 0:
-                RGBText.opacity = 0
-                RGBText.draw()
-
-            elif textCount % 2 == 1:
-                RGBText.opacity = 1
-                RGBText.draw()
+mywin.close()
 
-        if keys[0] in ['escape', 'q']:
-            presentation = False
-            mywin.close()
-            core.quit()
+frameTiming = funcSaveLog(pathLog, frameLog, varFrmPrd=framePeriod)
+print(funcTimingSummary(frameTiming, varFrmPrd=framePeriod))
+if frameLog['full']:
+    print('Warning: frame log full, the loop ended after '
+          + str(frameTiming['frames']) + ' frames (maximum number of frames '
+          + 'in one run, see measure_loop.py), not by the quit key')
+print('Frame timing saved to: ' + pathLog)
+if mode == 'grid':
+    print('Enter luminance at grid positions in: ' + pathGrid)
 
-mywin.close()
 core.quit()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+"""
+Calibration of the red, green, and blue channel of a display.
+
+Each channel is measured separately, stepping through its intensities with
+the other channels at black (see `measure_loop.funcColorStates` and
+`photometer.funcPsychopySetter`, with `strChn` 'red', 'green', or 'blue').
+The luminance function of each channel is fitted with a model that is linear
+in its parameters (e.g. the cubic polynomial, see luminance_models.py), all
+channels in one batched least squares solution.
+
+Assuming that the channels add (as for projectors and most LCDs), the
+luminance of an RGB pixel is the sum of the channel luminances, minus the
+black level that is contained in each of them twice (`funcLumRgb`).
+
+Inverse lookup tables of the three channels are stacked into one table
+(channels x entries), so that a whole RGB image of target luminances (per
+channel) is converted to pixel intensities in one broadcasted pass
+(`funcLutApplyRgb`).
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import numpy as np
+from luminance import funcLum, varSzeChnk
+from luminance_lut import funcLutLoad, funcLutSlope
+from luminance_models import dicMdl
+from measure_loop import tplChn
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcFitRgb(vecInd, aryDep, strMdl='poly3'):
+    """
+    Fit luminance functions of all channels at once.
+
+    Parameters
+    ----------
+    vecInd : np.ndarray
+        Pixel intensities, one vector for all channels (levels), or one per
+        channel (channels x levels).
+    aryDep : np.ndarray
+        Measured luminance [cd/m^2], channels x levels (e.g. averaged across
+        repetitions), or channels x repetitions x levels. NaN for missing
+        readings.
+    strMdl : str
+        Model name (key of `luminance_models.dicMdl`), a model with a design
+        matrix ('basis').
+
+    Returns
+    -------
+    aryPrm : np.ndarray
+        Fitted parameters, channels x parameters (NaN for channels with too
+        few readings).
+    """
+    dicTmp = dicMdl[strMdl]
+    if dicTmp['basis'] is None:
+        raise ValueError('Batched fit requires a model that is linear in its '
+                         + 'parameters, not ' + strMdl)
+
+    aryDep = np.asarray(aryDep, dtype=np.float64)
+    if aryDep.ndim == 3:
+        # Average across repetitions (levels without any reading are NaN):
+        lgcTmp = np.isfinite(aryDep)
+        with np.errstate(invalid='ignore'):
+            aryDep = (np.sum(np.where(lgcTmp, aryDep, 0.0), axis=1)
+                      / np.sum(lgcTmp, axis=1))
+    aryX = np.broadcast_to(np.asarray(vecInd, dtype=np.float64),
+                           aryDep.shape)
+
+    # Stacked design matrices, channels x levels x parameters. Missing
+    # readings and levels outside of the model domain get zero weight:
+    lgcVld = dicTmp['domain'](aryX) & np.isfinite(aryDep)
+    with np.errstate(all='ignore'):
+        aryDsgn = dicTmp['basis'](aryX)
+    aryDsgn[~lgcVld] = 0.0
+    aryY = np.where(lgcVld, aryDep, 0.0)
+
+    # One batched least squares solution for all channels:
+    aryPrm = np.matmul(np.linalg.pinv(aryDsgn), aryY[:, :, None])[:, :, 0]
+
+    aryPrm[np.sum(lgcVld, axis=1) < len(dicTmp['prm'])] = np.nan
+
+    return aryPrm
+
+
+def funcLumRgb(aryPix, aryPrm, out=None):
+    """
+    Luminance of RGB pixels (channels assumed additive).
+
+    Parameters
+    ----------
+    aryPix : array_like
+        Psychopy pixel intensities, RGB along the last axis (e.g. an image,
+        height x width x 3).
+    aryPrm : np.ndarray
+        Polynomial coefficients of the channels, channels x coefficients
+        (highest degree first).
+    out : np.ndarray, optional
+        Output array, shape of `aryPix` without the last axis.
+
+    Returns
+    -------
+    out : np.ndarray
+        Luminance [cd/m^2].
+    """
+    aryPix = np.asarray(aryPix)
+    if out is None:
+        out = np.zeros(aryPix.shape[:-1],
+                       dtype=np.result_type(aryPix.dtype, np.float32))
+    else:
+        out[...] = 0.0
+
+    # Black level, contained in the luminance function of every channel:
+    varCdBlck = np.mean([funcLum(-1.0, vecPrm) for vecPrm in aryPrm])
+
+    aryTmp = np.empty(out.shape, dtype=out.dtype)
+    for idxChn, vecPrm in enumerate(aryPrm):
+        funcLum(aryPix[..., idxChn], vecPrm, out=aryTmp)
+        out += aryTmp
+    out -= (len(aryPrm) - 1) * varCdBlck
+
+    return out
+
+
+def funcLutLoadRgb(aryPrm, varBit=16, strKnd='inv', strPathCache=None):
+    """
+    Stacked lookup tables of all channels.
+
+    Parameters
+    ----------
+    aryPrm : np.ndarray
+        Polynomial coefficients of the channels, channels x coefficients.
+    varBit : int
+        Resolution of the tables, one of 8, 10, or 16 bit.
+    strKnd : str
+        'fwd' (pixel intensity to luminance) or 'inv' (luminance to pixel
+        intensity).
+    strPathCache : str, optional
+        Cache directory (see `luminance_lut.funcLutLoad`).
+
+    Returns
+    -------
+    aryLut : np.ndarray
+        Lookup tables, channels x entries.
+    vecLo, vecHi : np.ndarray
+        Input values corresponding to the first and last entry of each
+        table.
+    """
+    lstLut = [funcLutLoad(vecPrm, varBit=varBit, strKnd=strKnd,
+                          strPathCache=strPathCache)
+              for vecPrm in aryPrm]
+    aryLut = np.stack([np.asarray(tplTmp[0]) for tplTmp in lstLut])
+    vecLo = np.array([tplTmp[1] for tplTmp in lstLut])
+    vecHi = np.array([tplTmp[2] for tplTmp in lstLut])
+    return aryLut, vecLo, vecHi
+
+
+def funcLutApplyRgb(aryIn, aryLut, vecLo, vecHi, out=None, lgcStrict=True,
+                    varChnk=varSzeChnk, vecSlp=None):
+    """
+    Look up RGB values in stacked tables, with linear interpolation.
+
+    Parameters
+    ----------
+    aryIn : array_like
+        Input values, RGB along the last axis (e.g. target luminance per
+        channel of an image, height x width x 3).
+    aryLut : np.ndarray
+        Lookup tables, channels x entries (see `funcLutLoadRgb`).
+    vecLo, vecHi : np.ndarray
+        Input values corresponding to the first and last entry of each
+        table.
+    out : np.ndarray, optional
+        Output array, same shape as `aryIn`. Float32 output is supported.
+    lgcStrict : bool
+        If True, a ValueError is raised if any input value is outside of the
+        range of its table. If False, NaN is returned for those values.
+    varChnk : int
+        Number of pixels processed at once.
+    vecSlp : np.ndarray, optional
+        Slopes between neighbouring entries of the flattened tables
+        (`luminance_lut.funcLutSlope(aryLut.ravel())`), calculated if not
+        given.
+
+    Returns
+    -------
+    out : np.ndarray
+        Interpolated table values, same shape as `aryIn`.
+    """
+    aryIn = np.asarray(aryIn)
+    varNumChn, varNumEnt = aryLut.shape
+    if aryIn.shape[-1] != varNumChn:
+        raise ValueError('Last axis of input (' + str(aryIn.shape[-1])
+                         + ') does not match number of channels ('
+                         + str(varNumChn) + ')')
+
+    if out is None:
+        out = np.empty(aryIn.shape,
+                       dtype=np.result_type(aryIn.dtype, np.float32))
+    elif out.shape != aryIn.shape:
+        raise ValueError('Shape of output array ' + str(out.shape)
+                         + ' does not match input ' + str(aryIn.shape))
+
+    # Tables and slopes between neighbouring entries, flattened, so that one
+    # gather per table serves all channels (offset of each channel):
+    vecLut = np.ascontiguousarray(aryLut, dtype=np.float64).ravel()
+    if vecSlp is None:
+        vecSlp = funcLutSlope(vecLut)
+    vecOff = np.arange(varNumChn) * varNumEnt
+    varMaxIdx = varNumEnt - 1
+    vecScl = varMaxIdx / (vecHi - vecLo)
+
+    aryTmpIn = aryIn.reshape(-1, varNumChn)
+    aryTmpOut = out.reshape(-1, varNumChn)
+    varStp = max(1, varChnk // varNumChn)
+
+    for idxStr in range(0, aryTmpIn.shape[0], varStp):
+        idxEnd = min(idxStr + varStp, aryTmpIn.shape[0])
+
+        # Fractional table index, broadcast across channels:
+        aryPos = (aryTmpIn[idxStr:idxEnd] - vecLo) * vecScl
+        lgcOut = ~((aryPos >= 0.0) & (aryPos <= varMaxIdx))
+        if np.any(lgcOut):
+            if lgcStrict:
+                raise ValueError(str(np.sum(lgcOut)) + ' value(s) out of '
+                                 + 'range of lookup tables')
+            aryPos[lgcOut] = 0.0
+        aryIdx = aryPos.astype(np.intp)
+        aryPos -= aryIdx
+        aryIdx += vecOff
+        aryPos *= vecSlp[aryIdx]
+        aryPos += vecLut[aryIdx]
+        if np.any(lgcOut):
+            aryPos[lgcOut] = np.nan
+        aryTmpOut[idxStr:idxEnd] = aryPos
+
+    if not np.shares_memory(aryTmpOut, out):
+        out[...] = aryTmpOut.reshape(out.shape)
+
+    return out
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Simulated calibration
+
+if __name__ == '__main__':
+
+    import time
+    from photometer import funcAcquire, SimulatedDisplay, SimulatedPhotometer
+
+    # Simulated channels: fractions of the grey luminance function (7T, NOVA
+    # coil) above black:
+    vecPrmGry = np.array([-195.9, 246.3, 887.4, 454.4])
+    varCdBlck = np.polyval(vecPrmGry, -1.0)
+    vecFrc = np.array([0.3, 0.6, 0.1])
+    aryPrmTrue = vecFrc[:, None] * vecPrmGry[None, :]
+    aryPrmTrue[:, -1] += (1.0 - vecFrc) * varCdBlck
+
+    vecInd = np.linspace(-1.0, 1.0, num=17)
+    aryDep = np.empty((len(tplChn), 2, vecInd.size))
+    for idxChn in range(len(tplChn)):
+        objDsp = SimulatedDisplay(aryPrmTrue[idxChn], varTau=0.002)
+        objPht = SimulatedPhotometer(objDsp, varTmeInt=0.005,
+                                     varSeed=idxChn)
+        aryDep[idxChn] = funcAcquire(objPht, objDsp.set, vecInd,
+                                     varNumRep=2, varTmeSttl=0.01)
+
+    aryPrm = funcFitRgb(vecInd, aryDep)
+    print('Fitted parameters (red, green, blue):')
+    print(np.around(aryPrm, 1))
+    print('True parameters:')
+    print(np.around(aryPrmTrue, 1))
+
+    # Grey pixels: sum of channels equals the grey luminance function:
+    vecTmp = np.repeat(vecInd[:, None], 3, axis=1)
+    print('Maximum deviation of grey from channel sum: '
+          + str(np.around(np.max(np.abs(funcLumRgb(vecTmp, aryPrmTrue)
+                                        - np.polyval(vecPrmGry, vecInd))),
+                          6)) + ' cd/m^2')
+
+    # Convert an image of target luminances (per channel) to pixel values:
+    aryLut, vecLo, vecHi = funcLutLoadRgb(aryPrm)
+    objRng = np.random.default_rng(0)
+    aryImg = objRng.uniform(0.0, 1.0, size=(1200, 1920, 3)) * (vecHi - vecLo)
+    aryImg += vecLo
+    varTme = time.perf_counter()
+    aryPix = funcLutApplyRgb(aryImg, aryLut, vecLo, vecHi,
+                             out=np.empty(aryImg.shape, dtype=np.float32))
+    varTme = time.perf_counter() - varTme
+    aryCd = np.stack([funcLum(aryPix[..., idxChn], aryPrm[idxChn],
+                              dtype=np.float64)
+                      for idxChn in range(len(tplChn))], axis=-1)
+    print('1920 x 1200 RGB image converted in '
+          + str(np.around(varTme * 1000.0, 1)) + ' ms, maximum error '
+          + str(np.around(np.max(np.abs(aryCd - aryImg)), 4)) + ' cd/m^2')
+# *****************************************************************************
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+"""
+Spatial non-uniformity of the display, and correction gain maps.
+
+Luminance is measured at a grid of screen positions, by stepping a patch
+across the screen (grid mode of psychopy_measure_luminance.py). A 2D
+polynomial surface is fitted to the luminance map, and evaluated at display
+resolution to obtain a gain map (float32, height x width): the ratio of a
+reference luminance (by default the centre of the screen, where the
+calibration is measured) to the luminance at each pixel.
+
+With the centre as reference, luminance at the centre is unchanged, and gains
+are above one where the screen is dimmer. Bright values can therefore be out
+of the range of the display towards the edges; the highest luminance that
+can be reached everywhere is the maximum luminance of the calibration divided
+by the maximum gain (see `funcGainCdMax`). A reference at the dimmest point
+('min') avoids this, but scales all luminance down (by the ratio of the
+dimmest point to the centre).
+
+Non-uniformity (vignetting, mirror and projection optics) is assumed to be
+multiplicative, i.e. the same relative map at all intensities. The gain map
+therefore applies to linear luminance: frames of luminance values are
+corrected with one multiply (broadcasting over frames and colour channels),
+and then converted to pixel intensities (see gamma_correct.py).
+
+Measurement files (csv) have one row per grid position: x and y [pix,
+psychopy 'pix' units, origin at the centre of the screen], and the luminance
+[cd/m^2] of each repetition.
+
+Simulated display with vignetting:
+
+    python uniformity.py
+"""
+
+# Copyright (C) 2018  Ingo Marquardt & Marian Schneider
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Load modules
+
+import os
+import tempfile
+import numpy as np
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Parameters
+
+# Number of grid positions (horizontal, vertical):
+tplGrdDef = (5, 5)
+
+# Degree of the surface (total degree of x and y):
+varDegDef = 2
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Functions
+
+def funcGridPos(varPixW, varPixH, tplGrd=tplGrdDef):
+    """
+    Patch size and centres of grid positions.
+
+    The screen is divided into equal cells; the patch fills one cell.
+
+    Parameters
+    ----------
+    varPixW, varPixH : float
+        Display resolution [pix].
+    tplGrd : tuple
+        Number of positions, horizontal and vertical.
+
+    Returns
+    -------
+    aryPos : np.ndarray
+        Centres of the positions [pix, origin at the centre of the screen,
+        y up], positions x 2, row by row from the top left.
+    tplSze : tuple
+        Width and height of the patch [pix].
+    """
+    varNumX, varNumY = tplGrd
+    varSzeX = float(varPixW) / varNumX
+    varSzeY = float(varPixH) / varNumY
+    vecX = (np.arange(varNumX) + 0.5) * varSzeX - 0.5 * varPixW
+    vecY = 0.5 * varPixH - (np.arange(varNumY) + 0.5) * varSzeY
+    aryX, aryY = np.meshgrid(vecX, vecY)
+    return (np.stack([aryX.ravel(), aryY.ravel()], axis=1),
+            (varSzeX, varSzeY))
+
+
+def funcGridTextStates(aryPos):
+    """Info text of all grid positions (position and step number)."""
+    varNumPos = aryPos.shape[0]
+    return [('Position: ' + str(np.around(aryPos[idxPos], 1)) + '\n'
+             + 'Step %s out of %s' % ((idxPos + 1), varNumPos))
+            for idxPos in range(varNumPos)]
+
+
+def funcWriteGrid(strPathCsv, aryPos, aryCd):
+    """
+    Write grid measurement (csv, atomically).
+
+    Parameters
+    ----------
+    strPathCsv : str
+        Measurement file.
+    aryPos : np.ndarray
+        Grid positions [pix], positions x 2.
+    aryCd : np.ndarray
+        Luminance [cd/m^2], positions, or positions x repetitions (NaN for
+        positions not yet measured, e.g. a template to be filled in).
+    """
+    aryCd = np.asarray(aryCd, dtype=np.float64).reshape(aryPos.shape[0], -1)
+    strHdr = ','.join(['x', 'y'] + ['cd_' + str(idxRep + 1)
+                                    for idxRep in range(aryCd.shape[1])])
+    strDir = os.path.dirname(os.path.abspath(strPathCsv))
+    varFd, strPathTmp = tempfile.mkstemp(dir=strDir, suffix='.tmp')
+    try:
+        with os.fdopen(varFd, 'w') as objFle:
+            np.savetxt(objFle, np.hstack([aryPos, aryCd]), fmt='%.6g',
+                       delimiter=',', header=strHdr, comments='')
+        os.replace(strPathTmp, strPathCsv)
+    except BaseException:
+        os.remove(strPathTmp)
+        raise
+
+
+def funcReadGrid(strPathCsv):
+    """
+    Read grid measurement.
+
+    Returns
+    -------
+    aryPos : np.ndarray
+        Grid positions [pix], positions x 2.
+    vecCd : np.ndarray
+        Luminance [cd/m^2], mean over repetitions (NaN for positions without
+        measurement).
+    """
+    aryTmp = np.atleast_2d(np.genfromtxt(strPathCsv, delimiter=',',
+                                         skip_header=1))
+    if aryTmp.shape[1] < 3:
+        raise ValueError('Grid measurement needs columns x, y, and luminance: '
+                         + strPathCsv)
+    aryCd = aryTmp[:, 2:]
+    lgcAny = np.any(~np.isnan(aryCd), axis=1)
+    vecCd = np.full(aryTmp.shape[0], np.nan)
+    vecCd[lgcAny] = np.nanmean(aryCd[lgcAny], axis=1)
+    return aryTmp[:, :2], vecCd
+
+
+def funcSurfTerms(varDeg):
+    """Exponents of x and y of all terms up to a total degree."""
+    return [(idxX, idxY) for idxY in range(varDeg + 1)
+            for idxX in range(varDeg + 1 - idxY)]
+
+
+def funcSurfFit(aryPos, vecCd, varPixW, varPixH, varDeg=varDegDef):
+    """
+    Fit a 2D polynomial surface to a luminance map.
+
+    Parameters
+    ----------
+    aryPos : np.ndarray
+        Grid positions [pix], positions x 2.
+    vecCd : np.ndarray
+        Luminance [cd/m^2] at the grid positions (NaN values are ignored).
+    varPixW, varPixH : float
+        Display resolution [pix]; coordinates are normalised to -1 to 1.
+    varDeg : int
+        Total degree of the surface.
+
+    Returns
+    -------
+    dicSrf : dict
+        'deg': degree; 'coef': coefficients, (degree + 1) x (degree + 1),
+        indexed by exponent of y and x (zero for terms above the degree);
+        'size': display resolution; 'rss', 'r2': residual sum of squares
+        and coefficient of determination; 'obs': number of positions.
+    """
+    vecCd = np.asarray(vecCd, dtype=np.float64)
+    lgcVld = ~np.isnan(vecCd)
+    lstTrm = funcSurfTerms(varDeg)
+    if np.sum(lgcVld) < len(lstTrm):
+        raise ValueError('Surface of degree ' + str(varDeg) + ' needs at '
+                         + 'least ' + str(len(lstTrm)) + ' positions')
+
+    vecX = aryPos[lgcVld, 0] / (0.5 * varPixW)
+    vecY = aryPos[lgcVld, 1] / (0.5 * varPixH)
+    vecCd = vecCd[lgcVld]
+    aryDsg = np.stack([np.power(vecX, idxX) * np.power(vecY, idxY)
+                       for idxX, idxY in lstTrm], axis=1)
+    vecCoef = np.linalg.lstsq(aryDsg, vecCd, rcond=None)[0]
+
+    aryCoef = np.zeros((varDeg + 1, varDeg + 1))
+    for (idxX, idxY), varCoef in zip(lstTrm, vecCoef):
+        aryCoef[idxY, idxX] = varCoef
+
+    varRss = float(np.sum(np.square(vecCd - np.dot(aryDsg, vecCoef))))
+    varTss = float(np.sum(np.square(vecCd - np.mean(vecCd))))
+    return {'deg': varDeg,
+            'coef': aryCoef,
+            'size': (float(varPixW), float(varPixH)),
+            'rss': varRss,
+            'r2': (1.0 - varRss / varTss) if varTss > 0.0 else 1.0,
+            'obs': int(vecCd.size)}
+
+
+def funcSurfEval(dicSrf, vecX, vecY):
+    """
+    Evaluate surface on a grid.
+
+    Parameters
+    ----------
+    dicSrf : dict
+        Surface (see `funcSurfFit`).
+    vecX, vecY : np.ndarray
+        Horizontal and vertical coordinates [pix].
+
+    Returns
+    -------
+    aryCd : np.ndarray
+        Luminance [cd/m^2], y x x. The surface is separable into powers of
+        x and y, so the whole grid is two matrix products.
+    """
+    varPixW, varPixH = dicSrf['size']
+    varDeg = dicSrf['deg']
+    aryVndX = np.vander(np.asarray(vecX, dtype=np.float64) / (0.5 * varPixW),
+                        N=(varDeg + 1), increasing=True)
+    aryVndY = np.vander(np.asarray(vecY, dtype=np.float64) / (0.5 * varPixH),
+                        N=(varDeg + 1), increasing=True)
+    return np.dot(np.dot(aryVndY, dicSrf['coef']), aryVndX.T)
+
+
+def funcGainMap(dicSrf, strRef='centre', dtype=np.float32):
+    """
+    Gain map at display resolution.
+
+    Parameters
+    ----------
+    dicSrf : dict
+        Surface (see `funcSurfFit`).
+    strRef : str
+        Reference luminance: 'centre' (luminance at the centre unchanged,
+        gains above one where the screen is dimmer), 'min' (dimmest point of
+        the screen, all gains at most one, so that the corrected luminance
+        can be reached everywhere, but all luminance is scaled down), or
+        'mean'.
+    dtype : np.dtype
+        Data type of gain map.
+
+    Returns
+    -------
+    aryGain : np.ndarray
+        Gain, height x width (rows from the top of the screen, as frames).
+    """
+    varPixW, varPixH = dicSrf['size']
+    # Pixel centres, rows from the top:
+    vecX = np.arange(int(varPixW)) + 0.5 - 0.5 * varPixW
+    vecY = 0.5 * varPixH - (np.arange(int(varPixH)) + 0.5)
+    aryCd = funcSurfEval(dicSrf, vecX, vecY)
+    if np.any(aryCd <= 0.0):
+        raise ValueError('Surface is not positive everywhere on the screen')
+
+    if strRef == 'min':
+        varRef = np.min(aryCd)
+    elif strRef == 'centre':
+        varRef = dicSrf['coef'][0, 0]
+    elif strRef == 'mean':
+        varRef = np.mean(aryCd)
+    else:
+        raise ValueError('Reference must be min, centre, or mean')
+
+    aryGain = np.divide(varRef, aryCd, out=aryCd)
+    return aryGain.astype(dtype, copy=False)
+
+
+def funcGainCdMax(aryGain, varCdHi):
+    """
+    Highest luminance that can be reached everywhere after gain correction.
+
+    Parameters
+    ----------
+    aryGain : np.ndarray
+        Gain map (see `funcGainMap`).
+    varCdHi : float
+        Maximum luminance of the display [cd/m^2] (see
+        `luminance.funcGamut`).
+
+    Returns
+    -------
+    varCdMax : float
+        Luminance [cd/m^2]; higher values are out of the range of the display
+        where the gain is highest.
+    """
+    return float(varCdHi) / float(np.max(aryGain))
+
+
+def funcApplyGain(aryFrm, aryGain, out=None):
+    """
+    Correct frames of linear luminance with a gain map.
+
+    Parameters
+    ----------
+    aryFrm : np.ndarray
+        Luminance, height x width, frames x height x width, or with a last
+        axis of colour channels (... x height x width x 3).
+    aryGain : np.ndarray
+        Gain, height x width (see `funcGainMap`).
+    out : np.ndarray, optional
+        Output array (may be `aryFrm`, for correction in place).
+
+    Returns
+    -------
+    aryOut : np.ndarray
+        Corrected luminance.
+    """
+    if aryFrm.shape[-2:] != aryGain.shape:
+        # Colour channels:
+        aryGain = aryGain[..., None]
+    return np.multiply(aryFrm, aryGain, out=out)
+
+
+def funcGainSave(strPathNpz, aryGain, dicSrf):
+    """Save gain map and surface (npz, atomically)."""
+    strDir = os.path.dirname(os.path.abspath(strPathNpz))
+    varFd, strPathTmp = tempfile.mkstemp(dir=strDir, suffix='.npz')
+    os.close(varFd)
+    try:
+        np.savez(strPathTmp, gain=aryGain, coef=dicSrf['coef'],
+                 deg=dicSrf['deg'], size=np.array(dicSrf['size']))
+        os.replace(strPathTmp, strPathNpz)
+    except BaseException:
+        os.remove(strPathTmp)
+        raise
+
+
+def funcGainLoad(strPathNpz):
+    """
+    Load gain map and surface.
+
+    Returns
+    -------
+    aryGain : np.ndarray
+        Gain, height x width.
+    dicSrf : dict
+        Surface ('deg', 'coef', 'size'; see `funcSurfFit`).
+    """
+    with np.load(strPathNpz) as objNpz:
+        return (objNpz['gain'],
+                {'deg': int(objNpz['deg']),
+                 'coef': objNpz['coef'],
+                 'size': tuple(float(varTmp) for varTmp in objNpz['size'])})
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Simulated display with vignetting
+
+if __name__ == '__main__':
+
+    import time
+
+    varPixW = 1920.0
+    varPixH = 1200.0
+
+    # Luminance of white, falling off towards the edges, brighter on the
+    # left (e.g. through the mirror):
+    def funcVgn(aryX, aryY):
+        return 450.0 * (1.0 - 0.15 * (np.square(aryX / varPixW * 2.0)
+                                      + np.square(aryY / varPixH * 2.0))
+                        - 0.05 * aryX / varPixW * 2.0)
+
+    aryPos, tplSze = funcGridPos(varPixW, varPixH, tplGrd=(7, 5))
+    objRng = np.random.default_rng(0)
+    vecCd = (funcVgn(aryPos[:, 0], aryPos[:, 1])
+             * (1.0 + objRng.normal(0.0, 0.005, size=aryPos.shape[0])))
+
+    dicSrf = funcSurfFit(aryPos, vecCd, varPixW, varPixH)
+    varTme = time.perf_counter()
+    aryGain = funcGainMap(dicSrf)
+    varTme = time.perf_counter() - varTme
+    print('Surface of degree ' + str(dicSrf['deg']) + ', R2 = '
+          + str(np.around(dicSrf['r2'], 4)) + ', gain map '
+          + str(aryGain.shape[1]) + ' x ' + str(aryGain.shape[0]) + ' in '
+          + str(np.around(varTme * 1000.0, 1)) + ' ms')
+
+    # Luminance on the screen after correction of a uniform white frame:
+    vecX = np.arange(int(varPixW)) + 0.5 - 0.5 * varPixW
+    vecY = 0.5 * varPixH - (np.arange(int(varPixH)) + 0.5)
+    aryCdScr = funcVgn(vecX[None, :], vecY[:, None])
+    aryCdCor = aryCdScr * aryGain
+    print('Non-uniformity (max / min): '
+          + str(np.around(np.max(aryCdScr) / np.min(aryCdScr), 3))
+          + ' before, ' + str(np.around(np.max(aryCdCor) / np.min(aryCdCor),
+                                        3)) + ' after correction')
+    print('Highest luminance reachable everywhere: '
+          + str(np.around(funcGainCdMax(aryGain, funcVgn(0.0, 0.0)), 1))
+          + ' cd/m^2 (white at the centre: '
+          + str(np.around(funcVgn(0.0, 0.0), 1)) + ' cd/m^2)')
+
+    # Correction of a stack of frames, in place:
+    aryFrm = objRng.uniform(0.0, 400.0, size=(60, int(varPixH), int(varPixW)))
+    aryFrm = aryFrm.astype(np.float32)
+    varTme = time.perf_counter()
+    funcApplyGain(aryFrm, aryGain, out=aryFrm)
+    varTme = time.perf_counter() - varTme
+    print(str(aryFrm.shape[0]) + ' frames corrected in '
+          + str(np.around(varTme * 1000.0, 1)) + ' ms ('
+          + str(np.around(varTme * 1000.0 / aryFrm.shape[0], 2))
+          + ' ms per frame)')
+# *****************************************************************************